@@ -0,0 +1,237 @@
+"""
+Apache Parquet and Arrow IPC import and export.
+
+Uploads named ``*.parquet``, ``*.arrow``, ``*.feather`` or ``*.ipc`` are read
+record batch by record batch instead of through pandas.read_csv, and their
+column types come straight from the Arrow schema rather than from
+inference. Tables export to Parquet one row group at a time, so neither
+direction holds more than a batch in memory.
+
+pyarrow is an optional dependency (``pip install csv-to-sql[parquet]``);
+without it these formats are rejected with a clear message and CSV keeps
+working.
+"""
+
+import io
+import logging
+from pathlib import Path
+
+from django.conf import settings
+
+from csv_upload.typed_tables import coerce_value, display_value
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - depends on the environment
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_CSV = 'csv'
+FORMAT_PARQUET = 'parquet'
+FORMAT_ARROW = 'arrow'
+SOURCE_FORMATS = {
+    '.csv': FORMAT_CSV,
+    '.parquet': FORMAT_PARQUET,
+    '.arrow': FORMAT_ARROW,
+    '.feather': FORMAT_ARROW,
+    '.ipc': FORMAT_ARROW,
+}
+
+DEFAULT_ROW_GROUP_SIZE = 50000
+# Python objects in a DataFrame take several times the bytes of the Arrow columns
+PYTHON_OBJECT_OVERHEAD = 8
+
+
+def source_format(filename):
+    """Upload format for a file name, or None if it is not supported"""
+    return SOURCE_FORMATS.get(Path(str(filename)).suffix.lower())
+
+
+def pyarrow_available():
+    return pa is not None
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ValueError('Parquet and Arrow files need the pyarrow package (pip install csv-to-sql[parquet]).')
+
+
+def arrow_data_type(arrow_type):
+    """Column data type for an Arrow type"""
+    types = pa.types
+    if types.is_dictionary(arrow_type):
+        return arrow_data_type(arrow_type.value_type)
+    if types.is_boolean(arrow_type):
+        return 'BOOLEAN'
+    if types.is_integer(arrow_type):
+        return 'INTEGER'
+    if types.is_floating(arrow_type) or types.is_decimal(arrow_type):
+        return 'REAL'
+    if types.is_date(arrow_type):
+        return 'DATE'
+    if types.is_timestamp(arrow_type):
+        return 'DATETIME'
+    if types.is_binary(arrow_type) or types.is_large_binary(arrow_type) or types.is_fixed_size_binary(arrow_type):
+        return 'BLOB'
+    return 'TEXT'
+
+
+def arrow_type(data_type):
+    """Arrow type a column of data_type is exported as"""
+    return {
+        'INTEGER': pa.int64(),
+        'REAL': pa.float64(),
+        'BOOLEAN': pa.bool_(),
+        'DATE': pa.date32(),
+        'DATETIME': pa.timestamp('us'),
+        'BLOB': pa.binary(),
+    }.get(data_type, pa.string())
+
+
+def schema_columns(schema):
+    """(name, data_type, nullable, source type) for each field of an Arrow schema"""
+    return [
+        (field.name, arrow_data_type(field.type), field.nullable, str(field.type))
+        for field in schema
+    ]
+
+
+def _open_ipc(source):
+    """Reader for the Arrow IPC file (Feather v2) format, or the streaming format"""
+    try:
+        return pa.ipc.open_file(source)
+    except pa.ArrowInvalid:
+        source.seek(0)
+        return pa.ipc.open_stream(source)
+
+
+def _rows_for_budget(nbytes, num_rows, memory_budget):
+    """Rows per batch so the pandas form of the batch fits memory_budget"""
+    if not num_rows or not nbytes:
+        return DEFAULT_ROW_GROUP_SIZE
+    return max(1, int(memory_budget / (nbytes / num_rows * PYTHON_OBJECT_OVERHEAD)))
+
+
+def _sliced(batches, memory_budget):
+    for batch in batches:
+        rows = _rows_for_budget(batch.nbytes, batch.num_rows, memory_budget)
+        for offset in range(0, batch.num_rows, rows):
+            yield batch.slice(offset, rows)
+
+
+def read_batches(source, fmt, memory_budget):
+    """(schema, iterator of RecordBatches) for a Parquet or Arrow IPC source
+
+    Batches are sized so that each one, converted to pandas, stays within
+    memory_budget.
+    """
+    require_pyarrow()
+    if fmt == FORMAT_PARQUET:
+        parquet_file = pq.ParquetFile(source)
+        metadata = parquet_file.metadata
+        nbytes = sum(metadata.row_group(index).total_byte_size for index in range(metadata.num_row_groups))
+        batch_rows = _rows_for_budget(nbytes, metadata.num_rows, memory_budget)
+        return parquet_file.schema_arrow, parquet_file.iter_batches(batch_size=batch_rows)
+    reader = _open_ipc(source)
+    if isinstance(reader, pa.ipc.RecordBatchFileReader):
+        batches = (reader.get_batch(index) for index in range(reader.num_record_batches))
+    else:
+        batches = iter(reader)
+    # IPC batches are whatever size the writer chose; split the large ones
+    return reader.schema, _sliced(batches, memory_budget)
+
+
+def empty_batch(schema):
+    return pa.RecordBatch.from_pylist([], schema=schema)
+
+
+def batch_frame(batch):
+    """A RecordBatch as a DataFrame of plain Python values (ints keep no .0)"""
+    frame = batch.to_pandas(integer_object_nulls=True, date_as_object=True)
+    for column, field in zip(frame.columns, batch.schema):
+        if pa.types.is_binary(field.type) or pa.types.is_large_binary(field.type):
+            frame[column] = frame[column].map(display_value, na_action='ignore')
+        elif pa.types.is_timestamp(field.type) and field.type.tz is not None:
+            frame[column] = frame[column].dt.tz_convert('UTC').dt.tz_localize(None)
+    return frame
+
+
+def _export_value(value, data_type):
+    """(value for the Arrow column, True if it did not fit the column type)"""
+    try:
+        return coerce_value(value, data_type), False
+    except (TypeError, ValueError):
+        return None, True
+
+
+class _ByteSink(io.RawIOBase):
+    """Writable file that collects bytes until the caller takes them"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_parquet(table_query, row_data_iterator):
+    """Parquet file bytes, written one row group at a time
+
+    Values that do not fit their configured column type (possible after a
+    JSON table's column was reconfigured) are written as nulls and logged.
+    """
+    require_pyarrow()
+    csv_upload = table_query.csv_upload
+    columns = csv_upload.get_column_names()
+    types = [csv_upload.get_column_properties(name).get('data_type', 'TEXT') for name in columns]
+    schema = pa.schema([pa.field(name, arrow_type(data_type)) for name, data_type in zip(columns, types)])
+    row_group_size = getattr(settings, 'CSV_EXPORT_ROW_GROUP_SIZE', DEFAULT_ROW_GROUP_SIZE)
+
+    sink = _ByteSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    unfit = 0
+
+    def row_group(rows):
+        nonlocal unfit
+        arrays = []
+        for name, data_type, field in zip(columns, types, schema):
+            values = []
+            for row_data in rows:
+                value, dropped = _export_value(row_data.get(name), data_type)
+                unfit += dropped
+                values.append(value)
+            arrays.append(pa.array(values, type=field.type))
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+    rows = []
+    for row_data in row_data_iterator:
+        rows.append(row_data)
+        if len(rows) >= row_group_size:
+            writer.write_table(row_group(rows))
+            rows = []
+            yield sink.take()
+    if rows:
+        writer.write_table(row_group(rows))
+    writer.close()
+    yield sink.take()
+    if unfit:
+        logger.warning('Parquet export of "%s" wrote %d value(s) that did not fit their column type as null',
+                       csv_upload.table_name, unfit)
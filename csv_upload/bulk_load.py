@@ -0,0 +1,204 @@
+"""
+Bulk loading of CSV rows into CSVData.
+
+On PostgreSQL the rows are streamed through a single ``COPY ... FROM STDIN``
+statement. Every other backend falls back to batched ``bulk_create`` calls.
+"""
+
+import csv
+import io
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from csv_upload.models import CSVData
+from csv_upload.search import build_search_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 5000
+COPY_READ_SIZE = 1024 * 1024
+
+
+class LoadStats:
+    """Row count and timing of a finished bulk load"""
+
+    def __init__(self, rows=0, elapsed=0.0, method=''):
+        self.rows = rows
+        self.elapsed = elapsed
+        self.method = method
+
+    @property
+    def rows_per_second(self):
+        if self.elapsed <= 0:
+            return float(self.rows)
+        return self.rows / self.elapsed
+
+    def __str__(self):
+        return f"{self.rows} rows in {self.elapsed:.2f}s ({self.rows_per_second:,.0f} rows/s via {self.method})"
+
+
+class _CopyStream:
+    """File-like wrapper that feeds COPY from an iterator of text chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._current = ''
+        self._offset = 0
+
+    def read(self, size=-1):
+        parts = []
+        wanted = size
+        while wanted != 0:
+            if self._offset >= len(self._current):
+                try:
+                    self._current = next(self._chunks)
+                except StopIteration:
+                    break
+                self._offset = 0
+                continue
+            end = len(self._current) if wanted < 0 else self._offset + wanted
+            part = self._current[self._offset:end]
+            self._offset += len(part)
+            parts.append(part)
+            if wanted > 0:
+                wanted -= len(part)
+        return ''.join(parts)
+
+
+class BulkLoader:
+    """Load ``(row_number, row_dict)`` pairs into CSVData for one upload"""
+
+    def __init__(self, csv_upload, batch_size=None, using='default', table=None):
+        self.csv_upload = csv_upload
+        self.batch_size = batch_size or getattr(settings, 'CSV_INGEST_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        self.using = using
+        self.table = table  # Target instead of CSVData's table, e.g. a staging partition or merge staging table
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def supports_copy(self):
+        """COPY is only used on PostgreSQL connections"""
+        return self.connection.vendor == 'postgresql'
+
+    def load(self, rows):
+        """Load all rows inside one transaction and return LoadStats"""
+        started = time.perf_counter()
+        with transaction.atomic(using=self.using):
+            if self.supports_copy():
+                count = self._copy(rows)
+                method = 'COPY'
+            else:
+                count = self._bulk_create(rows)
+                method = 'bulk_create'
+        stats = LoadStats(count, time.perf_counter() - started, method)
+        logger.info('Loaded table "%s": %s', self.csv_upload.table_name, stats)
+        return stats
+
+    def copy_table(self):
+        """Quoted target table for COPY"""
+        return self.connection.ops.quote_name(self.table or CSVData._meta.db_table)
+
+    def copy_columns(self):
+        """Target columns for COPY, in the order copy_values() returns them"""
+        return [CSVData._meta.get_field('csv_upload').column, 'row_number', 'row_data', 'search_text']
+
+    def copy_not_null_columns(self):
+        """COPY columns whose empty fields are empty strings rather than NULL"""
+        # A row whose cells are all empty still has search_text ''
+        return ['search_text']
+
+    def copy_values(self, row_number, row_dict):
+        """One COPY record for a row"""
+        return [
+            self.csv_upload.pk, row_number, json.dumps(self.csv_upload.encode_row(row_dict)), build_search_text(row_dict)
+        ]
+
+    def _copy(self, rows):
+        """Stream rows through COPY ... FROM STDIN in CSV format"""
+        quote = self.connection.ops.quote_name
+        columns = ', '.join(quote(column) for column in self.copy_columns())
+        options = 'FORMAT csv'
+        not_null = self.copy_not_null_columns()
+        if not_null:
+            options += f", FORCE_NOT_NULL ({', '.join(quote(column) for column in not_null)})"
+        sql = f"COPY {self.copy_table()} ({columns}) FROM STDIN WITH ({options})"
+        counter = {'rows': 0}
+
+        def chunks():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator='\n')
+            pending = 0
+            for row_number, row_dict in rows:
+                writer.writerow(self.copy_values(row_number, row_dict))
+                pending += 1
+                if pending >= self.batch_size:
+                    counter['rows'] += pending
+                    pending = 0
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            counter['rows'] += pending
+            yield buffer.getvalue()
+
+        with self.connection.cursor() as cursor:
+            raw_cursor = cursor.cursor
+            if hasattr(raw_cursor, 'copy_expert'):
+                # psycopg2
+                raw_cursor.copy_expert(sql, _CopyStream(chunks()), size=COPY_READ_SIZE)
+            else:
+                # psycopg 3
+                with raw_cursor.copy(sql) as copy:
+                    for chunk in chunks():
+                        copy.write(chunk)
+
+        return counter['rows']
+
+    def _bulk_create(self, rows):
+        """Insert rows with bulk_create in batch_size slices"""
+        if self.table:
+            return self._insert_many(rows)
+        count = 0
+        batch = []
+        for row_number, row_dict in rows:
+            batch.append(CSVData(
+                csv_upload=self.csv_upload,
+                row_number=row_number,
+                row_data=self.csv_upload.encode_row(row_dict),
+                search_text=build_search_text(row_dict),
+            ))
+            if len(batch) >= self.batch_size:
+                CSVData.objects.using(self.using).bulk_create(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            CSVData.objects.using(self.using).bulk_create(batch)
+            count += len(batch)
+        return count
+
+    def _insert_many(self, rows):
+        """Insert COPY records into self.table with executemany in batch_size slices"""
+        quote = self.connection.ops.quote_name
+        columns = self.copy_columns()
+        sql = (
+            f"INSERT INTO {self.copy_table()} ({', '.join(quote(column) for column in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))})"
+        )
+        count = 0
+        batch = []
+        with self.connection.cursor() as cursor:
+            for row_number, row_dict in rows:
+                batch.append(self.copy_values(row_number, row_dict))
+                if len(batch) >= self.batch_size:
+                    cursor.executemany(sql, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(sql, batch)
+                count += len(batch)
+        return count
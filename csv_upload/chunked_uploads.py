@@ -0,0 +1,214 @@
+"""
+Resumable chunked uploads.
+
+A client opens an UploadSession (``POST api/upload/``), PUTs the file in
+chunks at byte offsets (``PUT api/upload/<id>/chunk/?offset=N``) with each
+chunk's SHA-256 in the ``X-Chunk-SHA256`` header, and finalizes it
+(``POST api/upload/<id>/finalize/``). Opening a session is a normal
+CSRF-protected request; it answers with an ``upload_token`` that every
+later request of the session sends in the ``X-Upload-Token`` header instead,
+so scripted clients can resume without a browser session. Chunk bodies are streamed from the
+request straight into a file in CSV_INGEST_SPOOL_DIR, so Django's upload
+handlers never buffer them. ``received_bytes`` only advances past a chunk
+whose checksum matched and was flushed to disk; after a dropped connection
+the client reads it back (``GET api/upload/<id>/``) and resumes there.
+Finalize queues the spool file itself as the IngestJob source, so the file is
+never copied. Sessions without a chunk for CSV_UPLOAD_SESSION_EXPIRY seconds
+are purged by the ingest worker.
+"""
+
+import hashlib
+import logging
+import os
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from csv_upload.jobs import enqueue_spooled, get_spool_dir
+from csv_upload.models import CSVUpload, IngestJob, UploadSession
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_SESSION_EXPIRY = 24 * 60 * 60
+# Bytes read from the request per write to the spool file
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class ChunkRejected(ValueError):
+    """A chunk or finalize request that was refused; ``status`` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def chunk_size():
+    """Chunk size suggested to clients"""
+    return getattr(settings, 'CSV_UPLOAD_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def max_chunk_size():
+    """Largest chunk accepted by one PUT"""
+    return getattr(settings, 'CSV_UPLOAD_MAX_CHUNK_SIZE', DEFAULT_MAX_CHUNK_SIZE)
+
+
+def start_upload(filename, table_name, total_bytes, storage_engine=None, mode=IngestJob.MODE_CREATE):
+    """Open a session with an empty spool file for the chunks"""
+    # Keep the extension; it tells the pipeline how to read the file
+    suffix = Path(filename).suffix.lower() or '.csv'
+    path = get_spool_dir() / f"{uuid.uuid4().hex}{suffix}"
+    path.touch()
+    return UploadSession.objects.create(
+        table_name=table_name,
+        mode=mode,
+        filename=filename,
+        storage_engine=storage_engine or getattr(settings, 'CSV_STORAGE_ENGINE', CSVUpload.STORAGE_JSON),
+        spool_path=str(path),
+        total_bytes=total_bytes,
+    )
+
+
+def write_chunk(upload_id, offset, stream, length, checksum):
+    """Stream one chunk from ``stream`` into the spool file at ``offset``
+
+    Returns the session. A chunk that arrived already (a retry after a lost
+    response) is accepted without being written again.
+    """
+    if not checksum:
+        raise ChunkRejected('The X-Chunk-SHA256 header is required')
+    if length > max_chunk_size():
+        raise ChunkRejected(f'Chunks are limited to {max_chunk_size()} bytes', status=413)
+
+    # The row lock serialises writers of the same session for the length of the chunk
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=upload_id)
+        if session.status != UploadSession.STATUS_OPEN:
+            raise ChunkRejected('The upload was finalized already', status=409)
+        if offset + length <= session.received_bytes:
+            return session
+        if offset != session.received_bytes:
+            raise ChunkRejected(f'Expected a chunk at offset {session.received_bytes}', status=409)
+        if offset + length > session.total_bytes:
+            raise ChunkRejected(f'The chunk ends past the declared size of {session.total_bytes} bytes')
+
+        digest = hashlib.sha256()
+        remaining = length
+        with open(session.spool_path, 'r+b') as spool:
+            spool.seek(offset)
+            while remaining:
+                piece = stream.read(min(COPY_BUFFER_SIZE, remaining))
+                if not piece:
+                    break
+                digest.update(piece)
+                spool.write(piece)
+                remaining -= len(piece)
+            if remaining:
+                raise ChunkRejected(f'The chunk body ended {remaining} bytes short of Content-Length')
+            if digest.hexdigest() != checksum.strip().lower():
+                # Bytes past received_bytes are simply overwritten by the retry
+                raise ChunkRejected('Chunk checksum mismatch')
+            spool.flush()
+            os.fsync(spool.fileno())
+
+        session.received_bytes = offset + length
+        session.save(update_fields=['received_bytes', 'updated_at'])
+    return session
+
+
+def file_sha256(path):
+    """SHA-256 of a whole spool file, read in buffer-sized pieces"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for piece in iter(lambda: source.read(COPY_BUFFER_SIZE), b''):
+            digest.update(piece)
+    return digest.hexdigest()
+
+
+def finalize_upload(upload_id, checksum=None, enqueue=True):
+    """Close a complete session and, with ``enqueue``, queue its spool file for ingest
+
+    The file's SHA-256 is stored for dedup.py and, with ``checksum``,
+    verified against the client's. Without ``enqueue`` the caller loads the
+    spool file itself and removes it.
+    """
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=upload_id)
+        if session.status != UploadSession.STATUS_OPEN:
+            raise ChunkRejected('The upload was finalized already', status=409)
+        if not session.is_complete():
+            raise ChunkRejected(
+                f'{session.received_bytes} of {session.total_bytes} bytes received', status=409
+            )
+        # Refuses further chunks and finalize calls while the file is hashed
+        session.status = UploadSession.STATUS_FINALIZING
+        session.save(update_fields=['status', 'updated_at'])
+
+    # hashlib cannot carry a digest from one chunk request to the next, so the whole-file
+    # hash takes one read of the file, with no transaction or row lock held
+    try:
+        content_hash = file_sha256(session.spool_path)
+        if checksum and content_hash != checksum.strip().lower():
+            raise ChunkRejected('File checksum mismatch')
+    except BaseException:
+        # Open again, so the client can cancel the upload or finalize it once more
+        UploadSession.objects.filter(pk=upload_id).update(status=UploadSession.STATUS_OPEN)
+        raise
+
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=upload_id)
+        session.content_hash = content_hash
+        if enqueue:
+            session.ingest_job = enqueue_spooled(
+                session.spool_path, session.filename, session.table_name, session.storage_engine,
+                session.content_hash, session.mode
+            )
+        session.status = UploadSession.STATUS_FINALIZED
+        session.save(update_fields=['status', 'ingest_job', 'content_hash', 'updated_at'])
+    return session
+
+
+def abort_upload(session):
+    """Delete an open session and its partial spool file"""
+    try:
+        os.remove(session.spool_path)
+    except OSError:
+        pass
+    session.delete()
+
+
+def purge_expired_uploads(expire_after=None):
+    """Drop sessions idle for longer than CSV_UPLOAD_SESSION_EXPIRY seconds; returns how many"""
+    if expire_after is None:
+        expire_after = getattr(settings, 'CSV_UPLOAD_SESSION_EXPIRY', DEFAULT_SESSION_EXPIRY)
+    expired = UploadSession.objects.filter(updated_at__lt=timezone.now() - timedelta(seconds=expire_after))
+    count = 0
+    for session in expired:
+        if session.status != UploadSession.STATUS_FINALIZED:
+            logger.info('Purging abandoned upload %s (%s of %s bytes)', session.pk, session.received_bytes, session.total_bytes)
+            abort_upload(session)
+        else:
+            # The ingest job owns the spool file of a finalized session
+            session.delete()
+        count += 1
+    return count
+
+
+def upload_progress(session):
+    """JSON-serialisable state of a session for the upload API"""
+    return {
+        'upload_id': str(session.pk),
+        'status': session.status,
+        'table_name': session.table_name,
+        'mode': session.mode,
+        'filename': session.filename,
+        'received_bytes': session.received_bytes,
+        'total_bytes': session.total_bytes,
+        'chunk_size': chunk_size(),
+        'job_id': session.ingest_job_id,
+    }
@@ -0,0 +1,101 @@
+"""
+Content-hash deduplication of repeated uploads.
+
+Every upload is hashed (SHA-256) as it arrives: by the upload handlers for
+form uploads, or at finalize for chunked uploads. The hash is stored on
+CSVUpload.content_hash. When a byte-identical file is uploaded again, the
+new table is created by copying the existing table's rows inside the database
+(``INSERT ... SELECT``) instead of parsing the file again. Column properties,
+profiles and summary counters are copied along.
+
+A table only stays a copy source while it matches its file:
+``bump_data_version()`` clears the hash when rows or columns change. Only
+tables with the same storage engine are used, because the two engines store
+values differently.
+"""
+
+import time
+
+from django.db import connection, transaction
+
+from csv_upload.bulk_load import LoadStats
+from csv_upload.models import CSVData, CSVUpload
+from csv_upload.partitions import attach_partition, create_staging_partition, uses_partitions
+from csv_upload.typed_tables import ROW_ID, ROW_NUMBER, SEARCH_TEXT, create_typed_table, physical_table_name
+
+
+def find_duplicate(content_hash, storage_engine):
+    """Oldest table loaded from a file with this hash, or None"""
+    if not content_hash:
+        return None
+    return (
+        CSVUpload.objects.ready()
+        .filter(content_hash=content_hash, storage_engine=storage_engine)
+        .order_by('id')
+        .first()
+    )
+
+
+def copy_rows(source, target):
+    """Copy every row of source into the (empty) storage of target"""
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        if source.uses_typed_table():
+            columns = ', '.join(quote(name) for name in [ROW_ID, ROW_NUMBER, SEARCH_TEXT, *source.get_column_names()])
+            table = physical_table_name(target)
+            cursor.execute(
+                f"INSERT INTO {quote(table)} ({columns}) "
+                f"SELECT {columns} FROM {quote(physical_table_name(source))}"
+            )
+            rows = cursor.rowcount
+            if connection.vendor == 'postgresql':
+                # Explicit _row_id values do not advance the BIGSERIAL sequence
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, %s), COALESCE(MAX({quote(ROW_ID)}), 0) + 1, false) "
+                    f"FROM {quote(table)}",
+                    [quote(table), ROW_ID]
+                )
+            return rows
+
+        upload_column = CSVData._meta.get_field('csv_upload').column
+        columns = ', '.join(quote(name) for name in ['row_data', 'row_number', 'search_text'])
+        # PostgreSQL: fill the standalone partition table, attached by the caller
+        table = create_staging_partition(target) or CSVData._meta.db_table
+        cursor.execute(
+            f"INSERT INTO {quote(table)} ({quote(upload_column)}, {columns}) "
+            f"SELECT %s, {columns} FROM {quote(CSVData._meta.db_table)} WHERE {quote(upload_column)} = %s",
+            [target.pk, source.pk]
+        )
+        return cursor.rowcount
+
+
+def copy_upload(source, table_name, filename):
+    """Create a table with the rows of source without parsing its file again
+
+    Returns (csv_upload, load_stats), or None if source stopped matching its
+    file before it could be locked.
+    """
+    started = time.perf_counter()
+    with transaction.atomic():
+        # Edits clear content_hash by updating this row, so while it is locked the source cannot change
+        source = CSVUpload.objects.select_for_update().filter(pk=source.pk, content_hash=source.content_hash).first()
+        if source is None:
+            return None
+        csv_upload = CSVUpload.objects.create(
+            filename=filename,
+            table_name=table_name,
+            storage_engine=source.storage_engine,
+            columns=source.columns,
+            column_stats=source.column_stats,
+            row_format=source.row_format,
+            row_count=source.row_count,
+            byte_size=source.byte_size,
+            column_count=source.column_count,
+            content_hash=source.content_hash,
+        )
+        if csv_upload.uses_typed_table():
+            create_typed_table(csv_upload)
+        rows = copy_rows(source, csv_upload)
+        if not csv_upload.uses_typed_table() and uses_partitions():
+            attach_partition(csv_upload)
+    return csv_upload, LoadStats(rows, time.perf_counter() - started, f'copy of "{source.table_name}"')
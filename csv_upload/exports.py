@@ -0,0 +1,160 @@
+"""
+Streaming table exports: CSV, NDJSON, a SQL script and Parquet.
+
+Rows come from a TableQuery, so an export has the same filter, filter
+expression and sort as the table view. They are read with a server-side
+cursor (``QuerySet.iterator(chunk_size=...)`` for JSON tables,
+``TypedRowQuery.iterator()`` for typed tables) and written out one chunk
+at a time by a StreamingHttpResponse, so memory stays flat however many
+rows the table has.
+"""
+
+import csv
+import json
+import math
+
+from django.conf import settings
+from django.db import connection
+
+from csv_upload.arrow_io import stream_parquet
+from csv_upload.models import CSVUpload
+from csv_upload.typed_tables import SQL_TYPES, coerce_value, create_table_sql, display_value, quote_literal
+
+DEFAULT_CHUNK_SIZE = 2000
+DEFAULT_INSERT_BATCH_SIZE = 500
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson; charset=utf-8', 'ndjson'),
+    'sql': ('application/sql; charset=utf-8', 'sql'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def chunk_size():
+    return getattr(settings, 'CSV_EXPORT_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def iter_row_data(table_query):
+    """Yield the row dict of every matching row, in the query's sort order"""
+    rows = table_query.rows()
+    if table_query.csv_upload.uses_typed_table():
+        for row in rows.iterator(chunk_size=chunk_size()):
+            yield row.get_row_data()
+        return
+    for row_data in rows.values_list('row_data', flat=True).iterator(chunk_size=chunk_size()):
+        yield table_query.csv_upload.decode_row(row_data)
+
+
+class _Echo:
+    """Write target for csv.writer that hands each line back to the caller"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(table_query):
+    """CSV lines with a header row"""
+    columns = table_query.csv_upload.get_column_names()
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row_data in iter_row_data(table_query):
+        yield writer.writerow(['' if row_data.get(name) is None else row_data.get(name) for name in columns])
+
+
+def json_value(value, data_type):
+    """A stored value as a native JSON value of its column type"""
+    if value is None or data_type not in ('INTEGER', 'REAL', 'BOOLEAN'):
+        return value
+    try:
+        coerced = coerce_value(value, data_type)
+    except (TypeError, ValueError):
+        # Values that no longer fit a reconfigured column are exported as stored
+        return value
+    if isinstance(coerced, float) and not math.isfinite(coerced):
+        return value
+    return coerced
+
+
+def stream_ndjson(table_query):
+    """One JSON object per row, numbers and booleans as native JSON values"""
+    csv_upload = table_query.csv_upload
+    types = {name: csv_upload.get_column_properties(name).get('data_type', 'TEXT') for name in csv_upload.get_column_names()}
+    for row_data in iter_row_data(table_query):
+        record = {name: json_value(row_data.get(name), data_type) for name, data_type in types.items()}
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def quote_identifier(name):
+    """Standard SQL double-quoted identifier"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def sql_literal(value, data_type):
+    """A stored value as a SQL literal of its column type"""
+    if value is None:
+        return 'NULL'
+    try:
+        coerced = coerce_value(value, data_type)
+    except (TypeError, ValueError):
+        return quote_literal(value)
+    if coerced is None:
+        return 'NULL'
+    if isinstance(coerced, bool):
+        return 'TRUE' if coerced else 'FALSE'
+    if isinstance(coerced, int):
+        return str(coerced)
+    if isinstance(coerced, float):
+        return repr(coerced) if math.isfinite(coerced) else quote_literal(coerced)
+    return quote_literal(display_value(coerced))
+
+
+def export_dialect(requested=None):
+    """SQL dialect for a dump: the requested one if known, else the database's own"""
+    if requested in SQL_TYPES:
+        return requested
+    return connection.vendor if connection.vendor in SQL_TYPES else 'postgresql'
+
+
+def _resolve_export_table(table_name):
+    """Foreign keys reference other tables by the name they are exported under"""
+    return table_name if CSVUpload.objects.ready().filter(table_name=table_name).exists() else None
+
+
+def stream_sql(table_query, dialect=None):
+    """CREATE TABLE from the column properties followed by multi-row INSERTs"""
+    csv_upload = table_query.csv_upload
+    dialect = export_dialect(dialect)
+    columns = csv_upload.get_columns()
+    types = {name: csv_upload.get_column_properties(name).get('data_type', 'TEXT') for name in columns}
+    table = quote_identifier(csv_upload.table_name)
+    batch_size = getattr(settings, 'CSV_EXPORT_INSERT_BATCH_SIZE', DEFAULT_INSERT_BATCH_SIZE)
+
+    yield f'-- Table "{csv_upload.table_name}" exported from {csv_upload.filename} ({dialect})\n'
+    yield 'BEGIN;\n\n'
+    yield create_table_sql(
+        csv_upload.table_name, {name: csv_upload.get_column_properties(name) for name in columns},
+        dialect, quote_identifier, _resolve_export_table, internal_columns=False
+    ) + ';\n\n'
+
+    insert = f"INSERT INTO {table} ({', '.join(quote_identifier(name) for name in columns)}) VALUES\n"
+    batch = []
+    for row_data in iter_row_data(table_query):
+        batch.append('(' + ', '.join(sql_literal(row_data.get(name), data_type) for name, data_type in types.items()) + ')')
+        if len(batch) >= batch_size:
+            yield insert + ',\n'.join(batch) + ';\n'
+            batch = []
+    if batch:
+        yield insert + ',\n'.join(batch) + ';\n'
+    yield '\nCOMMIT;\n'
+
+
+def export_stream(table_query, export_format, dialect=None):
+    """Chunks of the export in the requested format"""
+    if export_format == 'csv':
+        return stream_csv(table_query)
+    if export_format == 'ndjson':
+        return stream_ndjson(table_query)
+    if export_format == 'parquet':
+        return stream_parquet(table_query, iter_row_data(table_query))
+    return stream_sql(table_query, dialect)
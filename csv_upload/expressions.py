@@ -0,0 +1,148 @@
+"""
+Query expressions over CSVData.row_data.
+
+On PostgreSQL row_data is jsonb and these compile to jsonb operators; on
+SQLite they use the JSON1 equivalents. A key is a column name for object
+rows or an int position for array rows (see ``CSVUpload.row_key()``).
+"""
+
+import json
+import re
+
+from django.db.models import BooleanField, FloatField, Func, JSONField
+from django.db.models.fields.json import KeyTextTransform
+
+# Text that PostgreSQL can CAST to NUMERIC without raising
+NUMBER_PATTERN = r'^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$'
+
+
+def escape_like(text):
+    """Escape LIKE wildcards so text matches literally"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def escape_glob(text):
+    """Escape GLOB wildcards so text matches literally"""
+    return re.sub(r'([*?\[])', r'[\1]', text)
+
+
+def prefix_match_sql(sql, prefix, vendor):
+    """Case-sensitive prefix match of a text expression, as (sql, params)"""
+    if vendor == 'postgresql':
+        return f"{sql} LIKE %s ESCAPE '\\'", [escape_like(prefix) + '%']
+    # SQLite's LIKE ignores ASCII case; GLOB does not
+    return f"{sql} GLOB %s", [escape_glob(prefix) + '*']
+
+
+def json_path(key):
+    """SQLite JSON path selecting one top-level key or array position"""
+    if isinstance(key, int):
+        return f'$[{key}]'
+    return '$."' + key.replace('"', '\\"') + '"'
+
+
+class JSONSetKey(Func):
+    """Replace one top-level key of a JSON object in place"""
+    output_field = JSONField()
+
+    def __init__(self, expression, key, value):
+        self.key = key
+        self.value = value
+        super().__init__(expression)
+
+    def as_sql(self, compiler, connection):
+        lhs, params = compiler.compile(self.source_expressions[0])
+        return f"json_set({lhs}, %s, json(%s))", (*params, json_path(self.key), json.dumps(self.value))
+
+    def as_postgresql(self, compiler, connection):
+        lhs, params = compiler.compile(self.source_expressions[0])
+        return (
+            f"jsonb_set({lhs}, ARRAY[%s], %s::jsonb, true)",
+            (*params, str(self.key), json.dumps(self.value)),
+        )
+
+
+class TextStartsWith(Func):
+    """True if a text expression starts with prefix, matching case on every backend"""
+    output_field = BooleanField()
+    conditional = True
+
+    def __init__(self, expression, prefix):
+        self.prefix = prefix
+        super().__init__(expression)
+
+    def as_sql(self, compiler, connection):
+        lhs, params = compiler.compile(self.source_expressions[0])
+        sql, prefix_params = prefix_match_sql(lhs, self.prefix, connection.vendor)
+        return sql, (*params, *prefix_params)
+
+
+class JSONKeyAsNumber(Func):
+    """Numeric value of one top-level key, NULL where the text is not a number
+
+    Used to sort INTEGER/REAL columns numerically instead of as strings.
+    """
+    output_field = FloatField()
+
+    def __init__(self, key, expression):
+        super().__init__(KeyTextTransform(key, expression))
+
+    def as_sql(self, compiler, connection):
+        value, params = compiler.compile(self.source_expressions[0])
+        # The comparison converts the text with numeric affinity, which only happens if all of it is a number
+        number = f"CAST({value} AS REAL)"
+        return f"CASE WHEN {number} = {value} THEN {number} END", (*params, *params, *params)
+
+    def as_postgresql(self, compiler, connection):
+        value, params = compiler.compile(self.source_expressions[0])
+        return f"CASE WHEN {value} ~ %s THEN CAST({value} AS NUMERIC) END", (*params, NUMBER_PATTERN, *params)
+
+
+class JSONKeyIsNull(Func):
+    """True if a top-level key is missing or holds JSON null"""
+    output_field = BooleanField()
+    conditional = True
+
+    def __init__(self, key, expression):
+        self.key = key
+        super().__init__(expression)
+
+    def as_sql(self, compiler, connection):
+        lhs, params = compiler.compile(self.source_expressions[0])
+        return f"json_extract({lhs}, %s) IS NULL", (*params, json_path(self.key))
+
+    def as_postgresql(self, compiler, connection):
+        lhs, params = compiler.compile(self.source_expressions[0])
+        return f"({lhs} ->> %s) IS NULL", (*params, self.key)
+
+
+class JSONObjectToArray(Func):
+    """A JSON object row as an array of its values in the given key order
+
+    Missing keys become JSON null. The key list is one parameter, so there is
+    no limit on the number of columns.
+    """
+    output_field = JSONField()
+
+    def __init__(self, expression, keys):
+        self.keys = list(keys)
+        super().__init__(expression)
+
+    def as_sql(self, compiler, connection):
+        lhs, params = compiler.compile(self.source_expressions[0])
+        return (
+            # json() marks nested and boolean values as JSON; SQL NULL becomes null
+            f"(SELECT json_group_array(CASE cell.type WHEN 'true' THEN json('true') WHEN 'false' THEN json('false') "
+            f"WHEN 'object' THEN json(cell.value) WHEN 'array' THEN json(cell.value) ELSE cell.value END) FROM ("
+            f"SELECT cell.type AS type, cell.value AS value FROM json_each(%s) AS name "
+            f"LEFT JOIN json_each({lhs}) AS cell ON cell.key = name.value ORDER BY name.key) AS cell)",
+            (json.dumps(self.keys), *params),
+        )
+
+    def as_postgresql(self, compiler, connection):
+        lhs, params = compiler.compile(self.source_expressions[0])
+        return (
+            f"COALESCE((SELECT jsonb_agg({lhs} -> name.key ORDER BY name.position) "
+            f"FROM jsonb_array_elements_text(%s::jsonb) WITH ORDINALITY AS name(key, position)), '[]'::jsonb)",
+            (*params, json.dumps(self.keys)),
+        )
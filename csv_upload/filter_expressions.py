@@ -0,0 +1,322 @@
+"""
+Column-scoped filter expressions for table views.
+
+A small language for analysts, parsed once and compiled to SQL:
+
+    age > 30 AND city = Berlin
+    status IN (open, pending) OR NOT closed_at IS NULL
+    price BETWEEN 10 AND 20.5 AND name ^= 'Dr. '
+    `first name` != "O'Brien"
+
+Comparisons are ``= != < <= > >=``, ``^=`` (case-sensitive prefix match), ``IN (...)``,
+``NOT IN (...)``, ``BETWEEN a AND b`` and ``IS [NOT] NULL``. They combine
+with ``AND``, ``OR``, ``NOT`` and parentheses. Columns are bare names or
+backquoted; values are bare words, numbers or single/double quoted strings.
+
+Every column is checked against ``CSVUpload.get_columns()``. INTEGER and
+REAL columns compare numerically through the same expression
+``CSVDataQuerySet.order_by_column()`` sorts on, so a per-column expression
+index (``manage.py index_table_column``) serves both.
+"""
+
+import re
+
+from django.db.models import Q
+from django.db.models.lookups import (
+    Exact, GreaterThan, GreaterThanOrEqual, In, LessThan, LessThanOrEqual,
+)
+
+from csv_upload.expressions import JSONKeyIsNull, TextStartsWith, prefix_match_sql
+from csv_upload.models import CSVData, CSVDataQuerySet
+from csv_upload.typed_tables import _db_param, coerce_value, display_value
+
+MAX_EXPRESSION_LENGTH = 2000
+MAX_NESTING = 32
+# Types whose JSON values are stored in a canonical text form by ingest
+CANONICAL_DATA_TYPES = ('BOOLEAN', 'DATE', 'DATETIME')
+KEYWORDS = {'AND', 'OR', 'NOT', 'IN', 'IS', 'NULL', 'BETWEEN'}
+COMPARISON_LOOKUPS = {
+    '=': Exact,
+    '<': LessThan,
+    '<=': LessThanOrEqual,
+    '>': GreaterThan,
+    '>=': GreaterThanOrEqual,
+}
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+      | (?P<column>`[^`]+`)
+      | (?P<op>!=|<>|<=|>=|\^=|=|<|>)
+      | (?P<punct>[(),])
+      | (?P<word>[^\s'"`(),=!<>^]+)
+    )""", re.VERBOSE)
+
+
+class FilterSyntaxError(ValueError):
+    """Raised for an expression that does not parse or does not fit the table"""
+
+
+def _unquote(text):
+    quote = text[0]
+    body = text[1:-1].replace(quote * 2, quote)
+    return re.sub(r'\\(.)', r'\1', body)
+
+
+def tokenize(text):
+    """Split an expression into (kind, value) tokens"""
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if not match or match.end() == position:
+            raise FilterSyntaxError(f'Unexpected character at position {position + 1}: {text[position:position + 10]!r}')
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            tokens.append(('value', _unquote(value)))
+        elif kind == 'column':
+            tokens.append(('name', value[1:-1]))
+        elif kind == 'op':
+            tokens.append(('op', '!=' if value == '<>' else value))
+        elif kind == 'punct':
+            tokens.append(('punct', value))
+        elif value.upper() in KEYWORDS:
+            tokens.append(('keyword', value.upper()))
+        else:
+            tokens.append(('word', value))
+    return tokens
+
+
+class _Parser:
+    """Recursive-descent parser producing a tuple tree
+
+    Nodes are ('and', [nodes]), ('or', [nodes]), ('not', node) and
+    ('cmp', column, operator, values).
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+        self.depth = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        if token[0] is None:
+            raise FilterSyntaxError('Unexpected end of expression')
+        self.position += 1
+        return token
+
+    def accept(self, kind, value=None):
+        token = self.peek()
+        if token[0] == kind and (value is None or token[1] == value):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, kind, value=None):
+        if not self.accept(kind, value):
+            found = self.peek()[1]
+            raise FilterSyntaxError(f"Expected {value or kind} but found {found!r}" if found else f"Expected {value or kind}")
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek()[0] is not None:
+            raise FilterSyntaxError(f'Unexpected {self.peek()[1]!r}')
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.accept('keyword', 'OR'):
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while self.accept('keyword', 'AND'):
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def parse_not(self):
+        if self.accept('keyword', 'NOT'):
+            return ('not', self.nested(self.parse_not))
+        if self.accept('punct', '('):
+            node = self.nested(self.parse_or)
+            self.expect('punct', ')')
+            return node
+        return self.parse_comparison()
+
+    def nested(self, parse):
+        self.depth += 1
+        if self.depth > MAX_NESTING:
+            raise FilterSyntaxError(f'Expression is nested more than {MAX_NESTING} levels deep')
+        node = parse()
+        self.depth -= 1
+        return node
+
+    def parse_value(self):
+        kind, value = self.take()
+        if kind not in ('value', 'word'):
+            raise FilterSyntaxError(f'Expected a value but found {value!r}')
+        return value
+
+    def parse_comparison(self):
+        kind, column = self.take()
+        if kind not in ('name', 'word'):
+            raise FilterSyntaxError(f'Expected a column name but found {column!r}')
+
+        if self.accept('keyword', 'IS'):
+            negated = self.accept('keyword', 'NOT')
+            self.expect('keyword', 'NULL')
+            return ('cmp', column, 'IS NOT NULL' if negated else 'IS NULL', [])
+        if self.accept('keyword', 'BETWEEN'):
+            low = self.parse_value()
+            self.expect('keyword', 'AND')
+            return ('cmp', column, 'BETWEEN', [low, self.parse_value()])
+
+        negated = self.accept('keyword', 'NOT')
+        if self.accept('keyword', 'IN'):
+            self.expect('punct', '(')
+            values = [self.parse_value()]
+            while self.accept('punct', ','):
+                values.append(self.parse_value())
+            self.expect('punct', ')')
+            return ('cmp', column, 'NOT IN' if negated else 'IN', values)
+        if negated:
+            raise FilterSyntaxError(f"Expected IN after '{column} NOT'")
+
+        kind, operator = self.take()
+        if kind != 'op':
+            raise FilterSyntaxError(f"Expected an operator after '{column}' but found {operator!r}")
+        return ('cmp', column, operator, [self.parse_value()])
+
+
+class FilterExpression:
+    """A parsed filter expression, compiled per table on demand"""
+
+    def __init__(self, text):
+        self.text = text.strip()
+        if len(self.text) > MAX_EXPRESSION_LENGTH:
+            raise FilterSyntaxError(f'Expression is longer than {MAX_EXPRESSION_LENGTH} characters')
+        self.tree = _Parser(tokenize(self.text)).parse()
+
+    def __str__(self):
+        return self.text
+
+    def comparisons(self, node=None):
+        """Yield every ('cmp', ...) node of the tree"""
+        node = self.tree if node is None else node
+        if node[0] == 'cmp':
+            yield node
+        elif node[0] == 'not':
+            yield from self.comparisons(node[1])
+        else:
+            for child in node[1]:
+                yield from self.comparisons(child)
+
+    def validate(self, csv_upload):
+        """Check columns and value types against the table; returns self"""
+        columns = csv_upload.get_columns()
+        for _, column, operator, values in self.comparisons():
+            if column not in columns:
+                raise FilterSyntaxError(f"Unknown column '{column}'. Columns: {', '.join(columns)}")
+            data_type = csv_upload.get_column_properties(column).get('data_type')
+            if operator == '^=':
+                continue
+            for value in values:
+                try:
+                    coerce_value(value, data_type)
+                except (TypeError, ValueError):
+                    raise FilterSyntaxError(f"'{value}' is not a valid {data_type} value for column '{column}'")
+        return self
+
+    # JSON storage: Q objects over CSVData.row_data
+
+    def to_q(self, csv_upload):
+        """Compile to a Q object for a CSVData queryset of csv_upload"""
+        self.validate(csv_upload)
+        return self._node_q(self.tree, csv_upload)
+
+    def _node_q(self, node, csv_upload):
+        if node[0] == 'and':
+            q = Q()
+            for child in node[1]:
+                q &= self._node_q(child, csv_upload)
+            return q
+        if node[0] == 'or':
+            q = Q()
+            for child in node[1]:
+                q |= self._node_q(child, csv_upload)
+            return q
+        if node[0] == 'not':
+            return ~self._node_q(node[1], csv_upload)
+        return self._comparison_q(node, csv_upload)
+
+    def _comparison_q(self, node, csv_upload):
+        _, column, operator, values = node
+        data_type = csv_upload.get_column_properties(column).get('data_type')
+        numeric = data_type in CSVDataQuerySet.NUMERIC_DATA_TYPES
+        key = csv_upload.row_key(column)
+        expression = CSVData.objects.column_sort_key(key, data_type)
+
+        def literal(value):
+            if numeric:
+                return float(value)
+            if data_type in CANONICAL_DATA_TYPES:
+                # Rows hold the canonical text form, e.g. ISO dates and true/false
+                return display_value(coerce_value(value, data_type))
+            return value
+
+        if operator == 'IS NULL':
+            return Q(JSONKeyIsNull(key, 'row_data'))
+        if operator == 'IS NOT NULL':
+            return ~Q(JSONKeyIsNull(key, 'row_data'))
+        if operator == '^=':
+            text = CSVData.objects.column_sort_key(key)
+            return Q(TextStartsWith(text, values[0]))
+        if operator == 'BETWEEN':
+            return Q(GreaterThanOrEqual(expression, literal(values[0]))) & Q(LessThanOrEqual(expression, literal(values[1])))
+        if operator in ('IN', 'NOT IN'):
+            q = Q(In(expression, [literal(value) for value in values]))
+            return ~q if operator == 'NOT IN' else q
+        if operator == '!=':
+            return ~Q(Exact(expression, literal(values[0])))
+        return Q(COMPARISON_LOOKUPS[operator](expression, literal(values[0])))
+
+    # Typed storage: SQL over the physical table's real columns
+
+    def to_sql(self, csv_upload, connection):
+        """Compile to a (sql, params) WHERE fragment for a typed table"""
+        self.validate(csv_upload)
+        return self._node_sql(self.tree, csv_upload, connection)
+
+    def _node_sql(self, node, csv_upload, connection):
+        if node[0] in ('and', 'or'):
+            parts = [self._node_sql(child, csv_upload, connection) for child in node[1]]
+            joiner = ' AND ' if node[0] == 'and' else ' OR '
+            return '(' + joiner.join(sql for sql, _ in parts) + ')', [param for _, params in parts for param in params]
+        if node[0] == 'not':
+            sql, params = self._node_sql(node[1], csv_upload, connection)
+            return f'(NOT {sql})', params
+
+        _, column, operator, values = node
+        data_type = csv_upload.get_column_properties(column).get('data_type')
+        name = connection.ops.quote_name(column)
+        params = [_db_param(coerce_value(value, data_type)) for value in values]
+
+        if operator in ('IS NULL', 'IS NOT NULL'):
+            return f'{name} {operator}', []
+        if operator == '^=':
+            return prefix_match_sql(f'CAST({name} AS TEXT)', values[0], connection.vendor)
+        if operator == 'BETWEEN':
+            return f'{name} BETWEEN %s AND %s', params
+        if operator in ('IN', 'NOT IN'):
+            return f"{name} {operator} ({', '.join(['%s'] * len(params))})", params
+        if operator == '!=':
+            return f'{name} <> %s', params
+        return f'{name} {operator} %s', params
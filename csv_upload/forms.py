@@ -1,5 +1,29 @@
+import re
+
 from django import forms
-from .models import CSVUpload
+from django.conf import settings
+from .arrow_io import FORMAT_CSV, SOURCE_FORMATS, pyarrow_available, source_format
+from .models import CSVUpload, IngestJob
+
+
+def validate_source_name(name):
+    """Reject file names the ingest pipeline cannot read"""
+    file_format = source_format(name)
+    if file_format is None:
+        raise forms.ValidationError('Please upload a CSV, Parquet or Arrow file.')
+    if file_format != FORMAT_CSV and not pyarrow_available():
+        raise forms.ValidationError('Parquet and Arrow uploads need the pyarrow package on the server.')
+
+
+def normalize_table_name(table_name):
+    """Table name with special characters replaced, starting with a letter; case is preserved"""
+    # Remove special characters and spaces, replace with underscores
+    table_name = re.sub(r'[^a-zA-Z0-9_]', '_', table_name)
+    
+    # Ensure it starts with a letter
+    if not table_name[:1].isalpha():
+        table_name = 'table_' + table_name
+    return table_name
 
 
 class CSVUploadForm(forms.Form):
@@ -8,8 +32,9 @@ class CSVUploadForm(forms.Form):
         label='Select CSV File',
         widget=forms.FileInput(attrs={
             'class': 'form-control',
-            'accept': '.csv'
-        })
+            'accept': ','.join(SOURCE_FORMATS)
+        }),
+        help_text='CSV, Parquet or Arrow IPC (.arrow, .feather) files'
     )
     table_name = forms.CharField(
         max_length=100,
@@ -20,30 +45,57 @@ class CSVUploadForm(forms.Form):
         }),
         help_text='Enter a unique name for the SQL table'
     )
+    storage_engine = forms.ChoiceField(
+        choices=CSVUpload.STORAGE_CHOICES,
+        label='Storage',
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+        help_text='Typed SQL tables use native column types and constraints'
+    )
+    mode = forms.ChoiceField(
+        choices=IngestJob.MODE_CHOICES,
+        label='Mode',
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+        help_text='Append and upsert load into the existing table of that name'
+    )
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['storage_engine'].initial = getattr(settings, 'CSV_STORAGE_ENGINE', CSVUpload.STORAGE_JSON)
+    
+    def clean_storage_engine(self):
+        """Fall back to the configured default storage engine"""
+        return self.cleaned_data['storage_engine'] or self.fields['storage_engine'].initial
+    
+    def clean_mode(self):
+        """Create a new table unless another mode was chosen"""
+        return self.cleaned_data['mode'] or IngestJob.MODE_CREATE
     
     def clean_csv_file(self):
-        """Validate that the uploaded file is a CSV"""
+        """Validate that the uploaded file is a CSV, Parquet or Arrow file"""
         file = self.cleaned_data['csv_file']
-        
-        if not file.name.endswith('.csv'):
-            raise forms.ValidationError('Please upload a CSV file.')
-        
+        validate_source_name(file.name)
         return file
     
     def clean_table_name(self):
         """Validate table name - preserve exact case as entered by user"""
-        table_name = self.cleaned_data['table_name']
-        
-        # Remove special characters and spaces, replace with underscores
-        import re
-        table_name = re.sub(r'[^a-zA-Z0-9_]', '_', table_name)
-        
-        # Ensure it starts with a letter
-        if not table_name[0].isalpha():
-            table_name = 'table_' + table_name
-        
-        # Return with exact case preserved
-        return table_name
+        return normalize_table_name(self.cleaned_data['table_name'])
+
+
+class ChunkedUploadForm(CSVUploadForm):
+    """Form opening a resumable chunked upload; the file itself arrives in chunks"""
+    csv_file = None
+    filename = forms.CharField(max_length=255)
+    total_bytes = forms.IntegerField(min_value=1)
+    
+    field_order = ['filename', 'total_bytes', 'table_name', 'storage_engine', 'mode']
+    
+    def clean_filename(self):
+        """Validate the name of the file that will be uploaded"""
+        filename = self.cleaned_data['filename']
+        validate_source_name(filename)
+        return filename
 
 
 class RenameTableForm(forms.Form):
@@ -64,15 +116,7 @@ class RenameTableForm(forms.Form):
     
     def clean_new_table_name(self):
         """Validate new table name - preserve exact case as entered by user"""
-        table_name = self.cleaned_data['new_table_name']
-        
-        # Remove special characters and spaces, replace with underscores
-        import re
-        table_name = re.sub(r'[^a-zA-Z0-9_]', '_', table_name)
-        
-        # Ensure it starts with a letter
-        if not table_name[0].isalpha():
-            table_name = 'table_' + table_name
+        table_name = normalize_table_name(self.cleaned_data['new_table_name'])
         
         # Check if the new name already exists (excluding current table)
         existing_query = CSVUpload.objects.filter(table_name=table_name)
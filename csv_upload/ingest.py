@@ -0,0 +1,408 @@
+"""
+Streaming CSV ingest pipeline.
+
+The uploaded file is parsed in chunks with pandas (Parquet and Arrow IPC
+files in record batches, see arrow_io). The schema is inferred
+from the first chunk and each chunk is written to the database before the
+next one is read, so peak memory stays close to CSV_INGEST_MEMORY_BUDGET
+regardless of the file size. A file whose hash matches an existing table is
+not parsed at all; its table is copied inside the database (see dedup.py).
+
+Columns are canonicalized as they load (see type_inference), so a column a
+later chunk widens would leave the rows before it in the canonical form of
+the narrower type ('yes' stored as 'true' in what became a TEXT column).
+When that happens the partial table is dropped, the rest of the file is
+scanned for the final types and the load starts over from the top; a source
+that cannot seek (stdin) is spooled to a temporary file first so it can be
+read twice.
+
+The CSVUpload row is committed before the rows are loaded in a transaction
+of their own. Until that transaction commits the upload is not ready
+(CSVUpload.is_ready) and is left out of the table list and views; it is
+removed again if the load fails.
+"""
+
+import itertools
+import logging
+import re
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from csv_upload.arrow_io import (
+    FORMAT_ARROW, FORMAT_CSV, FORMAT_PARQUET, batch_frame, empty_batch, read_batches, schema_columns, source_format,
+)
+from csv_upload.bulk_load import BulkLoader, LoadStats
+from csv_upload.dedup import copy_upload, find_duplicate
+from csv_upload.models import CSVUpload
+from csv_upload.partitions import attach_partition, create_staging_partition, delete_rows
+from csv_upload.profiling import TableProfiler
+from csv_upload.table_stats import frame_bytes
+from csv_upload.type_inference import canonicalize_column, column_fits, infer_column_type, widen_data_type
+from csv_upload.typed_tables import TypedTableLoader, create_typed_table, drop_typed_table
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+# Rows parsed before the per-row memory estimate exists; column types are inferred from them
+SAMPLE_ROWS = 1000
+# Parser buffers and row conversion roughly double the DataFrame footprint
+MEMORY_OVERHEAD_FACTOR = 2
+# Rows kept from the parsed chunks for the page shown after an upload
+PREVIEW_ROWS = 20
+
+
+def clean_column_name(name):
+    """Remove special characters and spaces from a column name"""
+    return re.sub(r'[^a-zA-Z0-9_]', '_', str(name)).lower().strip('_')
+
+
+def infer_data_type(series):
+    """Infer a column data type from its values"""
+    return infer_column_type(series)[0]
+
+
+def default_column_properties(data_type):
+    """Column properties for a freshly inferred column"""
+    return {
+        'data_type': data_type,
+        'nullable': True,
+        'primary_key': False,
+        'foreign_key': False,
+        'foreign_table': None,
+        'foreign_column': None,
+        'on_delete': None,
+        'unique': False,
+        'default_value': None,
+        'max_length': None,
+        'auto_increment': False
+    }
+
+
+def dataframe_rows(df, start=1):
+    """Yield (row_number, row_dict) pairs for a DataFrame, handling NaN values"""
+    columns = list(df.columns)
+    for offset, values in enumerate(df.itertuples(index=False, name=None)):
+        row_dict = {}
+        for col, value in zip(columns, values):
+            if pd.isna(value):
+                row_dict[col] = None
+            else:
+                row_dict[col] = str(value)
+        yield start + offset, row_dict
+
+
+def get_loader(csv_upload, table=None, batch_size=None):
+    """Bulk loader matching the upload's storage engine; table overrides its target table"""
+    if csv_upload.uses_typed_table():
+        return TypedTableLoader(csv_upload, table=table, batch_size=batch_size)
+    return BulkLoader(csv_upload, table=table, batch_size=batch_size)
+
+
+class SchemaWidened(Exception):
+    """A chunk widened a column after rows canonicalized as the narrower type were written"""
+
+
+class IngestPipeline:
+    """Parse a CSV source chunk by chunk and load it into a new table"""
+
+    def __init__(self, source, table_name, filename=None, memory_budget=None, storage_engine=None,
+                 content_hash=None, batch_size=None):
+        self.source = source
+        self.table_name = table_name
+        self.filename = filename or getattr(source, 'name', table_name)
+        self.storage_engine = storage_engine or getattr(settings, 'CSV_STORAGE_ENGINE', CSVUpload.STORAGE_JSON)
+        self.memory_budget = memory_budget or getattr(
+            settings, 'CSV_INGEST_MEMORY_BUDGET', DEFAULT_MEMORY_BUDGET
+        )
+        self.batch_size = batch_size  # Rows per COPY chunk; None uses CSV_INGEST_BATCH_SIZE
+        self.column_names = None
+        self.columns_info = None
+        self.rows_loaded = 0
+        self.chunks_loaded = 0
+        self.bytes_read = 0
+        self.cell_bytes = 0  # Becomes CSVUpload.byte_size
+        self.profiler = TableProfiler()
+        self.sample_rows = getattr(settings, 'CSV_INFERENCE_SAMPLE_ROWS', SAMPLE_ROWS)
+        self.source_format = source_format(self.filename) or FORMAT_CSV
+        self.arrow_schema = None
+        self.preview_limit = getattr(settings, 'CSV_UPLOAD_PREVIEW_ROWS', PREVIEW_ROWS)
+        self.preview = []  # First rows as loaded, so nothing has to be read back for display
+        self.source_start = 0  # Where the source was when the load started; rewind() returns there
+        self.spooled_source = None  # Temporary copy of a source that cannot seek
+        self.content_hash = content_hash or ''  # SHA-256 of the source file, if the caller hashed it
+        self.copied_from = None  # Set when the table was copied from an identical upload
+
+    def source_position(self):
+        """Bytes consumed from the source so far (pandas reads slightly ahead)"""
+        try:
+            return self.source.tell()
+        except (AttributeError, OSError, ValueError):
+            return self.bytes_read
+
+    def prepare_source(self):
+        """Make a CSV source rewindable, so the load can start over with wider column types"""
+        if self.source_format != FORMAT_CSV:
+            # Parquet and Arrow columns are typed by the file and never widen
+            return
+        if not self.source.seekable():
+            self.spooled_source = tempfile.TemporaryFile()
+            shutil.copyfileobj(self.source, self.spooled_source)
+            self.spooled_source.seek(0)
+            self.source = self.spooled_source
+        self.source_start = self.source.tell()
+
+    def rewind(self):
+        """Read the source again from the start, keeping the column types found so far"""
+        self.source.seek(self.source_start)
+        self.rows_loaded = 0
+        self.chunks_loaded = 0
+        self.bytes_read = 0
+        self.cell_bytes = 0
+        self.profiler = TableProfiler()
+        self.preview = []
+
+    def rows_per_chunk(self, chunk):
+        """Size the next chunk so it fits the memory budget"""
+        if len(chunk) == 0:
+            return SAMPLE_ROWS
+        bytes_per_row = chunk.memory_usage(index=True, deep=True).sum() / len(chunk)
+        return max(1, int(self.memory_budget / (bytes_per_row * MEMORY_OVERHEAD_FACTOR)))
+
+    def iter_chunks(self):
+        """Yield DataFrame chunks sized from the memory budget"""
+        if self.source_format in (FORMAT_PARQUET, FORMAT_ARROW):
+            yield from self.iter_arrow_chunks()
+            return
+        yield from self.iter_csv_chunks(self.source)
+
+    def iter_csv_chunks(self, source, **read_options):
+        """Yield DataFrame chunks of a CSV source; read_options are passed on to pandas"""
+        # Read every cell as text; update_schema() infers and canonicalizes the types
+        reader = pd.read_csv(source, chunksize=self.sample_rows, dtype=str, **read_options)
+        with reader:
+            chunk_rows = self.sample_rows
+            while True:
+                try:
+                    chunk = reader.get_chunk(chunk_rows)
+                except StopIteration:
+                    return
+                if self.column_names is None:
+                    self.column_names = [clean_column_name(col) for col in chunk.columns]
+                chunk.columns = self.column_names
+                yield chunk
+                if len(chunk) == 0:
+                    return
+                chunk_rows = self.rows_per_chunk(chunk)
+
+    def iter_arrow_chunks(self):
+        """Yield DataFrame chunks of a Parquet or Arrow IPC source, typed by its schema"""
+        schema, batches = read_batches(self.source, self.source_format, self.memory_budget)
+        self.column_names = [clean_column_name(name) for name in schema.names]
+        self.arrow_schema = schema
+        empty = True
+        for batch in batches:
+            empty = False
+            chunk = batch_frame(batch)
+            chunk.columns = self.column_names
+            yield chunk
+        if empty:
+            # A file with a schema but no rows still creates its (empty) table
+            chunk = batch_frame(empty_batch(schema))
+            chunk.columns = self.column_names
+            yield chunk
+
+    def update_schema(self, chunk):
+        """Infer column types from the first chunk and widen them on conflicts
+
+        Returns the names of the columns whose type was set or changed.
+        """
+        if self.columns_info is None and self.arrow_schema is not None:
+            # Parquet/Arrow columns are typed already; nothing to infer or widen
+            self.columns_info = {}
+            for col, (_, data_type, nullable, source_type) in zip(chunk.columns, schema_columns(self.arrow_schema)):
+                self.columns_info[col] = default_column_properties(data_type)
+                self.columns_info[col]['nullable'] = nullable
+                self.columns_info[col]['type_inference'] = {
+                    'confidence': 1.0, 'sample_size': 0, 'scores': {}, 'date_format': None,
+                    'source_type': source_type,
+                }
+            return list(self.columns_info)
+        if self.arrow_schema is not None:
+            return []
+
+        if self.columns_info is None:
+            self.columns_info = {}
+            for col in chunk.columns:
+                data_type, inference = infer_column_type(chunk[col])
+                self.columns_info[col] = default_column_properties(data_type)
+                self.columns_info[col]['type_inference'] = inference
+            return list(self.columns_info)
+        return self.widen_schema(chunk)
+
+    def widen_schema(self, chunk):
+        """Widen the known column types to fit a chunk; returns the names of the widened columns"""
+        changed = []
+        for col in chunk.columns:
+            properties = self.columns_info[col]
+            inference = properties['type_inference']
+            if column_fits(chunk[col], properties['data_type'], inference['date_format']):
+                continue
+            chunk_type, chunk_inference = infer_column_type(chunk[col])
+            widened = widen_data_type(properties['data_type'], chunk_type)
+            if widened == properties['data_type']:
+                # Values of the type that still do not parse with its format, e.g. mixed date formats
+                widened = 'TEXT'
+            properties['data_type'] = widened
+            if widened == chunk_type:
+                inference['date_format'] = chunk_inference['date_format']
+            changed.append(col)
+        return changed
+
+    def canonicalize(self, chunk):
+        """Rewrite each column of a chunk in the canonical form of its type"""
+        for col in chunk.columns:
+            properties = self.columns_info[col]
+            chunk[col] = canonicalize_column(
+                chunk[col], properties['data_type'], properties['type_inference']['date_format']
+            )
+        return chunk
+
+    def add_preview(self, chunk):
+        """Keep the first rows of a canonicalized chunk until the preview is full"""
+        if len(self.preview) < self.preview_limit:
+            wanted = self.preview_limit - len(self.preview)
+            self.preview.extend(row_dict for _, row_dict in dataframe_rows(chunk.head(wanted)))
+
+    def copy_duplicate(self):
+        """Copy an existing table loaded from an identical file; returns (csv_upload, stats) or None"""
+        source = find_duplicate(self.content_hash, self.storage_engine)
+        copied = copy_upload(source, self.table_name, self.filename) if source else None
+        if copied is None:
+            return None
+        self.copied_from = source
+        self.rows_loaded = copied[1].rows
+        self.bytes_read = self.source_position()
+        logger.info('Loaded "%s" as a copy of identical upload "%s": %s', self.table_name, source.table_name, copied[1])
+        return copied
+
+    def create_upload(self):
+        """Create the CSVUpload and its empty storage in a transaction of their own
+
+        Returns (csv_upload, staging table or None). The rows are loaded in a
+        second transaction: an uncommitted CSVUpload row held for a whole load
+        deadlocks concurrent ingests on PostgreSQL, because attaching a partition
+        locks CSVUpload against writers. The upload stays hidden (is_ready is
+        False) and content_hash blank until the rows are in, so neither the
+        views nor dedup.py ever see a half-loaded table.
+        """
+        with transaction.atomic():
+            csv_upload = CSVUpload(
+                filename=self.filename,
+                table_name=self.table_name,
+                storage_engine=self.storage_engine,
+                column_count=len(self.column_names),
+                is_ready=False,
+            )
+            csv_upload.set_columns(self.columns_info)
+            csv_upload.save()
+            if csv_upload.uses_typed_table():
+                create_typed_table(csv_upload)
+                return csv_upload, None
+            # PostgreSQL: load into a standalone table, attached as the partition at the end
+            return csv_upload, create_staging_partition(csv_upload)
+
+    def discard(self, csv_upload):
+        """Remove an upload whose load failed, with whatever storage it got"""
+        with transaction.atomic():
+            if csv_upload.uses_typed_table():
+                drop_typed_table(csv_upload)
+            delete_rows(csv_upload)
+            csv_upload.delete()
+
+    def run(self):
+        """Create the CSVUpload, then load every chunk in one transaction
+
+        A column widened after rows were written discards the partial table; the
+        rest of the file is scanned for the final types and loaded once more.
+        """
+        copied = self.copy_duplicate()
+        if copied is not None:
+            return copied
+
+        started = time.perf_counter()
+        self.prepare_source()
+        chunks = self.iter_chunks()
+        try:
+            first_chunk = next(chunks, None)
+            if first_chunk is None:
+                raise ValueError('The CSV file has no header row.')
+            self.update_schema(first_chunk)
+            try:
+                csv_upload, load_seconds = self.load(itertools.chain([first_chunk], chunks))
+            except SchemaWidened:
+                for chunk in chunks:
+                    self.update_schema(chunk)
+                chunks.close()
+                logger.info('Reloading "%s" with column types widened after %d chunk(s)', self.table_name, self.chunks_loaded)
+                self.rewind()
+                chunks = self.iter_chunks()
+                csv_upload, load_seconds = self.load(chunks)
+        finally:
+            chunks.close()
+            if self.spooled_source is not None:
+                self.spooled_source.close()
+
+        total = LoadStats(self.rows_loaded, time.perf_counter() - started, 'streaming ingest')
+        logger.info(
+            'Ingested "%s" in %d chunk(s): %s (%.2fs spent loading)',
+            self.table_name, self.chunks_loaded, total, load_seconds
+        )
+        return csv_upload, total
+
+    def load(self, chunks):
+        """Create the CSVUpload and load chunks into it; returns (csv_upload, seconds spent loading)
+
+        Raises SchemaWidened, with the upload discarded, if a chunk after the
+        first widens a column.
+        """
+        load_seconds = 0.0
+        csv_upload, staging_table = self.create_upload()
+        try:
+            with transaction.atomic():
+                for chunk in chunks:
+                    if self.chunks_loaded and self.update_schema(chunk):
+                        raise SchemaWidened()
+
+                    chunk = self.canonicalize(chunk)
+                    self.add_preview(chunk)
+                    stats = get_loader(csv_upload, staging_table, self.batch_size).load(
+                        dataframe_rows(chunk, start=self.rows_loaded + 1)
+                    )
+                    self.profiler.update(chunk)
+                    self.cell_bytes += frame_bytes(chunk)
+                    self.rows_loaded += stats.rows
+                    self.chunks_loaded += 1
+                    self.bytes_read = self.source_position()
+                    load_seconds += stats.elapsed
+
+                if staging_table:
+                    attach_partition(csv_upload)
+                csv_upload.set_column_stats(self.profiler.finish())
+                csv_upload.row_count = self.rows_loaded
+                csv_upload.byte_size = self.cell_bytes
+                csv_upload.content_hash = self.content_hash
+                csv_upload.last_modified = timezone.now()
+                csv_upload.is_ready = True
+                csv_upload.save(update_fields=[
+                    'column_stats', 'row_count', 'byte_size', 'content_hash', 'last_modified', 'is_ready'
+                ])
+        except BaseException:
+            self.discard(csv_upload)
+            raise
+        return csv_upload, load_seconds
@@ -0,0 +1,206 @@
+"""
+Background ingest jobs.
+
+``upload_csv`` spools the uploaded file to CSV_INGEST_SPOOL_DIR and queues an
+IngestJob; chunked uploads (see chunked_uploads.py) are assembled in the
+spool directory and queued in place. ``manage.py run_ingest_worker`` claims queued jobs with
+``SELECT ... FOR UPDATE SKIP LOCKED``, so any number of workers on any number
+of hosts can drain the same queue. A running job whose worker stops sending
+heartbeats is claimed again; the not-ready table that worker left behind is
+dropped first, so the job loads it from scratch. Append and upsert jobs load into the
+existing table of their name (see merge.py); large CSV files are parsed
+by several processes (see parallel_ingest.py).
+"""
+
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from csv_upload.merge import MergePipeline, delete_upload
+from csv_upload.models import CSVUpload, IngestJob
+from csv_upload.parallel_ingest import ParallelIngestPipeline
+from csv_upload.upload_handlers import content_hash
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROGRESS_INTERVAL = 1.0
+DEFAULT_STALE_AFTER = 300
+
+
+def get_spool_dir():
+    """Directory holding uploads that are waiting for a worker"""
+    spool_dir = Path(getattr(settings, 'CSV_INGEST_SPOOL_DIR', Path(settings.BASE_DIR) / 'spool'))
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    return spool_dir
+
+
+def worker_name():
+    """Identify this worker process in IngestJob.worker"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def spool_upload(uploaded_file):
+    """Write an UploadedFile to the spool directory chunk by chunk"""
+    # Keep the extension; it tells the pipeline how to read the file
+    suffix = Path(uploaded_file.name).suffix.lower() or '.csv'
+    path = get_spool_dir() / f"{uuid.uuid4().hex}{suffix}"
+    size = 0
+    with open(path, 'wb') as destination:
+        for chunk in uploaded_file.chunks():
+            destination.write(chunk)
+            size += len(chunk)
+    return path, size
+
+
+def enqueue_spooled(path, filename, table_name, storage_engine=None, content_hash='', mode=IngestJob.MODE_CREATE):
+    """Queue a file already in the spool directory; the worker removes it when done"""
+    return IngestJob.objects.create(
+        table_name=table_name,
+        mode=mode,
+        filename=filename,
+        storage_engine=storage_engine or getattr(settings, 'CSV_STORAGE_ENGINE', CSVUpload.STORAGE_JSON),
+        source_path=str(path),
+        total_bytes=os.path.getsize(path),
+        content_hash=content_hash or '',
+    )
+
+
+def enqueue_upload(uploaded_file, table_name, storage_engine=None, mode=IngestJob.MODE_CREATE):
+    """Spool an upload and queue it for the ingest worker"""
+    path, _ = spool_upload(uploaded_file)
+    return enqueue_spooled(path, uploaded_file.name, table_name, storage_engine, content_hash(uploaded_file), mode)
+
+
+def discard_partial_upload(job, worker):
+    """Remove the not-ready table a dead worker left behind, so the job can load it afresh"""
+    if job.mode != IngestJob.MODE_CREATE:
+        # Merges run in one transaction, which rolled back when the worker died
+        return
+    for csv_upload in CSVUpload.objects.filter(table_name=job.table_name, is_ready=False):
+        logger.warning('Discarding table "%s" partly loaded by %s', csv_upload.table_name, worker)
+        delete_upload(csv_upload)
+
+
+def claim_next_job(stale_after=DEFAULT_STALE_AFTER):
+    """Claim the oldest queued job, or a running job whose worker went silent"""
+    stale_before = timezone.now() - timedelta(seconds=stale_after)
+    with transaction.atomic():
+        job = (
+            IngestJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status=IngestJob.STATUS_QUEUED) |
+                Q(status=IngestJob.STATUS_RUNNING, updated_at__lt=stale_before)
+            )
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+        stale_worker = job.worker if job.status == IngestJob.STATUS_RUNNING else None
+        if stale_worker is not None:
+            logger.warning('Re-claiming stale ingest job %s from %s', job.pk, stale_worker)
+        job.status = IngestJob.STATUS_RUNNING
+        job.worker = worker_name()
+        job.started_at = timezone.now()
+        job.bytes_read = 0
+        job.rows_loaded = 0
+        job.error = ''
+        job.save()
+    if stale_worker is not None:
+        # Outside the claim's transaction, so the partition is detached without locking CSVData
+        discard_partial_upload(job, stale_worker)
+    return job
+
+
+def _record_progress(job, pipeline):
+    IngestJob.objects.filter(pk=job.pk).update(
+        rows_loaded=pipeline.rows_loaded,
+        bytes_read=pipeline.bytes_read,
+        updated_at=timezone.now(),
+    )
+
+
+def run_job(job, progress_interval=DEFAULT_PROGRESS_INTERVAL):
+    """Run a claimed job to completion and record the outcome"""
+    outcome = {}
+    pipeline_box = {}
+
+    def ingest():
+        # The pipeline commits once at the end, so it runs on its own thread
+        # and connection while this thread publishes progress
+        try:
+            with open(job.source_path, 'rb') as source:
+                if job.mode == IngestJob.MODE_CREATE:
+                    # Splits large CSV files across CSV_INGEST_WORKERS processes
+                    pipeline = ParallelIngestPipeline(
+                        source, job.table_name, filename=job.filename,
+                        storage_engine=job.storage_engine, content_hash=job.content_hash,
+                    )
+                else:
+                    target = CSVUpload.objects.ready().filter(table_name=job.table_name).first()
+                    if target is None:
+                        raise ValueError(f'Table "{job.table_name}" does not exist')
+                    pipeline = MergePipeline(source, target, job.mode, filename=job.filename)
+                pipeline_box['pipeline'] = pipeline
+                outcome['result'] = pipeline.run()
+        except Exception as e:
+            outcome['error'] = e
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=ingest, name=f'ingest-job-{job.pk}')
+    thread.start()
+    while thread.is_alive():
+        thread.join(progress_interval)
+        if thread.is_alive() and 'pipeline' in pipeline_box:
+            _record_progress(job, pipeline_box['pipeline'])
+
+    job.finished_at = timezone.now()
+    if 'error' in outcome:
+        logger.error('Ingest job %s failed: %s', job.pk, outcome['error'])
+        job.status = IngestJob.STATUS_FAILED
+        job.error = str(outcome['error'])
+    else:
+        csv_upload, stats = outcome['result']
+        logger.info('Ingest job %s finished: %s', job.pk, stats)
+        job.status = IngestJob.STATUS_DONE
+        job.csv_upload = csv_upload
+        job.rows_loaded = stats.rows
+        job.bytes_read = job.total_bytes
+    job.save()
+
+    try:
+        os.remove(job.source_path)
+    except OSError:
+        pass
+    return job
+
+
+def job_progress(job):
+    """JSON-serialisable progress report for the progress API"""
+    eta = job.eta_seconds()
+    return {
+        'job_id': job.pk,
+        'status': job.status,
+        'table_name': job.table_name,
+        'mode': job.mode,
+        'filename': job.filename,
+        'table_id': job.csv_upload_id,
+        'rows_loaded': job.rows_loaded,
+        'bytes_read': job.bytes_read,
+        'total_bytes': job.total_bytes,
+        'percent_complete': round(job.percent_complete(), 1),
+        'rows_per_second': round(job.rows_per_second(), 1),
+        'eta_seconds': round(eta, 1) if eta is not None else None,
+        'error': job.error,
+    }
@@ -0,0 +1,65 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from csv_upload.models import CSVUpload
+
+
+class Command(BaseCommand):
+    help = 'Time the filter, sort, paging and cell-update queries the table views run for one table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('table_id', type=int, help='CSVUpload id of the table to benchmark')
+        parser.add_argument('--filter', default='a', help='Filter text to search for (default: "a")')
+        parser.add_argument('--sort', help='Column to sort by (default: first column)')
+        parser.add_argument('--page-size', type=int, default=100, help='Rows per page (default: 100)')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query; the median is reported (default: 5)')
+
+    def time_query(self, label, run, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        self.stdout.write(f'{label:<32} median {statistics.median(timings):9.2f} ms   min {min(timings):9.2f} ms')
+
+    def handle(self, *args, **options):
+        try:
+            csv_upload = CSVUpload.objects.get(id=options['table_id'])
+        except CSVUpload.DoesNotExist:
+            raise CommandError(f'Table {options["table_id"]} does not exist')
+        if csv_upload.uses_typed_table():
+            raise CommandError('Typed tables are queried with plain SQL; benchmark JSON tables only')
+
+        rows = csv_upload.data_rows.all()
+        sort_by = options['sort'] or csv_upload.get_column_names()[0]
+        if sort_by not in csv_upload.get_columns():
+            raise CommandError(f'Column "{sort_by}" does not exist in table "{csv_upload.table_name}"')
+        key = csv_upload.row_key(sort_by)
+        page_size = options['page_size']
+        repeat = options['repeat']
+        total = rows.count()
+        last_offset = max(total - page_size, 0)
+        data_type = csv_upload.get_column_properties(sort_by).get('data_type')
+
+        self.stdout.write(f'Table "{csv_upload.table_name}": {total} rows, sorting by "{sort_by}" ({data_type})')
+        self.time_query('count', rows.count, repeat)
+        self.time_query('filter count', lambda: rows.search_values(options['filter']).count(), repeat)
+        self.time_query('filter first page', lambda: list(rows.search_values(options['filter'])[:page_size]), repeat)
+        self.time_query('row_number first page', lambda: list(rows.order_by('row_number')[:page_size]), repeat)
+        self.time_query('row_number last page', lambda: list(rows.order_by('row_number')[last_offset:total]), repeat)
+        self.time_query('sorted first page', lambda: list(rows.order_by_column(key, data_type=data_type)[:page_size]), repeat)
+        self.time_query('sorted last page', lambda: list(rows.order_by_column(key, data_type=data_type)[last_offset:total]), repeat)
+
+        first_row = rows.order_by('row_number').first()
+        if first_row is not None:
+            value = first_row.get_row_data().get(sort_by)
+
+            def update_cell():
+                with transaction.atomic():
+                    rows.set_cell(first_row.id, key, value)
+                    transaction.set_rollback(True)
+
+            self.time_query('update cell', update_cell, repeat)
@@ -0,0 +1,102 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+
+from csv_upload.expressions import JSONObjectToArray
+from csv_upload.models import CSVData, CSVUpload
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+def stored_bytes(csv_upload):
+    """Bytes the row_data values of one upload take on disk (before compression on SQLite)"""
+    if connection.vendor == 'postgresql':
+        size = models.Func(models.F('row_data'), function='pg_column_size', output_field=models.BigIntegerField())
+    else:
+        size = models.Func(
+            models.F('row_data'), template='length(CAST(%(expressions)s AS BLOB))', output_field=models.BigIntegerField()
+        )
+    total = CSVData.objects.filter(csv_upload=csv_upload).aggregate(total=models.Sum(size))['total']
+    return total or 0
+
+
+class Command(BaseCommand):
+    help = (
+        'Rewrite the rows of JSON tables from keyed objects to positional arrays in column order, '
+        'in batches, and report the space saved.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('table_ids', nargs='*', type=int, help='CSVUpload ids (default: every keyed table)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows rewritten per UPDATE')
+        parser.add_argument(
+            '--compression', choices=['pglz', 'lz4'],
+            help='PostgreSQL 14+: set the TOAST compression of row_data first (applies to rows over ~2 kB)'
+        )
+
+    def handle(self, *args, **options):
+        uploads = CSVUpload.objects.filter(storage_engine=CSVUpload.STORAGE_JSON, row_format=CSVUpload.ROW_FORMAT_OBJECT)
+        if options['table_ids']:
+            uploads = uploads.filter(id__in=options['table_ids'])
+            missing = set(options['table_ids']) - set(uploads.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f'No keyed JSON table with id {", ".join(map(str, sorted(missing)))}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        if options['compression']:
+            if connection.vendor != 'postgresql':
+                raise CommandError('--compression is only supported on PostgreSQL')
+            quote = connection.ops.quote_name
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"ALTER TABLE {quote(CSVData._meta.db_table)} ALTER COLUMN {quote('row_data')} "
+                    f"SET COMPRESSION {options['compression']}"
+                )
+            self.stdout.write(f'row_data values are now compressed with {options["compression"]} when TOASTed')
+
+        total_before = total_after = 0
+        for upload_id in uploads.order_by('id').values_list('id', flat=True):
+            before, after, _ = self.compact(upload_id, options['batch_size'])
+            total_before += before
+            total_after += after
+
+        if total_before:
+            self.stdout.write(self.style.SUCCESS(
+                f'Saved {total_before - total_after:,} of {total_before:,} bytes '
+                f'({100.0 * (total_before - total_after) / total_before:.1f}%)'
+            ))
+            if connection.vendor == 'postgresql':
+                self.stdout.write(
+                    'Run VACUUM to make the old row versions reusable (VACUUM FULL returns the space to the OS), '
+                    'and recreate any index_table_column indexes: they were built on the keyed rows.'
+                )
+        else:
+            self.stdout.write('Nothing to compact')
+
+    def compact(self, upload_id, batch_size):
+        """Rewrite one table's rows; returns (bytes before, bytes after, rows)"""
+        # One transaction per table: queries address a column by name or by position, never both
+        with transaction.atomic():
+            csv_upload = CSVUpload.objects.select_for_update().get(id=upload_id)
+            names = csv_upload.get_column_names()
+            before = stored_bytes(csv_upload)
+            rows = CSVData.objects.filter(csv_upload=csv_upload)
+            last_id = 0
+            count = 0
+            while True:
+                batch = list(rows.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+                if not batch:
+                    break
+                count += rows.filter(id__in=batch).update(row_data=JSONObjectToArray('row_data', names))
+                last_id = batch[-1]
+            csv_upload.row_format = CSVUpload.ROW_FORMAT_ARRAY
+            csv_upload.save(update_fields=['row_format'])
+            # Same values in a smaller encoding: still a faithful copy of the uploaded file
+            csv_upload.bump_data_version(source_changed=False)
+            after = stored_bytes(csv_upload)
+
+        saved = 100.0 * (before - after) / before if before else 0.0
+        self.stdout.write(
+            f'Table "{csv_upload.table_name}": {count:,} rows, {before:,} -> {after:,} bytes ({saved:.1f}% saved)'
+        )
+        return before, after, count
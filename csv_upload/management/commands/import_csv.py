@@ -0,0 +1,281 @@
+import glob
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django import forms
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from csv_upload.arrow_io import source_format
+from csv_upload.chunked_uploads import file_sha256
+from csv_upload.forms import normalize_table_name, validate_source_name
+from csv_upload.merge import MergePipeline, delete_upload
+from csv_upload.models import CSVUpload, IngestJob
+from csv_upload.parallel_ingest import ParallelIngestPipeline, ingest_workers
+
+STDIN = '-'
+ON_EXISTS_SKIP = 'skip'
+ON_EXISTS_REPLACE = 'replace'
+ON_EXISTS_APPEND = 'append'
+
+
+def is_glob(source):
+    return any(char in source for char in '*?[')
+
+
+def expand_sources(sources):
+    """Paths named by the arguments, in order; directories and globs contribute their supported files"""
+    paths = []
+    for source in sources:
+        if source == STDIN:
+            paths.append(STDIN)
+        elif os.path.isdir(source):
+            paths.extend(sorted(
+                os.path.join(source, name) for name in os.listdir(source)
+                if source_format(name) and os.path.isfile(os.path.join(source, name))
+            ))
+        elif os.path.isfile(source):
+            try:
+                validate_source_name(source)
+            except forms.ValidationError as e:
+                raise CommandError(f'{source}: {e.messages[0]}')
+            paths.append(source)
+        elif is_glob(source):
+            matches = sorted(
+                path for path in glob.glob(source, recursive=True) if os.path.isfile(path) and source_format(path)
+            )
+            if not matches:
+                raise CommandError(f'No CSV, Parquet or Arrow files match {source}')
+            paths.extend(matches)
+        else:
+            raise CommandError(f'No such file or directory: {source}')
+    # A file named twice is imported once
+    return list(dict.fromkeys(paths))
+
+
+def table_name_for(path, template):
+    """Table name for a source from --table-name-template"""
+    if path == STDIN:
+        name, parent = 'stdin', ''
+    else:
+        name = os.path.splitext(os.path.basename(path))[0]
+        parent = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    try:
+        table_name = normalize_table_name(template.format(name=name, parent=parent))
+    except (KeyError, IndexError, ValueError) as e:
+        raise CommandError(f'Invalid --table-name-template {template!r} ({e}); use {{name}} and {{parent}}')
+    if len(table_name) > CSVUpload._meta.get_field('table_name').max_length:
+        raise CommandError(f'Table name "{table_name}" for {path} is too long')
+    return table_name
+
+
+def replace_table(existing, csv_upload, table_name):
+    """Swap a freshly loaded table in for the existing table of that name
+
+    The loaded table is dropped if the swap fails, so the old table stays as it was.
+    """
+    try:
+        with transaction.atomic():
+            existing = CSVUpload.objects.select_for_update().filter(pk=existing.pk).first()
+            if existing is not None:
+                # Retired under another name, so the new table takes its name in the same commit
+                existing.table_name = f'{table_name[:80]}_replaced_{uuid.uuid4().hex[:8]}'
+                existing.is_ready = False
+                existing.save(update_fields=['table_name', 'is_ready'])
+            csv_upload.table_name = table_name
+            csv_upload.save(update_fields=['table_name'])
+    except Exception:
+        delete_upload(csv_upload)
+        raise
+    if existing is not None:
+        # Outside the swap's transaction, so its partition is detached without locking CSVData
+        delete_upload(existing)
+
+
+def import_file(path, table_name, options):
+    """Load one source into its table; returns a report dict"""
+    report = {
+        'path': path, 'table_name': table_name, 'status': 'failed', 'rows': 0,
+        'bytes': None if path == STDIN else os.path.getsize(path), 'seconds': 0.0, 'error': '',
+    }
+    started = time.perf_counter()
+    try:
+        existing = CSVUpload.objects.ready().filter(table_name=table_name).first()
+        if existing is not None and options['on_exists'] == ON_EXISTS_SKIP:
+            report['status'] = 'skipped'
+            return report
+        source = sys.stdin.buffer if path == STDIN else open(path, 'rb')
+        filename = 'stdin' if path == STDIN else os.path.basename(path)
+        try:
+            if existing is not None and options['on_exists'] == ON_EXISTS_APPEND:
+                pipeline = MergePipeline(
+                    source, existing, IngestJob.MODE_APPEND, filename=filename, batch_size=options['batch_size']
+                )
+                pipeline.run()
+                report['status'] = 'appended'
+            else:
+                # A replacement is loaded under a temporary name, so the old table stays until it is complete
+                load_name = f'{table_name[:80]}_import_{uuid.uuid4().hex[:8]}' if existing else table_name
+                pipeline = ParallelIngestPipeline(
+                    source, load_name, filename=filename, storage_engine=options['storage_engine'],
+                    # Hashed like uploads, so re-importing an identical file copies its table in the database
+                    content_hash='' if path == STDIN else file_sha256(path),
+                    workers=options['file_workers'], batch_size=options['batch_size'],
+                )
+                csv_upload, _ = pipeline.run()
+                if existing is not None:
+                    replace_table(existing, csv_upload, table_name)
+                report['status'] = 'replaced' if existing else 'created'
+            report['rows'] = pipeline.rows_loaded
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+    except Exception as e:
+        report['error'] = str(e)
+    finally:
+        report['seconds'] = time.perf_counter() - started
+    return report
+
+
+def import_group(paths, table_name, options):
+    """Import the sources of one table in order (run in a pool process)"""
+    try:
+        return [import_file(path, table_name, options) for path in paths]
+    finally:
+        connection.close()
+
+
+def throughput(rows, size, seconds):
+    """Rows and megabytes per second, for the report lines"""
+    seconds = max(seconds, 1e-9)
+    rate = f'{rows / seconds:,.0f} rows/s'
+    if size:
+        rate += f', {size / 1e6 / seconds:,.1f} MB/s'
+    return rate
+
+
+class Command(BaseCommand):
+    help = (
+        'Load CSV, Parquet or Arrow files into tables without going through the upload form. '
+        'Sources may be files, glob patterns, directories or - for stdin; several files load at once.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('sources', nargs='+', help='Files, glob patterns, directories or - for stdin')
+        parser.add_argument(
+            '--workers', type=int, default=ingest_workers(),
+            help='Processes loading files at once; spare processes split large CSV files '
+                 '(default: CSV_INGEST_WORKERS)',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Rows per COPY chunk or INSERT batch (default: CSV_INGEST_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--table-name-template', default='{name}',
+            help='Table name for each file; {name} is the file name without extension, '
+                 '{parent} its directory name (default: {name})',
+        )
+        parser.add_argument(
+            '--on-exists', choices=[ON_EXISTS_SKIP, ON_EXISTS_REPLACE, ON_EXISTS_APPEND], default=ON_EXISTS_SKIP,
+            help='What to do when the table exists already (default: skip)',
+        )
+        parser.add_argument(
+            '--storage-engine', choices=[choice for choice, _ in CSVUpload.STORAGE_CHOICES], default=None,
+            help='Storage for new tables (default: CSV_STORAGE_ENGINE)',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        paths = expand_sources(options['sources'])
+        if not paths:
+            raise CommandError('No CSV, Parquet or Arrow files to import')
+
+        # Sources sharing a table are imported in order by one process
+        groups = {}
+        for path in paths:
+            groups.setdefault(table_name_for(path, options['table_name_template']), []).append(path)
+        stdin_table = next((name for name, group in groups.items() if STDIN in group), None)
+
+        workers = options['workers']
+        if connection.vendor == 'sqlite' and workers > 1:
+            self.stdout.write(self.style.WARNING('SQLite has a single writer; importing one file at a time'))
+            workers = 1
+        file_options = {
+            'on_exists': options['on_exists'],
+            'batch_size': options['batch_size'],
+            'storage_engine': options['storage_engine'] or getattr(
+                settings, 'CSV_STORAGE_ENGINE', CSVUpload.STORAGE_JSON
+            ),
+            # Processes left over when there are fewer tables than workers parse large CSV files in parallel
+            'file_workers': max(1, workers // len(groups)),
+        }
+
+        started = time.perf_counter()
+        reports = []
+        # stdin cannot be handed to another process, so its table loads here
+        pooled = [(name, group) for name, group in groups.items() if name != stdin_table]
+        if workers > 1 and len(pooled) > 1:
+            pool = ProcessPoolExecutor(
+                min(workers, len(pooled)), mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+            )
+            with pool:
+                futures = [pool.submit(import_group, group, name, file_options) for name, group in pooled]
+                for future in as_completed(futures):
+                    for report in future.result():
+                        self.write_report(report)
+                        reports.append(report)
+        else:
+            for name, group in pooled:
+                for path in group:
+                    report = import_file(path, name, file_options)
+                    self.write_report(report)
+                    reports.append(report)
+        if stdin_table is not None:
+            for path in groups[stdin_table]:
+                report = import_file(path, stdin_table, file_options)
+                self.write_report(report)
+                reports.append(report)
+
+        failed = self.write_summary(reports, time.perf_counter() - started)
+        if failed:
+            raise CommandError(f'{failed} file(s) failed to import')
+
+    def write_report(self, report):
+        """One line per source: what happened and its throughput"""
+        source = 'stdin' if report['path'] == STDIN else report['path']
+        prefix = f'{source} -> "{report["table_name"]}"'
+        if report['status'] == 'failed':
+            self.stdout.write(self.style.ERROR(f'{prefix}: failed: {report["error"]}'))
+            return
+        if report['status'] == 'skipped':
+            self.stdout.write(f'{prefix}: skipped, the table exists')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}: {report["status"]}, {report["rows"]:,} rows in {report["seconds"]:.1f}s '
+            f'({throughput(report["rows"], report["bytes"], report["seconds"])})'
+        ))
+
+    def write_summary(self, reports, elapsed):
+        """Totals over all sources; returns the number that failed"""
+        counts = {}
+        for report in reports:
+            counts[report['status']] = counts.get(report['status'], 0) + 1
+        loaded = [report for report in reports if report['status'] not in ('failed', 'skipped')]
+        rows = sum(report['rows'] for report in loaded)
+        size = sum(report['bytes'] or 0 for report in loaded)
+        outcome = ', '.join(f'{count} {status}' for status, count in sorted(counts.items()))
+        self.stdout.write(
+            f'{len(reports)} file(s): {outcome}. {rows:,} rows, {size / 1e6:,.1f} MB in {elapsed:.1f}s '
+            f'({throughput(rows, size, elapsed)})'
+        )
+        return counts.get('failed', 0)
@@ -0,0 +1,74 @@
+import hashlib
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from csv_upload.models import CSVData, CSVUpload
+from csv_upload.partitions import partition_name
+
+
+def column_index_name(csv_upload, column):
+    """Stable, length-safe index name for one column of one upload"""
+    digest = hashlib.sha1(column.encode('utf-8')).hexdigest()[:10]
+    return f'csv_data_{csv_upload.pk}_{digest}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Create (or drop) a PostgreSQL expression index on one column of a JSON table, built on the table\'s CSVData partition. '
+        'The index matches the expression used for filter expressions and column sorts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('table_id', type=int, help='CSVUpload id of the table')
+        parser.add_argument('column', help='Column to index')
+        parser.add_argument('--drop', action='store_true', help='Drop the index instead of creating it')
+
+    def handle(self, *args, **options):
+        try:
+            csv_upload = CSVUpload.objects.get(id=options['table_id'])
+        except CSVUpload.DoesNotExist:
+            raise CommandError(f'Table {options["table_id"]} does not exist')
+        column = options['column']
+        if column not in csv_upload.get_columns():
+            raise CommandError(f'Column "{column}" does not exist in table "{csv_upload.table_name}"')
+        if csv_upload.uses_typed_table():
+            raise CommandError('Typed tables use real columns; index them with plain SQL')
+        if connection.vendor != 'postgresql':
+            raise CommandError('Column expression indexes are only supported on PostgreSQL')
+
+        name = column_index_name(csv_upload, column)
+        quote = connection.ops.quote_name
+        if options['drop']:
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {quote(name)}')
+            self.stdout.write(self.style.SUCCESS(f'Dropped index {name}'))
+            return
+
+        # Compile the same expression the queries use so the planner can match it
+        data_type = csv_upload.get_column_properties(column).get('data_type')
+        queryset = CSVData.objects.filter(csv_upload=csv_upload)
+        query = queryset.query
+        expression = queryset.column_sort_key(csv_upload.row_key(column), data_type).resolve_expression(query)
+        sql, params = query.get_compiler(connection=connection).compile(expression)
+        with connection.schema_editor(atomic=False) as schema_editor:
+            sql = sql % tuple(schema_editor.quote_value(param) for param in params)
+
+        table = quote(CSVData._meta.db_table)
+        # Unqualified, so the expression also applies to a partition
+        sql = sql.replace(f'{table}.', '')
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [partition_name(csv_upload)])
+            if cursor.fetchone()[0]:
+                # The upload's own partition holds only its rows; no predicate needed
+                target, predicate = quote(partition_name(csv_upload)), ''
+            else:
+                upload_column = quote(CSVData._meta.get_field('csv_upload').column)
+                target, predicate = table, f' WHERE {upload_column} = {int(csv_upload.pk)}'
+            cursor.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote(name)} ON {target} '
+                f'(({sql}), {quote("row_number")}){predicate}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Created index {name} on "{column}" ({data_type}) of table "{csv_upload.table_name}"'
+        ))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from csv_upload.models import CSVUpload
+from csv_upload.table_stats import measure_table
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the row, column and byte counters shown on the upload page from the stored rows '
+        'and report the tables whose counters had drifted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('table_ids', nargs='*', type=int, help='CSVUpload ids (default: every table)')
+
+    def handle(self, *args, **options):
+        uploads = CSVUpload.objects.ready()
+        if options['table_ids']:
+            uploads = uploads.filter(id__in=options['table_ids'])
+            missing = set(options['table_ids']) - set(uploads.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f'No table with id {", ".join(map(str, sorted(missing)))}')
+
+        corrected = 0
+        for upload_id in uploads.order_by('id').values_list('id', flat=True):
+            if self.reconcile(upload_id):
+                corrected += 1
+        self.stdout.write(self.style.SUCCESS(f'{corrected} table(s) corrected'))
+
+    def reconcile(self, upload_id):
+        """Recompute one table's counters; returns True if they had drifted"""
+        # Locked like record_cell_changes() so an edit cannot land between the scan and the write
+        with transaction.atomic():
+            csv_upload = CSVUpload.objects.select_for_update().get(id=upload_id)
+            counted = dict(zip(('row_count', 'byte_size', 'column_count'), measure_table(csv_upload)))
+            drift = {
+                field: (getattr(csv_upload, field), value)
+                for field, value in counted.items() if getattr(csv_upload, field) != value
+            }
+            if drift:
+                CSVUpload.objects.filter(id=upload_id).update(**counted)
+
+        if drift:
+            changes = ', '.join(f'{field} {old:,} -> {new:,}' for field, (old, new) in drift.items())
+            self.stdout.write(f'Table "{csv_upload.table_name}": {changes}')
+        return bool(drift)
@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from csv_upload.chunked_uploads import purge_expired_uploads
+from csv_upload.jobs import (
+    DEFAULT_PROGRESS_INTERVAL, DEFAULT_STALE_AFTER, claim_next_job, run_job, worker_name,
+)
+from csv_upload.models import IngestJob
+
+
+class Command(BaseCommand):
+    help = 'Process queued CSV ingest jobs. Several workers can run side by side.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once the queue is empty instead of polling for new jobs',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=2.0,
+            help='Seconds to wait between queue polls when idle (default: 2)',
+        )
+        parser.add_argument(
+            '--progress-interval', type=float, default=DEFAULT_PROGRESS_INTERVAL,
+            help='Seconds between progress updates on a running job (default: 1)',
+        )
+        parser.add_argument(
+            '--stale-after', type=int, default=DEFAULT_STALE_AFTER,
+            help='Re-claim running jobs without a heartbeat for this many seconds (default: 300)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Ingest worker {worker_name()} started')
+        try:
+            while True:
+                job = claim_next_job(stale_after=options['stale_after'])
+                if job is None:
+                    # Idle: clear out chunked uploads their clients abandoned
+                    purged = purge_expired_uploads()
+                    if purged:
+                        self.stdout.write(f'Purged {purged} expired chunked upload(s)')
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                self.stdout.write(f'Job {job.pk}: loading "{job.filename}" into table "{job.table_name}"')
+                job = run_job(job, progress_interval=options['progress_interval'])
+                if job.status == IngestJob.STATUS_DONE:
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Job {job.pk}: {job.rows_loaded} rows in {job.elapsed_seconds():.1f}s '
+                        f'({job.rows_per_second():,.0f} rows/s)'
+                    ))
+                else:
+                    self.stdout.write(self.style.ERROR(f'Job {job.pk} failed: {job.error}'))
+        except KeyboardInterrupt:
+            self.stdout.write('Ingest worker stopped')
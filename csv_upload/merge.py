@@ -0,0 +1,503 @@
+"""
+Incremental loads into an existing table.
+
+Append mode parses a delta file with the ingest pipeline and loads its rows
+after the table's last row. Upsert mode matches rows on the columns flagged
+``primary_key`` in the column properties: the delta is bulk loaded (COPY on
+PostgreSQL) into a temporary staging table, deduplicated (the last row of a
+key wins) and merged with set-based statements, so the cost follows the size
+of the delta rather than the table.
+
+Typed tables enforce their key with a constraint and merge with
+``INSERT ... ON CONFLICT DO UPDATE``. JSON rows have no unique index to
+conflict on (the key is not enforced there), so matched rows are rewritten
+with ``UPDATE ... FROM`` and the rest inserted with ``INSERT ... SELECT``;
+an expression index on the key, created by the first upsert, keeps both
+lookups off a full scan.
+
+Column profiles and the summary counters are updated from the delta alone:
+changed cells of matched rows go through apply_cell_changes() and new rows
+are profiled and folded in with merge_profiles().
+"""
+
+import hashlib
+import logging
+import time
+import uuid
+
+import pandas as pd
+from django.db import connection, transaction
+from django.db.models import Max
+
+from csv_upload.bulk_load import DEFAULT_BATCH_SIZE, LoadStats
+from csv_upload.expressions import json_path
+from csv_upload.ingest import IngestPipeline, SchemaWidened, dataframe_rows, get_loader
+from csv_upload.models import CSVData, CSVUpload, IngestJob
+from csv_upload.partitions import delete_rows, detach_partition, partition_name, uses_partitions
+from csv_upload.profiling import apply_cell_changes, merge_profiles
+from csv_upload.table_stats import frame_bytes, measure_table, text_bytes
+from csv_upload.typed_tables import (
+    ROW_ID, ROW_NUMBER, SEARCH_TEXT, display_value, drop_typed_table, physical_table_name, quote_literal,
+    widen_typed_columns,
+)
+
+logger = logging.getLogger(__name__)
+
+# Inference metadata for columns whose properties predate type inference
+DEFAULT_INFERENCE = {'confidence': 1.0, 'sample_size': 0, 'scores': {}, 'date_format': None}
+
+
+def last_row_number(csv_upload):
+    """Highest row_number stored in a table (0 if it is empty)"""
+    if csv_upload.uses_typed_table():
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT MAX({quote(ROW_NUMBER)}) FROM {quote(physical_table_name(csv_upload))}")
+            return cursor.fetchone()[0] or 0
+    return CSVData.objects.filter(csv_upload=csv_upload).aggregate(last=Max('row_number'))['last'] or 0
+
+
+def key_index_name(csv_upload, key_columns):
+    """Name of the expression index on the key of a JSON table"""
+    digest = hashlib.md5(','.join(str(csv_upload.row_key(name)) for name in key_columns).encode()).hexdigest()[:8]
+    table = partition_name(csv_upload) if uses_partitions() else f'{CSVData._meta.db_table}_{int(csv_upload.pk)}'
+    return f'{table}_key_{digest}'
+
+
+def drop_key_indexes(csv_upload):
+    """Drop the key indexes upserts created for a JSON table
+
+    On PostgreSQL they live on the upload's partition and go with it.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name GLOB %s",
+            [f'{CSVData._meta.db_table}_{int(csv_upload.pk)}_key_*']
+        )
+        for (name,) in cursor.fetchall():
+            cursor.execute(f'DROP INDEX IF EXISTS {quote(name)}')
+
+
+def delete_upload(csv_upload):
+    """Delete a table with its rows and everything loads created for it
+
+    Called outside a transaction, the table is hidden and its partition
+    detached concurrently before the rest goes in a transaction of its own,
+    so other tables stay readable throughout (see partitions.py). Inside a
+    transaction an attached partition is dropped with CSVData locked until
+    that transaction ends.
+    """
+    if not connection.in_atomic_block:
+        CSVUpload.objects.filter(pk=csv_upload.pk).update(is_ready=False)
+        detach_partition(csv_upload)
+    with transaction.atomic():
+        # Orphan any cached pages in case the id is ever reused
+        csv_upload.bump_data_version()
+        if csv_upload.uses_typed_table():
+            drop_typed_table(csv_upload)
+        # Drops the upload's partition (PostgreSQL) instead of cascading row by row
+        delete_rows(csv_upload)
+        drop_key_indexes(csv_upload)
+        csv_upload.delete()
+
+
+def _stored_text(value, boolean=False):
+    """Stored value as the text profiles are kept in"""
+    if boolean and isinstance(value, int):
+        # SQLite hands BOOLEAN columns back as 0/1
+        value = bool(value)
+    return display_value(value)
+
+
+class MergePipeline(IngestPipeline):
+    """Parse a CSV source chunk by chunk and append or upsert it into an existing table"""
+
+    def __init__(self, source, csv_upload, mode, filename=None, memory_budget=None, batch_size=None):
+        super().__init__(
+            source, csv_upload.table_name, filename=filename, memory_budget=memory_budget,
+            storage_engine=csv_upload.storage_engine, batch_size=batch_size
+        )
+        if mode not in (IngestJob.MODE_APPEND, IngestJob.MODE_UPSERT):
+            raise ValueError(f'Unknown merge mode "{mode}"')
+        self.csv_upload = csv_upload
+        self.mode = mode
+        self.key_columns = []
+        self.staging_table = None
+        self.target_table = None
+        self.rows_inserted = 0
+        self.rows_updated = 0
+
+    def update_schema(self, chunk):
+        """Check a chunk's columns against the table and widen its types to fit the chunk"""
+        missing = [name for name in self.columns_info if name not in chunk.columns]
+        unexpected = [name for name in chunk.columns if name not in self.columns_info]
+        if missing or unexpected:
+            problems = []
+            if missing:
+                problems.append(f'missing {", ".join(missing)}')
+            if unexpected:
+                problems.append(f'unknown {", ".join(unexpected)}')
+            raise ValueError(f'The file\'s columns do not match table "{self.table_name}": {"; ".join(problems)}')
+
+        changed = self.widen_schema(chunk)
+        for name in changed:
+            if self.mode == IngestJob.MODE_UPSERT and name in self.key_columns:
+                raise ValueError(
+                    f'Key column "{name}" would change type to {self.columns_info[name]["data_type"]}, '
+                    f'so its values could no longer be matched'
+                )
+        return changed
+
+    def run(self):
+        """Load every chunk into the existing table in one transaction
+
+        As in IngestPipeline.run(), a column widened after rows were loaded
+        rolls the delta back and loads it again with the final types.
+        """
+        started = time.perf_counter()
+        upsert = self.mode == IngestJob.MODE_UPSERT
+
+        with transaction.atomic():
+            # Merges into one table run one at a time, and cell edits wait for the commit
+            csv_upload = self.csv_upload = CSVUpload.objects.select_for_update().get(pk=self.csv_upload.pk)
+            self.columns_info = {}
+            for name in csv_upload.get_column_names():
+                self.columns_info[name] = dict(csv_upload.get_column_properties(name))
+                self.columns_info[name].setdefault('type_inference', dict(DEFAULT_INFERENCE))
+            self.key_columns = [name for name, properties in self.columns_info.items() if properties.get('primary_key')]
+            if upsert and not self.key_columns:
+                raise ValueError(
+                    f'Table "{csv_upload.table_name}" has no primary key column to match rows on. '
+                    f'Mark one in its column settings first.'
+                )
+
+            first_row = last_row_number(csv_upload) + 1
+            if upsert:
+                self.create_staging_table()
+            table_types = {name: properties['data_type'] for name, properties in self.columns_info.items()}
+            self.prepare_source()
+            chunks = self.iter_chunks()
+            try:
+                try:
+                    # A savepoint, so a restart drops the delta's rows and leaves the table as it was
+                    with transaction.atomic():
+                        widened_table, load_seconds = self.load_delta(chunks, first_row, table_types)
+                except SchemaWidened:
+                    for chunk in chunks:
+                        self.update_schema(chunk)
+                    chunks.close()
+                    logger.info(
+                        'Reloading the delta for "%s" with column types widened after %d chunk(s)',
+                        self.table_name, self.chunks_loaded
+                    )
+                    self.rewind()
+                    chunks = self.iter_chunks()
+                    widened_table, load_seconds = self.load_delta(chunks, first_row, table_types)
+            finally:
+                chunks.close()
+                if self.spooled_source is not None:
+                    self.spooled_source.close()
+
+            if self.column_names is None:
+                raise ValueError('The CSV file has no header row.')
+
+            column_stats = csv_upload.get_column_stats()
+            if upsert:
+                self.merge_staging_table(first_row, column_stats)
+            else:
+                self.rows_inserted = self.rows_loaded
+            for name, delta in self.profiler.finish().items():
+                if name in column_stats:
+                    merge_profiles(column_stats[name], delta)
+
+            csv_upload.set_column_stats(column_stats)
+            csv_upload.row_count += self.rows_inserted
+            csv_upload.byte_size += self.cell_bytes
+            if widened_table:
+                # A widened column changes how existing values print (1 -> 1.0), and the ALTER rewrote
+                # every row anyway, so the size is measured again
+                csv_upload.byte_size = measure_table(csv_upload)[1]
+            csv_upload.save(update_fields=['columns', 'column_stats', 'row_count', 'byte_size'])
+            csv_upload.bump_data_version()
+
+        total = LoadStats(self.rows_loaded, time.perf_counter() - started, self.mode)
+        logger.info(
+            'Merged %d chunk(s) into "%s": %s, %d inserted, %d updated (%.2fs spent loading)',
+            self.chunks_loaded, self.table_name, total, self.rows_inserted, self.rows_updated, load_seconds
+        )
+        return csv_upload, total
+
+    def load_delta(self, chunks, first_row, table_types):
+        """Load chunks into the table, or the staging table of an upsert
+
+        Columns the first chunk widens past table_types are altered before it
+        loads; a later chunk that widens one raises SchemaWidened. Returns
+        (whether the typed table was altered, seconds spent loading).
+        """
+        csv_upload = self.csv_upload
+        upsert = self.mode == IngestJob.MODE_UPSERT
+        widened_table = False
+        load_seconds = 0.0
+        for chunk in chunks:
+            if self.chunks_loaded:
+                if self.update_schema(chunk):
+                    raise SchemaWidened()
+            else:
+                self.update_schema(chunk)
+                changed_columns = [
+                    name for name, properties in self.columns_info.items() if properties['data_type'] != table_types[name]
+                ]
+                if changed_columns:
+                    csv_upload.set_columns(self.columns_info)
+                    if csv_upload.uses_typed_table():
+                        widened_table = True
+                        widen_typed_columns(csv_upload, changed_columns, previous_types=table_types)
+                        if self.staging_table:
+                            widen_typed_columns(csv_upload, changed_columns, table=self.staging_table)
+
+            chunk = self.canonicalize(chunk)
+            stats = get_loader(csv_upload, self.staging_table, self.batch_size).load(
+                dataframe_rows(chunk, start=first_row + self.rows_loaded)
+            )
+            if not upsert:
+                # Appended rows are all new, so they are profiled as they load
+                self.profiler.update(chunk)
+                self.cell_bytes += frame_bytes(chunk)
+            self.rows_loaded += stats.rows
+            self.chunks_loaded += 1
+            self.bytes_read = self.source_position()
+            load_seconds += stats.elapsed
+        return widened_table, load_seconds
+
+    # Upsert staging
+
+    def row_number_column(self):
+        return ROW_NUMBER if self.csv_upload.uses_typed_table() else 'row_number'
+
+    def value_columns(self, alias):
+        """Select list of the stored cell values (row_data for JSON tables)"""
+        quote = connection.ops.quote_name
+        if self.csv_upload.uses_typed_table():
+            return [f'{alias}.{quote(name)}' for name in self.columns_info]
+        return [f'{alias}.{quote("row_data")}']
+
+    def key_expressions(self, alias=None):
+        """SQL of each key column's value; JSON keys compare as text"""
+        quote = connection.ops.quote_name
+        prefix = f'{alias}.' if alias else ''
+        if self.csv_upload.uses_typed_table():
+            return [f'{prefix}{quote(name)}' for name in self.key_columns]
+        expressions = []
+        for name in self.key_columns:
+            key = self.csv_upload.row_key(name)
+            # Keys are inlined so the expressions match the key index
+            if connection.vendor == 'postgresql':
+                literal = str(key) if isinstance(key, int) else quote_literal(key)
+                expressions.append(f'({prefix}{quote("row_data")} ->> {literal})')
+            else:
+                expressions.append(f'json_extract({prefix}{quote("row_data")}, {quote_literal(json_path(key))})')
+        return expressions
+
+    def match_condition(self):
+        """Join condition between staging rows (s) and table rows (t) with the same key"""
+        conditions = [
+            f'{target} = {staged}' for target, staged in zip(self.key_expressions('t'), self.key_expressions('s'))
+        ]
+        if not self.csv_upload.uses_typed_table():
+            upload_column = connection.ops.quote_name(CSVData._meta.get_field('csv_upload').column)
+            # Inlined so SQLite can use the partial key index
+            conditions.insert(0, f't.{upload_column} = {int(self.csv_upload.pk)}')
+        return ' AND '.join(conditions)
+
+    def target_reference(self):
+        """The table as ``t`` in a FROM clause"""
+        quote = connection.ops.quote_name
+        reference = f'{quote(self.target_table)} AS t'
+        if connection.vendor == 'sqlite' and not self.csv_upload.uses_typed_table():
+            # Without statistics on CSVData SQLite would rather walk the upload's rows by csv_data_upload_row_idx
+            reference += f' INDEXED BY {quote(key_index_name(self.csv_upload, self.key_columns))}'
+        return reference
+
+    def create_staging_table(self):
+        """Create the empty temporary table the delta is loaded into"""
+        quote = connection.ops.quote_name
+        csv_upload = self.csv_upload
+        self.staging_table = f'csv_merge_{int(csv_upload.pk)}_{uuid.uuid4().hex[:8]}'
+        if csv_upload.uses_typed_table():
+            self.target_table = physical_table_name(csv_upload)
+            columns = [ROW_NUMBER, SEARCH_TEXT, *self.columns_info]
+            source = self.target_table
+        else:
+            # On PostgreSQL every JSON upload has a partition of its own (migration 0011)
+            self.target_table = partition_name(csv_upload) if uses_partitions() else CSVData._meta.db_table
+            columns = [CSVData._meta.get_field('csv_upload').column, 'row_number', 'row_data', 'search_text']
+            source = CSVData._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {quote(self.staging_table)} AS "
+                f"SELECT {', '.join(quote(name) for name in columns)} FROM {quote(source)} WHERE 1 = 0"
+            )
+
+    def ensure_key_index(self):
+        """Index the key of a JSON table so matching rows are looked up, not scanned for"""
+        quote = connection.ops.quote_name
+        name = key_index_name(self.csv_upload, self.key_columns)
+        expressions = ', '.join(self.key_expressions())
+        with connection.cursor() as cursor:
+            if uses_partitions():
+                cursor.execute('SELECT to_regclass(%s)', [quote(name)])
+                if cursor.fetchone()[0] is None:
+                    cursor.execute(f'CREATE INDEX {quote(name)} ON {quote(self.target_table)} ({expressions})')
+                    # Statistics on the key expression, and on a partition autovacuum may not have reached yet
+                    cursor.execute(f'ANALYZE {quote(self.target_table)}')
+            else:
+                upload_column = quote(CSVData._meta.get_field('csv_upload').column)
+                # Partial, so only this upload's rows are indexed
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(self.target_table)} ({expressions}) '
+                    f'WHERE {upload_column} = {int(self.csv_upload.pk)}'
+                )
+
+    def prepare_staging_table(self):
+        """Reject rows without a key and keep only the last row of each key"""
+        quote = connection.ops.quote_name
+        staging = quote(self.staging_table)
+        row_number = quote(self.row_number_column())
+        keys = self.key_expressions()
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT 1 FROM {staging} WHERE {' OR '.join(f'{key} IS NULL' for key in keys)} LIMIT 1")
+            if cursor.fetchone():
+                raise ValueError(f'Every row needs a value in the key column(s) {", ".join(self.key_columns)}')
+            cursor.execute(
+                f"DELETE FROM {staging} WHERE {row_number} NOT IN "
+                f"(SELECT MAX({row_number}) FROM {staging} GROUP BY {', '.join(keys)})"
+            )
+            # Without statistics on the fresh table the planners scan it once per table row
+            cursor.execute(f'ANALYZE {staging}')
+
+    def stored_rows(self, records, offset=0):
+        """Row dicts of stored text for fetched records, reading values from offset on"""
+        if self.csv_upload.uses_typed_table():
+            names = list(self.columns_info)
+            booleans = {name for name in names if self.columns_info[name].get('data_type') == 'BOOLEAN'}
+            return [
+                {name: _stored_text(value, name in booleans) for name, value in zip(names, record[offset:])}
+                for record in records
+            ]
+        rows = []
+        for record in records:
+            row = self.csv_upload.decode_row(record[offset])
+            rows.append({name: _stored_text(row.get(name)) for name in self.columns_info})
+        return rows
+
+    def profile_matched_rows(self, column_stats):
+        """Fold the changed cells of matched rows into the profiles and byte size"""
+        quote = connection.ops.quote_name
+        staged = self.value_columns('s')
+        sql = (
+            f"SELECT {', '.join(staged + self.value_columns('t'))} FROM {quote(self.staging_table)} AS s "
+            f"JOIN {self.target_reference()} ON {self.match_condition()}"
+        )
+        cursor = connection.chunked_cursor()
+        try:
+            cursor.execute(sql)
+            while True:
+                records = cursor.fetchmany(DEFAULT_BATCH_SIZE)
+                if not records:
+                    break
+                changes = {}
+                for new_row, old_row in zip(self.stored_rows(records), self.stored_rows(records, len(staged))):
+                    for name, new in new_row.items():
+                        old = old_row[name]
+                        if old != new:
+                            changes.setdefault(name, []).append((old, new))
+                            self.cell_bytes += text_bytes(new) - text_bytes(old)
+                for name, column_changes in changes.items():
+                    if name in column_stats:
+                        apply_cell_changes(column_stats[name], column_changes)
+        finally:
+            cursor.close()
+
+    def profile_new_rows(self):
+        """Profile the staging rows that match no table row"""
+        quote = connection.ops.quote_name
+        sql = (
+            f"SELECT {', '.join(self.value_columns('s'))} FROM {quote(self.staging_table)} AS s "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {self.target_reference()} WHERE {self.match_condition()})"
+        )
+        cursor = connection.chunked_cursor()
+        try:
+            cursor.execute(sql)
+            while True:
+                records = cursor.fetchmany(DEFAULT_BATCH_SIZE)
+                if not records:
+                    break
+                frame = pd.DataFrame.from_records(self.stored_rows(records), columns=list(self.columns_info))
+                self.profiler.update(frame)
+                self.cell_bytes += frame_bytes(frame)
+        finally:
+            cursor.close()
+
+    def merge_staging_table(self, first_row, column_stats):
+        """Merge the staged delta into the table, new rows numbered from first_row"""
+        if not self.csv_upload.uses_typed_table():
+            self.ensure_key_index()
+        self.prepare_staging_table()
+        # Profiles read the old values, so they are updated before the rows are
+        self.profile_matched_rows(column_stats)
+        self.profile_new_rows()
+
+        quote = connection.ops.quote_name
+        staging = quote(self.staging_table)
+        target = quote(self.target_table)
+        match = self.match_condition()
+        with connection.cursor() as cursor:
+            if self.csv_upload.uses_typed_table():
+                # Rows that will insert; the upsert's row count covers inserts and updates together
+                cursor.execute(
+                    f"SELECT COUNT(*) FROM {staging} AS s WHERE NOT EXISTS (SELECT 1 FROM {target} AS t WHERE {match})"
+                )
+                new_rows = cursor.fetchone()[0]
+                columns = [quote(name) for name in self.columns_info]
+                updates = [
+                    f'{quote(name)} = excluded.{quote(name)}'
+                    for name in self.columns_info if name not in self.key_columns
+                ]
+                if updates:
+                    updates.append(f'{quote(SEARCH_TEXT)} = excluded.{quote(SEARCH_TEXT)}')
+                # Matched rows keep their row number; new rows are numbered without gaps by a running count
+                cursor.execute(
+                    f"INSERT INTO {target} ({quote(ROW_NUMBER)}, {quote(SEARCH_TEXT)}, {', '.join(columns)}) "
+                    f"SELECT %s + SUM(CASE WHEN t.{quote(ROW_ID)} IS NULL THEN 1 ELSE 0 END) "
+                    f"OVER (ORDER BY s.{quote(ROW_NUMBER)}), "
+                    f"s.{quote(SEARCH_TEXT)}, {', '.join(self.value_columns('s'))} "
+                    f"FROM {staging} AS s LEFT JOIN {target} AS t ON {match} "
+                    # WHERE keeps SQLite from reading ON CONFLICT as a join constraint
+                    f"WHERE 1 = 1 "
+                    f"ON CONFLICT ({', '.join(quote(name) for name in self.key_columns)}) "
+                    f"DO {'UPDATE SET ' + ', '.join(updates) if updates else 'NOTHING'}",
+                    [first_row - 1]
+                )
+                self.rows_inserted = new_rows
+                # DO NOTHING (a table of key columns only) leaves matched rows as they are
+                self.rows_updated = cursor.rowcount - new_rows
+            else:
+                upload_column = quote(CSVData._meta.get_field('csv_upload').column)
+                cursor.execute(
+                    f"UPDATE {self.target_reference()} SET {quote('row_data')} = s.{quote('row_data')}, "
+                    f"{quote('search_text')} = s.{quote('search_text')} FROM {staging} AS s WHERE {match}"
+                )
+                self.rows_updated = cursor.rowcount
+                cursor.execute(
+                    f"INSERT INTO {target} ({upload_column}, {quote('row_number')}, {quote('row_data')}, "
+                    f"{quote('search_text')}) "
+                    f"SELECT s.{upload_column}, %s + ROW_NUMBER() OVER (ORDER BY s.{quote('row_number')}), "
+                    f"s.{quote('row_data')}, s.{quote('search_text')} FROM {staging} AS s "
+                    f"WHERE NOT EXISTS (SELECT 1 FROM {self.target_reference()} WHERE {match})",
+                    [first_row - 1]
+                )
+                self.rows_inserted = cursor.rowcount
+            cursor.execute(f'DROP TABLE {staging}')
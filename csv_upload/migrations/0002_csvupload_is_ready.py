@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('csv_upload', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvupload',
+            name='is_ready',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('csv_upload', '0003_ingestjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvupload',
+            name='storage_engine',
+            field=models.CharField(choices=[('json', 'JSON rows (CSVData)'), ('table', 'Typed SQL table')], default='json', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='ingestjob',
+            name='storage_engine',
+            field=models.CharField(choices=[('json', 'JSON rows (CSVData)'), ('table', 'Typed SQL table')], default='json', max_length=20),
+        ),
+    ]
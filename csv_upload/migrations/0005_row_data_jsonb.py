@@ -0,0 +1,96 @@
+# Converts CSVData.row_data from JSON text to jsonb.
+#
+# The migration is non-atomic: existing rows are converted in id-range
+# batches that commit one by one, so large tables are never rewritten in a
+# single long transaction. It keeps no checkpoint, though: the row_json
+# column is already added when the conversion starts, so an interrupted run
+# cannot simply be started again and has to be finished or undone by hand.
+
+from django.db import migrations, models
+
+BATCH_SIZE = 50000
+
+
+def _id_batches(cursor, table, quote):
+    cursor.execute(f"SELECT MIN({quote('id')}), MAX({quote('id')}) FROM {quote(table)}")
+    low, high = cursor.fetchone()
+    if low is None:
+        return
+    for start in range(low, high + 1, BATCH_SIZE):
+        yield start, start + BATCH_SIZE
+
+
+def convert_rows(apps, schema_editor):
+    CSVData = apps.get_model('csv_upload', 'CSVData')
+    connection = schema_editor.connection
+    quote = connection.ops.quote_name
+    table = CSVData._meta.db_table
+
+    if connection.vendor == 'postgresql':
+        cast = f"{quote('row_data')}::jsonb"
+    elif connection.vendor == 'sqlite':
+        cast = f"json({quote('row_data')})"
+    else:
+        cast = f"CAST({quote('row_data')} AS JSON)"
+
+    with connection.cursor() as cursor:
+        for start, end in _id_batches(cursor, table, quote):
+            cursor.execute(
+                f"UPDATE {quote(table)} SET {quote('row_json')} = {cast} "
+                f"WHERE {quote('id')} >= %s AND {quote('id')} < %s AND {quote('row_json')} IS NULL",
+                [start, end]
+            )
+
+
+def revert_rows(apps, schema_editor):
+    CSVData = apps.get_model('csv_upload', 'CSVData')
+    connection = schema_editor.connection
+    quote = connection.ops.quote_name
+    table = CSVData._meta.db_table
+    cast = f"{quote('row_json')}::text" if connection.vendor == 'postgresql' else f"CAST({quote('row_json')} AS TEXT)"
+
+    with connection.cursor() as cursor:
+        for start, end in _id_batches(cursor, table, quote):
+            cursor.execute(
+                f"UPDATE {quote(table)} SET {quote('row_data')} = {cast} "
+                f"WHERE {quote('id')} >= %s AND {quote('id')} < %s",
+                [start, end]
+            )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('csv_upload', '0004_storage_engine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvdata',
+            name='row_json',
+            field=models.JSONField(null=True),
+        ),
+        # Nullable so the old column can be re-added and refilled when reversing
+        migrations.AlterField(
+            model_name='csvdata',
+            name='row_data',
+            field=models.TextField(null=True),
+        ),
+        migrations.RunPython(convert_rows, revert_rows),
+        migrations.RemoveField(
+            model_name='csvdata',
+            name='row_data',
+        ),
+        migrations.RenameField(
+            model_name='csvdata',
+            old_name='row_json',
+            new_name='row_data',
+        ),
+        migrations.AlterField(
+            model_name='csvdata',
+            name='row_data',
+            field=models.JSONField(),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('csv_upload', '0005_row_data_jsonb'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='csvdata',
+            index=models.Index(fields=['csv_upload', 'row_number'], name='csv_data_upload_row_idx'),
+        ),
+    ]
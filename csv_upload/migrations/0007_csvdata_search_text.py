@@ -0,0 +1,96 @@
+# Adds CSVData.search_text (cell values only) and the index behind the
+# table filter box: a pg_trgm GIN index on PostgreSQL, an FTS5 trigram table
+# kept in sync by triggers on SQLite.
+#
+# Like 0004 the migration is non-atomic and backfills in id-range batches.
+
+from django.db import migrations, models
+
+BATCH_SIZE = 50000
+TRIGRAM_INDEX_NAME = 'csv_data_search_trgm'
+FTS_TABLE = 'csv_upload_csvdata_fts'
+
+
+def backfill_search_text(apps, schema_editor):
+    CSVData = apps.get_model('csv_upload', 'CSVData')
+    connection = schema_editor.connection
+    quote = connection.ops.quote_name
+    table = CSVData._meta.db_table
+
+    if connection.vendor == 'postgresql':
+        values = f"(SELECT string_agg(cell.value, E'\\n') FROM jsonb_each_text({quote('row_data')}) AS cell)"
+    else:
+        values = f"(SELECT group_concat(cell.value, char(10)) FROM json_each({quote('row_data')}) AS cell)"
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT MIN({quote('id')}), MAX({quote('id')}) FROM {quote(table)}")
+        low, high = cursor.fetchone()
+        if low is None:
+            return
+        for start in range(low, high + 1, BATCH_SIZE):
+            cursor.execute(
+                f"UPDATE {quote(table)} SET {quote('search_text')} = COALESCE({values}, '') "
+                f"WHERE {quote('id')} >= %s AND {quote('id')} < %s",
+                [start, start + BATCH_SIZE]
+            )
+
+
+def create_search_index(apps, schema_editor):
+    CSVData = apps.get_model('csv_upload', 'CSVData')
+    vendor = schema_editor.connection.vendor
+    table = CSVData._meta.db_table
+
+    if vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX_NAME} ON {schema_editor.quote_name(table)} "
+            f"USING gin (search_text gin_trgm_ops)"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"search_text, content='{table}', content_rowid='id', tokenize='trigram')"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF search_text ON {table} BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+            f"INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END"
+        )
+        schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(f"DROP INDEX IF EXISTS {TRIGRAM_INDEX_NAME}")
+    elif vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('csv_upload', '0006_csvdata_upload_row_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvdata',
+            name='search_text',
+            field=models.TextField(default=''),
+        ),
+        migrations.RunPython(backfill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('csv_upload', '0007_csvdata_search_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvupload',
+            name='data_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('csv_upload', '0008_csvupload_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvupload',
+            name='column_stats',
+            field=models.TextField(default='{}'),
+        ),
+    ]
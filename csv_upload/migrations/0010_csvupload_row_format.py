@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('csv_upload', '0009_csvupload_column_stats'),
+    ]
+
+    operations = [
+        # Existing tables keep their keyed rows until compact_row_data rewrites them
+        migrations.AddField(
+            model_name='csvupload',
+            name='row_format',
+            field=models.CharField(choices=[('object', 'JSON object keyed by column name'), ('array', 'JSON array in column order')], default='object', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='csvupload',
+            name='row_format',
+            field=models.CharField(choices=[('object', 'JSON object keyed by column name'), ('array', 'JSON array in column order')], default='array', max_length=10),
+        ),
+    ]
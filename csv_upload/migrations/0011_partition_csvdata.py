@@ -0,0 +1,126 @@
+# Turns CSVData into a table list-partitioned by csv_upload_id on
+# PostgreSQL, with one partition per upload, so a table is deleted by
+# detaching and dropping its partition (see csv_upload/partitions.py). Every
+# JSON upload gets a partition, even one without rows yet. There is no
+# default partition: PostgreSQL refuses DETACH PARTITION ... CONCURRENTLY
+# while one exists.
+#
+# PostgreSQL cannot partition an existing table in place: the table is
+# renamed, a partitioned table with the same columns takes its name, the rows
+# are copied across and the old table is dropped. Foreign keys and indexes are
+# recreated under their old names. The id sequence becomes a plain sequence
+# because partitioned tables only take identity columns from PostgreSQL 17.
+# The copy runs in one transaction that locks CSVData until it commits.
+# Other backends are left alone.
+
+from django.db import migrations
+
+
+def _foreign_keys(cursor, table):
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table]
+    )
+    return cursor.fetchall()
+
+
+def _index_definitions(cursor, table):
+    """CREATE INDEX statements of a table's indexes, constraint indexes excluded"""
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+        "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)",
+        [table, table]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _detach_id_sequence(cursor, table, quote, sequence_name):
+    """Free the id sequence from its table; returns the sequence as SQL"""
+    cursor.execute("SELECT attidentity FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'id'", [table])
+    identity = cursor.fetchone()[0]
+    cursor.execute(f"SELECT COALESCE(MAX({quote('id')}), 0) + 1 FROM {quote(table)}")
+    next_id = cursor.fetchone()[0]
+    if identity:
+        # Dropping the identity drops its sequence; a plain one takes over its name
+        sequence = quote(sequence_name)
+        cursor.execute(f"ALTER TABLE {quote(table)} ALTER COLUMN {quote('id')} DROP IDENTITY")
+        cursor.execute(f"CREATE SEQUENCE {sequence}")
+    else:
+        # Already a plain sequence (the reverse direction)
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence = cursor.fetchone()[0]
+        cursor.execute(f"ALTER TABLE {quote(table)} ALTER COLUMN {quote('id')} DROP DEFAULT")
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    cursor.execute("SELECT setval(%s, %s, false)", [sequence, next_id])
+    return sequence
+
+
+def _rebuild(apps, schema_editor, partitioned):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    CSVData = apps.get_model('csv_upload', 'CSVData')
+    CSVUpload = apps.get_model('csv_upload', 'CSVUpload')
+    quote = connection.ops.quote_name
+    table = CSVData._meta.db_table
+    old_table = f'{table}_old'
+    upload_column = CSVData._meta.get_field('csv_upload').column
+
+    with connection.cursor() as cursor:
+        foreign_keys = _foreign_keys(cursor, table)
+        indexes = _index_definitions(cursor, table)
+
+        cursor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(old_table)}")
+        cursor.execute(f"ALTER TABLE {quote(old_table)} DROP CONSTRAINT IF EXISTS {quote(table + '_pkey')}")
+        for name, _ in foreign_keys:
+            cursor.execute(f"ALTER TABLE {quote(old_table)} DROP CONSTRAINT {quote(name)}")
+        sequence = _detach_id_sequence(cursor, old_table, quote, f'{table}_id_seq')
+
+        partition_by = f" PARTITION BY LIST ({quote(upload_column)})" if partitioned else ''
+        cursor.execute(f"CREATE TABLE {quote(table)} (LIKE {quote(old_table)}){partition_by}")
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} ALTER COLUMN {quote('id')} SET DEFAULT nextval(%s::regclass)", [sequence]
+        )
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {quote(table)}.{quote('id')}")
+
+        if partitioned:
+            cursor.execute(f"SELECT DISTINCT {quote(upload_column)} FROM {quote(old_table)}")
+            upload_ids = {upload_id for (upload_id,) in cursor.fetchall()}
+            upload_ids.update(CSVUpload.objects.filter(storage_engine='json').values_list('id', flat=True))
+            for upload_id in sorted(upload_ids):
+                cursor.execute(
+                    f"CREATE TABLE {quote(f'{table}_p{int(upload_id)}')} PARTITION OF {quote(table)} "
+                    f"FOR VALUES IN ({int(upload_id)})"
+                )
+
+        cursor.execute(f"INSERT INTO {quote(table)} SELECT * FROM {quote(old_table)}")
+        # Dropping the old table also drops its indexes, freeing their names
+        cursor.execute(f"DROP TABLE {quote(old_table)}")
+
+        # A partitioned table's primary key has to include the partition key
+        key = f"{quote('id')}, {quote(upload_column)}" if partitioned else quote('id')
+        cursor.execute(f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(table + '_pkey')} PRIMARY KEY ({key})")
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}")
+        for definition in indexes:
+            cursor.execute(definition)
+
+
+def partition_csvdata(apps, schema_editor):
+    _rebuild(apps, schema_editor, partitioned=True)
+
+
+def unpartition_csvdata(apps, schema_editor):
+    _rebuild(apps, schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('csv_upload', '0010_csvupload_row_format'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_csvdata, unpartition_csvdata),
+    ]
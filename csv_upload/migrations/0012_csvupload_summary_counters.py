@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:05
+
+import json
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_summaries(apps, schema_editor):
+    # Row counts and sizes need a pass over the rows: run `manage.py reconcile_table_stats`
+    CSVUpload = apps.get_model('csv_upload', 'CSVUpload')
+    for csv_upload in CSVUpload.objects.only('id', 'columns', 'uploaded_at'):
+        CSVUpload.objects.filter(pk=csv_upload.pk).update(
+            column_count=len(json.loads(csv_upload.columns or '{}')),
+            last_modified=csv_upload.uploaded_at,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('csv_upload', '0011_partition_csvdata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvupload',
+            name='row_count',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='csvupload',
+            name='byte_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='csvupload',
+            name='column_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='csvupload',
+            name='last_modified',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
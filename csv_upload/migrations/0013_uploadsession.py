@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:35
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+import csv_upload.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('csv_upload', '0012_csvupload_summary_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('token', models.CharField(default=csv_upload.models.new_upload_token, editable=False, max_length=64)),
+                ('table_name', models.CharField(max_length=100)),
+                ('filename', models.CharField(max_length=255)),
+                ('storage_engine', models.CharField(choices=[('json', 'JSON rows (CSVData)'), ('table', 'Typed SQL table')], default='json', max_length=20)),
+                ('spool_path', models.CharField(max_length=500)),
+                ('total_bytes', models.BigIntegerField()),
+                ('received_bytes', models.BigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('open', 'Receiving chunks'), ('finalizing', 'Checking the file'), ('finalized', 'Finalized')], default='open', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('ingest_job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload_sessions', to='csv_upload.ingestjob')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='csv_uploadsession_status_idx')],
+            },
+        ),
+    ]
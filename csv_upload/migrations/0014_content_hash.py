@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('csv_upload', '0013_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvupload',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='ingestjob',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='uploadsession',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
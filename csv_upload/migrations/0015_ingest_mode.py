@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('csv_upload', '0014_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestjob',
+            name='mode',
+            field=models.CharField(choices=[('create', 'Create a new table'), ('append', 'Append to an existing table'), ('upsert', 'Upsert into an existing table (matched on its primary key)')], default='create', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='uploadsession',
+            name='mode',
+            field=models.CharField(choices=[('create', 'Create a new table'), ('append', 'Append to an existing table'), ('upsert', 'Upsert into an existing table (matched on its primary key)')], default='create', max_length=10),
+        ),
+    ]
@@ -0,0 +1,105 @@
+# Adds the _search_text column behind the table filter box to every typed
+# table (csv_table_<id>) and fills it with the row's displayed cell values
+# joined by newlines. On PostgreSQL it gets a pg_trgm GIN index like
+# CSVData.search_text (migration 0007).
+#
+# Like 0007 the migration is non-atomic and backfills each table in
+# _row_id batches. The display rules are copied from typed_tables so the
+# migration keeps working when they change.
+
+import datetime
+import json
+
+from django.db import migrations
+
+BATCH_SIZE = 5000
+SEARCH_TEXT = '_search_text'
+ROW_ID = '_row_id'
+
+
+def _display(value, boolean):
+    if boolean and isinstance(value, int):
+        value = bool(value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, memoryview):
+        value = value.tobytes()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return str(value)
+
+
+def _typed_tables(apps, schema_editor):
+    CSVUpload = apps.get_model('csv_upload', 'CSVUpload')
+    existing = set(schema_editor.connection.introspection.table_names())
+    for csv_upload in CSVUpload.objects.filter(storage_engine='table').only('id', 'columns'):
+        table = f'csv_table_{csv_upload.pk}'
+        if table in existing:
+            yield table, json.loads(csv_upload.columns)
+
+
+def add_search_text(apps, schema_editor):
+    connection = schema_editor.connection
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        trigram = False
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            trigram = cursor.fetchone() is not None
+        for table, columns in _typed_tables(apps, schema_editor):
+            names = list(columns)
+            booleans = [
+                (properties.get('data_type') if isinstance(properties, dict) else properties) == 'BOOLEAN'
+                for properties in columns.values()
+            ]
+            cursor.execute(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(SEARCH_TEXT)} TEXT NOT NULL DEFAULT ''")
+            select = f"SELECT {', '.join(quote(name) for name in [ROW_ID, *names])} FROM {quote(table)}"
+            last_id = 0
+            while True:
+                cursor.execute(
+                    f"{select} WHERE {quote(ROW_ID)} > %s ORDER BY {quote(ROW_ID)} LIMIT {BATCH_SIZE}", [last_id]
+                )
+                records = cursor.fetchall()
+                if not records:
+                    break
+                cursor.executemany(
+                    f"UPDATE {quote(table)} SET {quote(SEARCH_TEXT)} = %s WHERE {quote(ROW_ID)} = %s",
+                    [
+                        ('\n'.join(
+                            _display(value, boolean) for value, boolean in zip(record[1:], booleans)
+                            if value is not None
+                        ), record[0])
+                        for record in records
+                    ]
+                )
+                last_id = records[-1][0]
+            if trigram:
+                cursor.execute(
+                    f"CREATE INDEX {quote(table + '_search_trgm')} ON {quote(table)} "
+                    f"USING gin ({quote(SEARCH_TEXT)} gin_trgm_ops)"
+                )
+
+
+def drop_search_text(apps, schema_editor):
+    quote = schema_editor.connection.ops.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        for table, _ in _typed_tables(apps, schema_editor):
+            # Drops the trigram index with the column
+            cursor.execute(f"ALTER TABLE {quote(table)} DROP COLUMN {quote(SEARCH_TEXT)}")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('csv_upload', '0015_ingest_mode'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_text, drop_search_text),
+    ]
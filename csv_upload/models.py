@@ -1,13 +1,76 @@
-from django.db import models
+from django.db import connections, models
+from django.db.models.fields.json import KeyTextTransform
+from django.utils import timezone
 import json
+import secrets
+import uuid
+
+from csv_upload.expressions import JSONKeyAsNumber, JSONSetKey, json_path
+from csv_upload.search import RowSearchText, SearchTextContains, build_search_text
+
+
+class CSVUploadQuerySet(models.QuerySet):
+    """Upload queries; tables still being loaded are left out with ready()"""
+    
+    def ready(self):
+        """Tables whose ingest has committed"""
+        return self.filter(is_ready=True)
 
 
 class CSVUpload(models.Model):
     """Model to store CSV upload metadata"""
+    STORAGE_JSON = 'json'
+    STORAGE_TABLE = 'table'
+    STORAGE_CHOICES = [
+        (STORAGE_JSON, 'JSON rows (CSVData)'),
+        (STORAGE_TABLE, 'Typed SQL table'),
+    ]
+    ROW_FORMAT_OBJECT = 'object'
+    ROW_FORMAT_ARRAY = 'array'
+    ROW_FORMAT_CHOICES = [
+        (ROW_FORMAT_OBJECT, 'JSON object keyed by column name'),
+        (ROW_FORMAT_ARRAY, 'JSON array in column order'),
+    ]
+    
     filename = models.CharField(max_length=255)
     table_name = models.CharField(max_length=100, unique=True)
     columns = models.TextField()  # JSON string of column names and types with properties
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    storage_engine = models.CharField(max_length=20, choices=STORAGE_CHOICES, default=STORAGE_JSON)
+    data_version = models.PositiveIntegerField(default=0)  # Bumped on every change; keys the result cache
+    column_stats = models.TextField(default='{}')  # JSON string of per-column profiles (see profiling.py)
+    row_format = models.CharField(max_length=10, choices=ROW_FORMAT_CHOICES, default=ROW_FORMAT_ARRAY)
+    # Summary counters for the upload page, kept up to date on writes (see table_stats.py)
+    row_count = models.BigIntegerField(default=0)
+    byte_size = models.BigIntegerField(default=0)  # UTF-8 bytes of the non-null cell values
+    column_count = models.PositiveIntegerField(default=0)
+    last_modified = models.DateTimeField(default=timezone.now)
+    # SHA-256 of the uploaded file while the table still matches it; blank once rows or columns change (see dedup.py)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    # False while an ingest is loading the rows; such tables are hidden until it commits (see ingest.py)
+    is_ready = models.BooleanField(default=True)
+    
+    objects = CSVUploadQuerySet.as_manager()
+    
+    def uses_typed_table(self):
+        """True if rows live in a materialized table instead of CSVData"""
+        return self.storage_engine == self.STORAGE_TABLE
+    
+    def uses_row_arrays(self):
+        """True if CSVData rows are positional arrays instead of keyed objects"""
+        return self.row_format == self.ROW_FORMAT_ARRAY
+    
+    def bump_data_version(self, source_changed=True):
+        """Invalidate cached table results after rows or columns change
+
+        With source_changed the table no longer matches its uploaded file, so
+        it stops being a copy source for repeated uploads of that file.
+        """
+        changes = {'data_version': models.F('data_version') + 1, 'last_modified': timezone.now()}
+        if source_changed:
+            changes['content_hash'] = ''
+        CSVUpload.objects.filter(pk=self.pk).update(**changes)
+        self.refresh_from_db(fields=['data_version', 'last_modified', 'content_hash'])
     
     def get_columns(self):
         """Return columns as a Python object"""
@@ -17,6 +80,14 @@ class CSVUpload(models.Model):
         """Set columns from a Python object"""
         self.columns = json.dumps(columns_dict)
     
+    def get_column_stats(self):
+        """Return column profiles as a Python object"""
+        return json.loads(self.column_stats or '{}')
+    
+    def set_column_stats(self, stats_dict):
+        """Set column profiles from a Python object"""
+        self.column_stats = json.dumps(stats_dict)
+    
     def get_column_names(self):
         """Return just the column names as a list"""
         columns = self.get_columns()
@@ -27,6 +98,36 @@ class CSVUpload(models.Model):
             # Old format - just data types
             return list(columns.keys())
     
+    def _row_columns(self):
+        """Column names in row array order, parsed once per columns value"""
+        if getattr(self, '_row_columns_source', None) != self.columns:
+            self._row_columns_cache = self.get_column_names()
+            self._row_columns_source = self.columns
+        return self._row_columns_cache
+    
+    def row_key(self, column):
+        """Key of a column in row_data: its position for array rows, else its name"""
+        if self.uses_row_arrays():
+            return self._row_columns().index(column)
+        return column
+    
+    def encode_row(self, row_dict):
+        """Row dict in this table's row_data format"""
+        if self.uses_row_arrays():
+            return [row_dict.get(name) for name in self._row_columns()]
+        return row_dict
+    
+    def decode_row(self, row_data):
+        """Stored row_data of either format as a row dict"""
+        if isinstance(row_data, str):
+            # Rows written before the jsonb migration
+            row_data = json.loads(row_data)
+        if isinstance(row_data, list):
+            # Cells past the end of a short array read as null
+            names = self._row_columns()
+            return dict(zip(names, row_data + [None] * (len(names) - len(row_data))))
+        return row_data
+    
     def get_column_properties(self, column_name):
         """Get properties for a specific column"""
         columns = self.get_columns()
@@ -60,22 +161,254 @@ class CSVUpload(models.Model):
         return f"{self.filename} -> {self.table_name}"
 
 
+class CSVDataQuerySet(models.QuerySet):
+    """Row queries that run as jsonb operations in the database"""
+    NUMERIC_DATA_TYPES = ('INTEGER', 'REAL')
+    PATCH_BATCH_SIZE = 1000
+    
+    def search_values(self, text):
+        """Rows where any cell value contains text (JSON keys are not searched)"""
+        return self.filter(SearchTextContains(text))
+    
+    # Methods that take a column expect its row_data key, CSVUpload.row_key(column)
+    
+    def column_sort_key(self, column, data_type=None):
+        """Expression a column sorts on: numeric for INTEGER/REAL, text otherwise"""
+        if data_type in self.NUMERIC_DATA_TYPES:
+            return JSONKeyAsNumber(column, 'row_data')
+        # Wrapped so comparisons use plain text lookups, not JSON key lookups
+        return models.ExpressionWrapper(KeyTextTransform(column, 'row_data'), output_field=models.TextField())
+    
+    def order_by_column(self, column, descending=False, data_type=None):
+        """Order by one column of row_data, then by row number
+
+        INTEGER and REAL columns sort numerically; other types sort on the
+        stored text. Empty and unparsable cells always sort last.
+        """
+        value = self.column_sort_key(column, data_type)
+        ordering = value.desc(nulls_last=True) if descending else value.asc(nulls_last=True)
+        return self.order_by(ordering, 'row_number')
+    
+    def set_cell(self, row_id, column, value):
+        """Rewrite one key of one row in place; returns the number of rows updated"""
+        return self.filter(id=row_id).update(
+            row_data=JSONSetKey('row_data', column, value),
+            search_text=RowSearchText(JSONSetKey('row_data', column, value))
+        )
+    
+    def set_cells(self, changes):
+        """Apply {row_id: {column: value}} edits with set-based UPDATEs
+
+        On PostgreSQL each batch of keyed rows is one ``UPDATE ... FROM
+        (VALUES ...)`` merging a jsonb patch object; array rows, and all rows
+        elsewhere, get one such UPDATE per column setting a single path.
+        Returns the set of row ids that were updated.
+        """
+        found = dict(self.filter(id__in=list(changes)).values_list('id', 'csv_upload_id'))
+        existing = set(found)
+        if not existing:
+            return existing
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        row_ids = sorted(existing)
+        # Naming the uploads lets PostgreSQL prune the scan to their partitions
+        upload_ids = sorted(set(found.values()))
+        upload_column = quote(self.model._meta.get_field('csv_upload').column)
+        in_uploads = f"IN ({', '.join(['%s'] * len(upload_ids))})"
+        
+        with connection.cursor() as cursor:
+            for start in range(0, len(row_ids), self.PATCH_BATCH_SIZE):
+                batch = row_ids[start:start + self.PATCH_BATCH_SIZE]
+                positional = any(isinstance(column, int) for row_id in batch for column in changes[row_id])
+                if connection.vendor == 'postgresql' and not positional:
+                    values = ', '.join(['(%s::bigint, %s::jsonb)'] * len(batch))
+                    params = [param for row_id in batch for param in (row_id, json.dumps(changes[row_id]))]
+                    cursor.execute(
+                        f"UPDATE {table} AS d SET {quote('row_data')} = d.{quote('row_data')} || v.patch "
+                        f"FROM (VALUES {values}) AS v(id, patch) WHERE d.{quote('id')} = v.id "
+                        f"AND d.{upload_column} {in_uploads}",
+                        params + upload_ids
+                    )
+                    continue
+                for column in sorted({column for row_id in batch for column in changes[row_id]}):
+                    edits = [(row_id, changes[row_id][column]) for row_id in batch if column in changes[row_id]]
+                    if connection.vendor == 'postgresql':
+                        values = ', '.join(['(%s::bigint, %s::jsonb)'] * len(edits))
+                        params = [[str(column)]]
+                        params += [param for row_id, value in edits for param in (row_id, json.dumps(value))]
+                        cursor.execute(
+                            f"UPDATE {table} AS d SET {quote('row_data')} = jsonb_set(d.{quote('row_data')}, %s, v.value) "
+                            f"FROM (VALUES {values}) AS v(id, value) WHERE d.{quote('id')} = v.id "
+                            f"AND d.{upload_column} {in_uploads}",
+                            params + upload_ids
+                        )
+                    else:
+                        values = ', '.join(['(%s, %s)'] * len(edits))
+                        params = [json_path(column)]
+                        params += [param for row_id, value in edits for param in (row_id, json.dumps(value))]
+                        cursor.execute(
+                            f"UPDATE {table} SET {quote('row_data')} = json_set({quote('row_data')}, %s, json(v.column2)) "
+                            f"FROM (VALUES {values}) AS v WHERE {table}.{quote('id')} = v.column1 "
+                            f"AND {table}.{upload_column} {in_uploads}",
+                            params + upload_ids
+                        )
+        
+        # Keep the search index in step with the new cell values
+        self.filter(id__in=row_ids).update(search_text=RowSearchText('row_data'))
+        return existing
+
+
 class CSVData(models.Model):
     """Model to store CSV data rows"""
     csv_upload = models.ForeignKey(CSVUpload, on_delete=models.CASCADE, related_name='data_rows')
-    row_data = models.TextField()  # JSON string of row data
+    row_data = models.JSONField()  # jsonb array in column order, or object of column name -> value (see row_format)
     row_number = models.IntegerField()
+    search_text = models.TextField(default='')  # Cell values only, indexed for the filter box
+    
+    objects = CSVDataQuerySet.as_manager()
     
     def get_row_data(self):
         """Return row data as a Python object"""
-        return json.loads(self.row_data)
+        if isinstance(self.row_data, dict):
+            return self.row_data
+        # Array rows need the column order; read through csv_upload.data_rows to share the upload
+        return self.csv_upload.decode_row(self.row_data)
     
     def set_row_data(self, row_dict):
         """Set row data from a Python object"""
-        self.row_data = json.dumps(row_dict)
+        self.row_data = self.csv_upload.encode_row(row_dict)
+        self.search_text = build_search_text(row_dict)
     
     class Meta:
         ordering = ['row_number']
+        indexes = [
+            # Serves row_number ordering and keyset pagination within one upload
+            models.Index(fields=['csv_upload', 'row_number'], name='csv_data_upload_row_idx'),
+        ]
     
     def __str__(self):
         return f"Row {self.row_number} of {self.csv_upload.table_name}"
+
+
+class IngestJob(models.Model):
+    """Model to track a queued CSV ingest handled by run_ingest_worker"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    ACTIVE_STATUSES = [STATUS_QUEUED, STATUS_RUNNING]
+    MODE_CREATE = 'create'
+    MODE_APPEND = 'append'
+    MODE_UPSERT = 'upsert'
+    MODE_CHOICES = [
+        (MODE_CREATE, 'Create a new table'),
+        (MODE_APPEND, 'Append to an existing table'),
+        (MODE_UPSERT, 'Upsert into an existing table (matched on its primary key)'),
+    ]
+    
+    table_name = models.CharField(max_length=100)
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES, default=MODE_CREATE)  # Append/upsert target table_name
+    filename = models.CharField(max_length=255)
+    storage_engine = models.CharField(max_length=20, choices=CSVUpload.STORAGE_CHOICES, default=CSVUpload.STORAGE_JSON)
+    source_path = models.CharField(max_length=500)  # Spooled copy of the upload
+    content_hash = models.CharField(max_length=64, blank=True)  # SHA-256 of the spooled file, if known
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    csv_upload = models.ForeignKey(CSVUpload, on_delete=models.SET_NULL, null=True, blank=True, related_name='ingest_jobs')
+    total_bytes = models.BigIntegerField(default=0)
+    bytes_read = models.BigIntegerField(default=0)
+    rows_loaded = models.BigIntegerField(default=0)
+    worker = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)  # Doubles as the worker heartbeat
+    
+    def elapsed_seconds(self):
+        """Seconds spent running so far (or in total once finished)"""
+        if not self.started_at:
+            return 0.0
+        end = self.finished_at or timezone.now()
+        return max((end - self.started_at).total_seconds(), 0.0)
+    
+    def rows_per_second(self):
+        """Average ingest throughput"""
+        elapsed = self.elapsed_seconds()
+        return self.rows_loaded / elapsed if elapsed > 0 else 0.0
+    
+    def percent_complete(self):
+        """Progress based on the bytes consumed from the spooled file"""
+        if self.status == self.STATUS_DONE:
+            return 100.0
+        if not self.total_bytes:
+            return 0.0
+        return min(100.0 * self.bytes_read / self.total_bytes, 100.0)
+    
+    def eta_seconds(self):
+        """Estimated seconds until the job finishes, or None if unknown"""
+        if self.status != self.STATUS_RUNNING or not self.bytes_read or not self.total_bytes:
+            return None
+        remaining = max(self.total_bytes - self.bytes_read, 0)
+        return self.elapsed_seconds() * remaining / self.bytes_read
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='csv_ingestjob_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Ingest job {self.pk} ({self.status}) -> {self.table_name}"
+
+
+def new_upload_token():
+    """Secret a chunked upload's client sends back in X-Upload-Token"""
+    return secrets.token_hex(32)
+
+
+class UploadSession(models.Model):
+    """Model to track a resumable chunked upload until it is handed to ingest"""
+    STATUS_OPEN = 'open'
+    STATUS_FINALIZING = 'finalizing'
+    STATUS_FINALIZED = 'finalized'
+    STATUS_CHOICES = [
+        (STATUS_OPEN, 'Receiving chunks'),
+        (STATUS_FINALIZING, 'Checking the file'),
+        (STATUS_FINALIZED, 'Finalized'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)  # Unguessable; clients resume by it
+    # Authenticates chunk, status, finalize and cancel requests instead of the CSRF cookie; never in a URL
+    token = models.CharField(max_length=64, default=new_upload_token, editable=False)
+    table_name = models.CharField(max_length=100)
+    mode = models.CharField(max_length=10, choices=IngestJob.MODE_CHOICES, default=IngestJob.MODE_CREATE)
+    filename = models.CharField(max_length=255)
+    storage_engine = models.CharField(max_length=20, choices=CSVUpload.STORAGE_CHOICES, default=CSVUpload.STORAGE_JSON)
+    spool_path = models.CharField(max_length=500)  # Chunks are written here; becomes the IngestJob source
+    total_bytes = models.BigIntegerField()
+    received_bytes = models.BigIntegerField(default=0)  # Verified bytes; only ever advanced past a good chunk
+    content_hash = models.CharField(max_length=64, blank=True)  # SHA-256 of the whole file, set at finalize
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_OPEN)
+    ingest_job = models.ForeignKey(IngestJob, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_sessions')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def is_complete(self):
+        """True once every byte of the file has arrived"""
+        return self.received_bytes == self.total_bytes
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='csv_uploadsession_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Upload session {self.pk} ({self.received_bytes}/{self.total_bytes} bytes) -> {self.table_name}"
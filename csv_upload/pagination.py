@@ -0,0 +1,136 @@
+"""
+Keyset (seek) pagination for CSVData rows.
+
+Instead of COUNT(*) plus OFFSET, each page continues from the
+(sort key, row number) of the row it starts after. The cursor handed to the
+client is an opaque token carrying that position, so a deep page costs the
+same as the first one.
+"""
+
+import base64
+import binascii
+import json
+
+from django.db.models import F, Q
+
+SORT_KEY = 'sort_key'
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that cannot be decoded or belongs to another sort"""
+
+
+def encode_cursor(sort_by, sort_order, sort_key, row_number, direction):
+    """Opaque, URL-safe token for a position in a sorted row list"""
+    payload = {'s': sort_by, 'o': sort_order, 'k': sort_key, 'r': row_number, 'd': direction}
+    # default=str covers Decimal sort keys returned by PostgreSQL
+    data = json.dumps(payload, separators=(',', ':'), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def decode_cursor(cursor, sort_by, sort_order):
+    """Return (sort_key, row_number, direction) from a cursor token"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        sort_key, row_number, direction = payload['k'], int(payload['r']), payload['d']
+    except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+        raise InvalidCursor('Invalid cursor')
+    if payload.get('s') != sort_by or payload.get('o') != sort_order:
+        raise InvalidCursor('Cursor does not match the requested sort')
+    if direction not in ('next', 'prev'):
+        raise InvalidCursor('Invalid cursor')
+    return sort_key, row_number, direction
+
+
+class KeysetPage:
+    """One page of rows plus the cursors of its neighbours"""
+
+    def __init__(self, rows, next_cursor=None, prev_cursor=None):
+        self.object_list = rows
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+
+def _seek_filter(sort_key, row_number, descending, forward, by_column):
+    """Rows strictly after (forward) or before the given position"""
+    if not by_column:
+        after = 'lt' if descending else 'gt'
+        before = 'gt' if descending else 'lt'
+        return Q(**{f'row_number__{after if forward else before}': row_number})
+
+    # Column sorts order by the key (NULLs last), then row_number ascending
+    greater = 'lt' if descending else 'gt'
+    smaller = 'gt' if descending else 'lt'
+    if forward:
+        if sort_key is None:
+            return Q(**{f'{SORT_KEY}__isnull': True, 'row_number__gt': row_number})
+        return (
+            Q(**{f'{SORT_KEY}__{greater}': sort_key})
+            | Q(**{SORT_KEY: sort_key, 'row_number__gt': row_number})
+            | Q(**{f'{SORT_KEY}__isnull': True})
+        )
+    if sort_key is None:
+        return (
+            Q(**{f'{SORT_KEY}__isnull': False})
+            | Q(**{f'{SORT_KEY}__isnull': True, 'row_number__lt': row_number})
+        )
+    return (
+        Q(**{f'{SORT_KEY}__{smaller}': sort_key})
+        | Q(**{SORT_KEY: sort_key, 'row_number__lt': row_number})
+    )
+
+
+def _seek_ordering(descending, forward, by_column):
+    """ORDER BY for walking the rows forwards, or backwards from a cursor"""
+    if not by_column:
+        # Walking backwards reverses the requested direction
+        return ['-row_number' if descending == forward else 'row_number']
+
+    key = F(SORT_KEY)
+    if forward:
+        return [key.desc(nulls_last=True) if descending else key.asc(nulls_last=True), 'row_number']
+    return [key.asc(nulls_first=True) if descending else key.desc(nulls_first=True), '-row_number']
+
+
+def keyset_page(rows, sort_by, sort_order, page_size, cursor=None, data_type=None, row_key=None):
+    """Fetch one page of a CSVData queryset by seeking from a cursor
+
+    rows is an already filtered CSVData queryset. sort_by is 'row_number' or a
+    column name; data_type selects numeric ordering as in order_by_column(),
+    and row_key is the column's key in row_data if it is not the name.
+    Raises InvalidCursor for a malformed or mismatched cursor.
+    """
+    descending = sort_order == 'desc'
+    by_column = sort_by != 'row_number'
+    if by_column:
+        rows = rows.annotate(**{SORT_KEY: rows.column_sort_key(sort_by if row_key is None else row_key, data_type)})
+
+    forward = True
+    if cursor:
+        sort_key, row_number, direction = decode_cursor(cursor, sort_by, sort_order)
+        forward = direction == 'next'
+        rows = rows.filter(_seek_filter(sort_key, row_number, descending, forward, by_column))
+
+    # One extra row tells whether another page exists in the walk direction
+    page_rows = list(rows.order_by(*_seek_ordering(descending, forward, by_column))[:page_size + 1])
+    has_more = len(page_rows) > page_size
+    page_rows = page_rows[:page_size]
+    if not forward:
+        page_rows.reverse()
+
+    has_next = has_more if forward else True
+    has_previous = bool(cursor) if forward else has_more
+
+    def position(row, direction):
+        sort_key = getattr(row, SORT_KEY) if by_column else None
+        return encode_cursor(sort_by, sort_order, sort_key, row.row_number, direction)
+
+    next_cursor = position(page_rows[-1], 'next') if has_next and page_rows else None
+    prev_cursor = position(page_rows[0], 'prev') if has_previous and page_rows else None
+    return KeysetPage(page_rows, next_cursor, prev_cursor)
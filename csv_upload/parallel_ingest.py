@@ -0,0 +1,356 @@
+"""
+Parallel ingest of one large CSV file.
+
+A CSV file of at least CSV_PARALLEL_INGEST_MIN_BYTES is split into byte
+ranges that each start on a record boundary. A newline only ends a record
+outside a quoted field, so the quote characters before each split point are
+counted and the range starts after the first newline found outside quotes;
+quoted fields containing newlines are never cut. A pool of
+CSV_INGEST_WORKERS processes then makes two passes over the ranges:
+
+1. scan: each range is parsed and the column types inferred from the first
+   rows are widened to fit it. This gives the final schema and the number of
+   rows in every range.
+2. load: each range is parsed again, canonicalized with the final types,
+   profiled and loaded (COPY) over the worker's own database connection.
+   Row numbers start after the rows of the ranges before it, so they follow
+   file order.
+
+Scanning first means every value of a column is written in the same
+canonical form and no typed table is altered while other connections load
+into it. The per-range profiles are merged into the table's profile.
+
+Worker connections only see committed rows, so the CSVUpload and its
+storage are committed before the load pass; the table stays hidden (not
+ready) until the load commits, and is removed if any range fails. Parallel loading needs
+PostgreSQL (SQLite has a single writer). Other sources and backends are
+loaded by IngestPipeline. Boundaries assume RFC 4180 quoting: a quote
+character inside a field is doubled and the field is quoted.
+"""
+
+import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+import pandas as pd
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from csv_upload.arrow_io import FORMAT_CSV
+from csv_upload.bulk_load import LoadStats
+from csv_upload.ingest import IngestPipeline, clean_column_name, dataframe_rows, get_loader
+from csv_upload.models import CSVUpload
+from csv_upload.partitions import attach_partition
+from csv_upload.profiling import TableProfiler
+from csv_upload.table_stats import frame_bytes
+from csv_upload.type_inference import widen_data_type
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 1
+DEFAULT_MIN_BYTES = 64 * 1024 * 1024
+# More ranges than workers, so a worker that draws a slow range does not hold up the rest
+RANGES_PER_WORKER = 4
+# Smallest byte range worth a task of its own
+MIN_RANGE_BYTES = 4 * 1024 * 1024
+# Bytes read at a time while counting quotes and looking for record boundaries
+SCAN_BLOCK_SIZE = 1024 * 1024
+
+
+def ingest_workers():
+    """Processes used to parse one CSV file; 1 means sequential ingest"""
+    return max(1, int(getattr(settings, 'CSV_INGEST_WORKERS', DEFAULT_WORKERS)))
+
+
+def count_quotes(source, start, end):
+    """Number of quote characters in the bytes [start, end) of a binary file"""
+    source.seek(start)
+    count = 0
+    remaining = end - start
+    while remaining > 0:
+        block = source.read(min(SCAN_BLOCK_SIZE, remaining))
+        if not block:
+            break
+        count += block.count(b'"')
+        remaining -= len(block)
+    return count
+
+
+def next_record_start(source, position, in_quotes=False):
+    """Offset just past the first newline at or after position that is outside quotes, or None"""
+    source.seek(position)
+    while True:
+        block = source.read(SCAN_BLOCK_SIZE)
+        if not block:
+            return None
+        index = 0
+        while True:
+            quote_at = block.find(b'"', index)
+            if not in_quotes:
+                newline_at = block.find(b'\n', index)
+                if newline_at >= 0 and (quote_at < 0 or newline_at < quote_at):
+                    return position + newline_at + 1
+            if quote_at < 0:
+                break
+            # A doubled quote toggles twice, so it leaves the state as it was
+            in_quotes = not in_quotes
+            index = quote_at + 1
+        position += len(block)
+
+
+def split_ranges(path, start, parts):
+    """Split the bytes of a CSV file after start into up to ``parts`` (start, end) ranges of whole records"""
+    end = os.path.getsize(path)
+    boundaries = [start]
+    with open(path, 'rb') as source:
+        position, in_quotes = start, False
+        for part in range(1, parts):
+            target = start + (end - start) * part // parts
+            if target <= position:
+                # The previous range ran past this split point (a long quoted field)
+                continue
+            in_quotes ^= count_quotes(source, position, target) % 2 == 1
+            boundary = next_record_start(source, target, in_quotes)
+            if boundary is None or boundary >= end:
+                break
+            boundaries.append(boundary)
+            position, in_quotes = boundary, False
+    boundaries.append(end)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+class RangeReader(io.RawIOBase):
+    """Read-only file object over the bytes [start, end) of a file"""
+
+    def __init__(self, path, start, end):
+        super().__init__()
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.file.read(min(len(buffer), self.remaining))
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+class RangePipeline(IngestPipeline):
+    """Parses the records of one byte range of a CSV file, which has no header row"""
+
+    def __init__(self, task):
+        super().__init__(None, task['table_name'], filename=task['path'], memory_budget=task['memory_budget'])
+        self.task = task
+        self.column_names = task['column_names']
+        self.columns_info = task['columns_info']
+        self.profiler = TableProfiler(seed=task['index'] + 1)
+        self.preview_limit = task.get('preview_limit', 0)
+
+    def iter_chunks(self):
+        with io.BufferedReader(RangeReader(self.task['path'], self.task['start'], self.task['end'])) as source:
+            try:
+                # Fixed names keep every range as wide as the header, like the sequential parser
+                yield from self.iter_csv_chunks(
+                    source, header=None, names=list(range(len(self.column_names))), index_col=False
+                )
+            except pd.errors.ParserError as e:
+                # The parser counts lines from the start of the range
+                raise pd.errors.ParserError(f"{e} (counting from byte {self.task['start']} of the file)") from e
+
+
+def scan_range(task):
+    """Parse one range and widen the sampled column types to fit it; returns (rows, columns_info)"""
+    pipeline = RangePipeline(task)
+    for chunk in pipeline.iter_chunks():
+        pipeline.widen_schema(chunk)
+        pipeline.rows_loaded += len(chunk)
+    return pipeline.rows_loaded, pipeline.columns_info
+
+
+def load_range(task):
+    """Parse, canonicalize, profile and load one range in one transaction
+
+    Returns (rows, cell bytes, TableProfiler, preview rows).
+    """
+    pipeline = RangePipeline(task)
+    try:
+        csv_upload = CSVUpload.objects.get(pk=task['csv_upload_id'])
+        loader = get_loader(csv_upload, task['table'], task['batch_size'])
+        with transaction.atomic():
+            for chunk in pipeline.iter_chunks():
+                chunk = pipeline.canonicalize(chunk)
+                pipeline.add_preview(chunk)
+                stats = loader.load(dataframe_rows(chunk, start=task['first_row'] + pipeline.rows_loaded))
+                pipeline.profiler.update(chunk)
+                pipeline.cell_bytes += frame_bytes(chunk)
+                pipeline.rows_loaded += stats.rows
+    finally:
+        connection.close()
+    return pipeline.rows_loaded, pipeline.cell_bytes, pipeline.profiler, pipeline.preview
+
+
+class ParallelIngestPipeline(IngestPipeline):
+    """IngestPipeline that parses and loads a large CSV file in a process pool
+
+    Sources that cannot be split, or do not pay for a pool, are loaded
+    sequentially (see can_run_parallel()).
+    """
+
+    def __init__(self, source, table_name, workers=None, **kwargs):
+        super().__init__(source, table_name, **kwargs)
+        self.workers = workers or ingest_workers()
+        self.path = getattr(source, 'name', None)
+
+    def can_run_parallel(self):
+        """True if the source is a large CSV file on disk and the rows go to PostgreSQL"""
+        min_bytes = getattr(settings, 'CSV_PARALLEL_INGEST_MIN_BYTES', DEFAULT_MIN_BYTES)
+        return (
+            self.workers > 1
+            and self.source_format == FORMAT_CSV
+            and connection.vendor == 'postgresql'
+            # Worker connections cannot see rows of an open transaction
+            and not connection.in_atomic_block
+            and isinstance(self.path, str) and os.path.isfile(self.path)
+            and os.path.getsize(self.path) >= min_bytes
+        )
+
+    def read_sample(self):
+        """Infer the column types from the first rows, as the first chunk of a sequential ingest would
+
+        Returns the offset of the first data record, or None if the file holds
+        no more than its header.
+        """
+        sample = pd.read_csv(self.path, nrows=self.sample_rows, dtype=str)
+        self.column_names = [clean_column_name(col) for col in sample.columns]
+        sample.columns = self.column_names
+        self.update_schema(sample)
+        with open(self.path, 'rb') as source:
+            return next_record_start(source, 0)
+
+    def merge_schemas(self, range_columns):
+        """Widen the sampled column types to fit what every range's scan found"""
+        for columns_info in range_columns:
+            for col, properties in columns_info.items():
+                current = self.columns_info[col]
+                widened = widen_data_type(current['data_type'], properties['data_type'])
+                if widened == current['data_type']:
+                    continue
+                current['data_type'] = widened
+                if widened == properties['data_type']:
+                    current['type_inference']['date_format'] = properties['type_inference']['date_format']
+
+    def load_ranges(self, pool, tasks, scans):
+        """Load every range in the pool; returns the load_range() results by range index"""
+        futures = {pool.submit(load_range, task): task for task in tasks}
+        results = {}
+        try:
+            for future in as_completed(futures):
+                task = futures[future]
+                result = results[task['index']] = future.result()
+                if result[0] != scans[task['index']][0]:
+                    raise ValueError(f'{self.filename} changed while it was being loaded')
+                self.rows_loaded += result[0]
+                self.bytes_read += task['end'] - task['start']
+                self.chunks_loaded += 1
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        return results
+
+    def run(self):
+        """Create the CSVUpload and load the file's ranges in parallel"""
+        if not self.can_run_parallel():
+            return super().run()
+        copied = self.copy_duplicate()
+        if copied is not None:
+            return copied
+
+        started = time.perf_counter()
+        data_start = self.read_sample()
+        if data_start is None:
+            return super().run()
+        size = os.path.getsize(self.path)
+        parts = max(1, min(self.workers * RANGES_PER_WORKER, (size - data_start) // MIN_RANGE_BYTES))
+        ranges = split_ranges(self.path, data_start, parts)
+        tasks = [
+            {
+                'index': index,
+                'path': self.path,
+                'start': start,
+                'end': end,
+                'table_name': self.table_name,
+                'column_names': self.column_names,
+                'columns_info': self.columns_info,
+                # The budget is shared, so peak memory does not grow with the number of workers
+                'memory_budget': max(1, self.memory_budget // self.workers),
+                'batch_size': self.batch_size,
+            }
+            for index, (start, end) in enumerate(ranges)
+        ]
+        self.bytes_read = data_start
+
+        processes = min(self.workers, len(tasks))
+        csv_upload = None
+        try:
+            pool = ProcessPoolExecutor(
+                # Spawned, not forked, so Django is set up afresh; django.setup itself is the
+                # initializer because unpickling a function of this module would import the models first
+                processes, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+            )
+            with pool:
+                scans = list(pool.map(scan_range, tasks))
+                self.merge_schemas(columns_info for _, columns_info in scans)
+                csv_upload, staging_table = self.create_upload()
+                first_row = 1
+                for task, (rows, _) in zip(tasks, scans):
+                    task.update(
+                        columns_info=self.columns_info,
+                        csv_upload_id=csv_upload.pk,
+                        table=staging_table,
+                        first_row=first_row,
+                        preview_limit=self.preview_limit if task['index'] == 0 else 0,
+                    )
+                    first_row += rows
+                results = self.load_ranges(pool, tasks, scans)
+
+            with transaction.atomic():
+                if staging_table:
+                    attach_partition(csv_upload)
+                for index in sorted(results):
+                    _, cell_bytes, profiler, preview = results[index]
+                    self.profiler.merge(profiler)
+                    self.cell_bytes += cell_bytes
+                    self.preview.extend(preview)
+                csv_upload.set_column_stats(self.profiler.finish())
+                csv_upload.row_count = self.rows_loaded
+                csv_upload.byte_size = self.cell_bytes
+                csv_upload.content_hash = self.content_hash
+                csv_upload.last_modified = timezone.now()
+                csv_upload.is_ready = True
+                csv_upload.save(update_fields=[
+                    'column_stats', 'row_count', 'byte_size', 'content_hash', 'last_modified', 'is_ready'
+                ])
+        except BaseException:
+            if csv_upload is not None:
+                self.discard(csv_upload)
+            raise
+
+        total = LoadStats(self.rows_loaded, time.perf_counter() - started, 'parallel ingest')
+        logger.info(
+            'Ingested "%s" in %d range(s) on %d process(es): %s',
+            self.table_name, len(tasks), processes, total
+        )
+        return csv_upload, total
@@ -0,0 +1,116 @@
+"""
+Per-upload storage of CSVData rows.
+
+On PostgreSQL CSVData is list-partitioned by ``csv_upload_id`` (migration
+0011) and every JSON upload has a partition of its own,
+``csv_upload_csvdata_p<id>``. Ingest COPYs into a fresh standalone table and
+attaches it as the upload's partition at the end, so the parent's indexes
+are built once over the loaded rows. There is no default partition:
+deleting an upload detaches its partition with DETACH PARTITION ...
+CONCURRENTLY, which PostgreSQL only allows without one, and then drops the
+detached table. A plain DROP TABLE of an attached partition would hold an
+ACCESS EXCLUSIVE lock on CSVData, blocking every table's reads, until its
+transaction ended.
+
+Other backends keep CSVData as one table; deleting an upload removes its
+rows with batched raw DELETEs instead of going through the ORM's cascade
+collector.
+"""
+
+from django.conf import settings
+from django.db import connection
+
+from csv_upload.models import CSVData
+
+DEFAULT_DELETE_BATCH_SIZE = 10000
+
+
+def uses_partitions():
+    """True if CSVData is partitioned per upload (PostgreSQL)"""
+    return connection.vendor == 'postgresql'
+
+
+def partition_name(csv_upload):
+    """Table name of an upload's CSVData partition"""
+    return f'{CSVData._meta.db_table}_p{int(csv_upload.pk)}'
+
+
+def _upload_column():
+    return connection.ops.quote_name(CSVData._meta.get_field('csv_upload').column)
+
+
+def create_staging_partition(csv_upload):
+    """Create the standalone table an upload is loaded into
+
+    Returns its name, or None where CSVData is not partitioned.
+    """
+    if not uses_partitions():
+        return None
+    quote = connection.ops.quote_name
+    name = partition_name(csv_upload)
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {quote(name)} (LIKE {quote(CSVData._meta.db_table)} INCLUDING DEFAULTS)')
+        # Proves the partition bound, so ATTACH PARTITION does not scan the rows to check it
+        cursor.execute(
+            f'ALTER TABLE {quote(name)} ADD CONSTRAINT {quote(name + "_bound")} '
+            f'CHECK ({_upload_column()} = {int(csv_upload.pk)})'
+        )
+    return name
+
+
+def attach_partition(csv_upload):
+    """Attach a loaded staging table as the upload's partition"""
+    quote = connection.ops.quote_name
+    name = partition_name(csv_upload)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'ALTER TABLE {quote(CSVData._meta.db_table)} ATTACH PARTITION {quote(name)} '
+            f'FOR VALUES IN ({int(csv_upload.pk)})'
+        )
+        # The partition bound enforces the same thing from now on
+        cursor.execute(f'ALTER TABLE {quote(name)} DROP CONSTRAINT {quote(name + "_bound")}')
+
+
+def detach_partition(csv_upload):
+    """Detach an upload's partition from CSVData without blocking other tables
+
+    DETACH ... CONCURRENTLY takes a SHARE UPDATE EXCLUSIVE lock on CSVData
+    and cannot run in a transaction block, so this does nothing inside one
+    (delete_rows() then drops the attached partition). The rows disappear
+    from CSVData at once: hide the upload first. Returns True if a partition
+    was detached.
+    """
+    if not uses_partitions() or connection.in_atomic_block:
+        return False
+    quote = connection.ops.quote_name
+    name = quote(partition_name(csv_upload))
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(%s)', [name])
+        if cursor.fetchone() is None:
+            # Not attached (a failed load's staging table) or already gone
+            return False
+        cursor.execute(f'ALTER TABLE {quote(CSVData._meta.db_table)} DETACH PARTITION {name} CONCURRENTLY')
+    return True
+
+
+def delete_rows(csv_upload):
+    """Remove every CSVData row of an upload without the ORM cascade collector
+
+    On PostgreSQL this drops the upload's partition; call detach_partition()
+    first, outside the transaction, to keep CSVData unlocked.
+    """
+    quote = connection.ops.quote_name
+    table = quote(CSVData._meta.db_table)
+    with connection.cursor() as cursor:
+        if uses_partitions():
+            cursor.execute(f'DROP TABLE IF EXISTS {quote(partition_name(csv_upload))}')
+            return
+        batch_size = getattr(settings, 'CSV_DELETE_BATCH_SIZE', DEFAULT_DELETE_BATCH_SIZE)
+        while True:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE {quote("id")} IN '
+                f'(SELECT {quote("id")} FROM {table} WHERE {_upload_column()} = %s LIMIT %s)',
+                [csv_upload.pk, batch_size]
+            )
+            if cursor.rowcount < batch_size:
+                break
@@ -0,0 +1,109 @@
+"""
+Batched multi-cell edits for the table patch API.
+
+A patch is a list of ``{row_id, column, value}`` edits. Every value is
+validated against its column's data_type first; the valid edits are then
+applied in one transaction with set-based UPDATEs and the table's data
+version is bumped once. Each edit gets its own result.
+"""
+
+from django.conf import settings
+from django.db import transaction
+
+from csv_upload.models import CSVData
+from csv_upload.profiling import current_cell_values, record_cell_changes
+from csv_upload.typed_tables import coerce_value, display_value, update_typed_cells
+
+DEFAULT_MAX_PATCH_EDITS = 10000
+
+
+class PatchError(ValueError):
+    """Raised for a patch request that cannot be applied at all"""
+
+
+def max_patch_edits():
+    return getattr(settings, 'CSV_PATCH_MAX_EDITS', DEFAULT_MAX_PATCH_EDITS)
+
+
+def _parse_row_id(row_id):
+    if isinstance(row_id, bool):
+        raise ValueError('row_id must be an integer')
+    try:
+        return int(row_id)
+    except (TypeError, ValueError):
+        raise ValueError('row_id must be an integer')
+
+
+def apply_patch(csv_upload, edits):
+    """Validate and apply a list of cell edits; returns (applied, results)
+
+    results has one dict per edit, in request order. Later edits to the same
+    cell win. Raises PatchError if ``edits`` is not a list or is too long.
+    """
+    if not isinstance(edits, list):
+        raise PatchError('edits must be a list of {row_id, column, value} objects')
+    if len(edits) > max_patch_edits():
+        raise PatchError(f'A patch may contain at most {max_patch_edits()} edits')
+
+    columns = csv_upload.get_columns()
+    results = []
+    changes = {}  # row_id -> {column: value to store}
+    for edit in edits:
+        result = {'row_id': None, 'column': None, 'success': False}
+        results.append(result)
+        try:
+            if not isinstance(edit, dict):
+                raise ValueError('Each edit must be an object')
+            result['row_id'] = edit.get('row_id')
+            result['column'] = column = edit.get('column')
+            row_id = _parse_row_id(edit.get('row_id'))
+            if column not in columns:
+                raise ValueError(f'Unknown column "{column}"')
+            value = edit.get('value')
+            if value is not None and not isinstance(value, (str, int, float, bool)):
+                raise ValueError('value must be a string, number, boolean or null')
+            data_type = csv_upload.get_column_properties(column).get('data_type', 'TEXT')
+            try:
+                stored = coerce_value(value, data_type)
+            except (TypeError, ValueError):
+                raise ValueError(f"'{value}' is not a valid {data_type} value")
+        except ValueError as e:
+            result['message'] = str(e)
+            continue
+
+        if csv_upload.uses_typed_table():
+            changes.setdefault(row_id, {})[column] = stored
+        else:
+            # JSON rows keep the canonical text form of each value
+            changes.setdefault(row_id, {})[column] = display_value(stored)
+        result['row_id'] = row_id
+        result['value'] = display_value(stored)
+        result['success'] = True
+
+    updated = set()
+    if changes:
+        with transaction.atomic():
+            old_values = current_cell_values(csv_upload, changes)
+            if csv_upload.uses_typed_table():
+                updated = update_typed_cells(csv_upload, changes)
+            else:
+                updated = CSVData.objects.filter(csv_upload=csv_upload).set_cells({
+                    row_id: {csv_upload.row_key(column): value for column, value in row_changes.items()}
+                    for row_id, row_changes in changes.items()
+                })
+            if updated:
+                record_cell_changes(csv_upload, [
+                    (column, old_values.get((row_id, column)), display_value(value))
+                    for row_id in updated for column, value in changes[row_id].items()
+                ])
+                csv_upload.bump_data_version()
+
+    applied = 0
+    for result in results:
+        if result['success'] and result['row_id'] not in updated:
+            result['success'] = False
+            result['message'] = f"Row {result['row_id']} does not exist"
+            result.pop('value', None)
+        elif result['success']:
+            applied += 1
+    return applied, results
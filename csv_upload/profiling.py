@@ -0,0 +1,423 @@
+"""
+Per-column data profiles, computed while a CSV is ingested.
+
+Each chunk is folded into a ColumnProfiler with vectorized pandas/numpy
+operations: null counts, text and numeric min/max, sum and mean, an
+approximate distinct count (HyperLogLog), approximate top-k values and a
+numeric histogram built from a bounded uniform sample. The finished
+profiles are stored as JSON in ``CSVUpload.column_stats`` next to
+``CSVUpload.columns``, together with the sketch state needed to keep them
+current when single cells are edited (see record_cell_changes()).
+"""
+
+import base64
+import math
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+
+from csv_upload.models import CSVData
+from csv_upload.table_stats import cell_change_bytes
+from csv_upload.typed_tables import display_value, typed_cell_rows
+
+HLL_PRECISION = 12  # 4096 registers, about 1.6% standard error
+TOP_K = 10
+# Candidate values tracked for top-k; extra capacity keeps the estimate stable
+TOP_K_CAPACITY = 1000
+HISTOGRAM_BINS = 20
+HISTOGRAM_SAMPLE_SIZE = 10000
+NUMERIC_DATA_TYPES = ('INTEGER', 'REAL')
+LOOKUP_BATCH_SIZE = 1000
+
+
+def hash_values(values):
+    """Stable 64-bit hashes of string values"""
+    return pd.util.hash_pandas_object(pd.Series(values, dtype=object), index=False).to_numpy(dtype=np.uint64)
+
+
+class HyperLogLog:
+    """Approximate distinct counter with vectorized updates"""
+
+    def __init__(self, registers=None, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = registers if registers is not None else np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        if len(hashes) == 0:
+            return
+        value_bits = 64 - self.precision
+        index = (hashes >> np.uint64(value_bits)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << value_bits) - 1)
+        # Position of the leftmost 1-bit in the remaining bits (frexp is exact below 2**53)
+        bit_length = np.frexp(remainder.astype(np.float64))[1]
+        rank = (value_bits - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_json(self):
+        return base64.b64encode(self.registers.tobytes()).decode('ascii')
+
+    @classmethod
+    def from_json(cls, data):
+        registers = np.frombuffer(base64.b64decode(data), dtype=np.uint8).copy()
+        return cls(registers, precision=int(math.log2(len(registers))))
+
+
+class ColumnProfiler:
+    """Accumulates one column's profile across ingest chunks"""
+
+    def __init__(self, seed=0):
+        self.count = 0
+        self.null_count = 0
+        self.text_min = None
+        self.text_max = None
+        self.numeric_count = 0
+        self.numeric_sum = 0.0
+        self.numeric_min = None
+        self.numeric_max = None
+        self.hll = HyperLogLog()
+        self.top_counts = pd.Series(dtype=np.int64)
+        # Bottom-k sample: keep the values with the smallest random keys
+        self.sample_keys = np.empty(0)
+        self.sample_values = np.empty(0)
+        self.random = np.random.default_rng(seed)
+
+    def update(self, series):
+        self.count += len(series)
+        present = series.dropna()
+        self.null_count += len(series) - len(present)
+        if present.empty:
+            return
+
+        # Profiles describe the stored text, as dataframe_rows() writes it
+        text = present.astype(str)
+        self.hll.add_hashes(hash_values(text.to_numpy()))
+        low, high = text.min(), text.max()
+        self.text_min = low if self.text_min is None else min(self.text_min, low)
+        self.text_max = high if self.text_max is None else max(self.text_max, high)
+        # Only each chunk's most frequent values are merged (value_counts sorts descending)
+        chunk_counts = text.value_counts().head(TOP_K_CAPACITY)
+        self.top_counts = self.top_counts.add(chunk_counts, fill_value=0).nlargest(TOP_K_CAPACITY)
+
+        numbers = pd.to_numeric(present, errors='coerce').dropna().to_numpy(dtype=np.float64)
+        numbers = numbers[np.isfinite(numbers)]
+        if len(numbers):
+            self.numeric_count += len(numbers)
+            self.numeric_sum += float(numbers.sum())
+            low, high = float(numbers.min()), float(numbers.max())
+            self.numeric_min = low if self.numeric_min is None else min(self.numeric_min, low)
+            self.numeric_max = high if self.numeric_max is None else max(self.numeric_max, high)
+            keys = np.concatenate([self.sample_keys, self.random.random(len(numbers))])
+            values = np.concatenate([self.sample_values, numbers])
+            if len(keys) > HISTOGRAM_SAMPLE_SIZE:
+                keep = np.argpartition(keys, HISTOGRAM_SAMPLE_SIZE)[:HISTOGRAM_SAMPLE_SIZE]
+                keys, values = keys[keep], values[keep]
+            self.sample_keys, self.sample_values = keys, values
+
+    def merge(self, other):
+        """Fold in a profiler that saw other rows of the same column (e.g. another byte range)"""
+        self.count += other.count
+        self.null_count += other.null_count
+        for attribute, pick in (('text_min', min), ('text_max', max), ('numeric_min', min), ('numeric_max', max)):
+            mine, theirs = getattr(self, attribute), getattr(other, attribute)
+            if theirs is not None:
+                setattr(self, attribute, theirs if mine is None else pick(mine, theirs))
+        self.numeric_count += other.numeric_count
+        self.numeric_sum += other.numeric_sum
+        np.maximum(self.hll.registers, other.hll.registers, out=self.hll.registers)
+        self.top_counts = self.top_counts.add(other.top_counts, fill_value=0).nlargest(TOP_K_CAPACITY)
+        # The union of two bottom-k samples, cut back to k, is a bottom-k sample of both
+        keys = np.concatenate([self.sample_keys, other.sample_keys])
+        values = np.concatenate([self.sample_values, other.sample_values])
+        if len(keys) > HISTOGRAM_SAMPLE_SIZE:
+            keep = np.argpartition(keys, HISTOGRAM_SAMPLE_SIZE)[:HISTOGRAM_SAMPLE_SIZE]
+            keys, values = keys[keep], values[keep]
+        self.sample_keys, self.sample_values = keys, values
+
+    def histogram(self):
+        if not self.numeric_count or self.numeric_min is None:
+            return None
+        counts, edges = np.histogram(
+            self.sample_values, bins=HISTOGRAM_BINS, range=(self.numeric_min, self.numeric_max or 0.0)
+        )
+        # Scale the sample back up to the full column
+        scale = self.numeric_count / max(len(self.sample_values), 1)
+        return {
+            'edges': [float(edge) for edge in edges],
+            'counts': [int(round(count * scale)) for count in counts],
+            'sampled': len(self.sample_values) < self.numeric_count,
+        }
+
+    def finish(self):
+        """The stored profile for this column"""
+        profile = {
+            'count': self.count,
+            'null_count': self.null_count,
+            'text_min': self.text_min,
+            'text_max': self.text_max,
+            'distinct_estimate': self.hll.count(),
+            'hll': self.hll.to_json(),
+            'heavy_hitters': {value: int(count) for value, count in self.top_counts.items()},
+            'numeric': None,
+            'exact_bounds': True,
+        }
+        if self.numeric_count:
+            profile['numeric'] = {
+                'count': self.numeric_count,
+                'sum': self.numeric_sum,
+                'min': self.numeric_min,
+                'max': self.numeric_max,
+                'histogram': self.histogram(),
+            }
+        return profile
+
+
+class TableProfiler:
+    """Profiles every column of a chunked ingest"""
+
+    def __init__(self, seed=0):
+        # Profilers that are merged later need different seeds so their sample keys are independent
+        self.seed = seed
+        self.columns = {}
+
+    def update(self, chunk):
+        for column in chunk.columns:
+            self.columns.setdefault(column, ColumnProfiler(self.seed)).update(chunk[column])
+
+    def merge(self, other):
+        """Fold in the profiles of another part of the same table"""
+        for column, profiler in other.columns.items():
+            if column in self.columns:
+                self.columns[column].merge(profiler)
+            else:
+                self.columns[column] = profiler
+
+    def finish(self):
+        return {column: profiler.finish() for column, profiler in self.columns.items()}
+
+
+def top_values(profile, k=TOP_K):
+    """The k most frequent values of a profile as (value, count) pairs"""
+    counts = profile.get('heavy_hitters') or {}
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+def summarize(profile, data_type):
+    """Display-ready statistics of a stored profile"""
+    numeric = profile.get('numeric') if data_type in NUMERIC_DATA_TYPES else None
+    summary = {
+        'count': profile['count'],
+        'null_count': profile['null_count'],
+        'null_percent': 100.0 * profile['null_count'] / profile['count'] if profile['count'] else 0.0,
+        'distinct_estimate': profile['distinct_estimate'],
+        'top_values': top_values(profile),
+        'exact_bounds': profile.get('exact_bounds', True),
+        'mean': None,
+        'histogram': None,
+    }
+    if numeric:
+        summary['min'], summary['max'] = numeric['min'], numeric['max']
+        summary['mean'] = numeric['sum'] / numeric['count'] if numeric['count'] else None
+        histogram = numeric.get('histogram')
+        if histogram and max(histogram['counts'], default=0) > 0:
+            peak = max(histogram['counts'])
+            summary['histogram'] = [
+                {'low': low, 'high': high, 'count': count, 'percent': 100.0 * count / peak}
+                for low, high, count in zip(histogram['edges'], histogram['edges'][1:], histogram['counts'])
+            ]
+    else:
+        summary['min'], summary['max'] = profile.get('text_min'), profile.get('text_max')
+    return summary
+
+
+def _as_number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _histogram_bin(histogram, number):
+    edges = histogram['edges']
+    index = int(np.searchsorted(edges, number, side='right')) - 1
+    return min(max(index, 0), len(histogram['counts']) - 1)
+
+
+def apply_cell_change(profile, old, new, sketch=True):
+    """Fold one edited cell (old and new stored text, None for NULL) into a profile
+
+    Without sketch the distinct-count sketch is left alone; apply_cell_changes()
+    adds the new values to it in one go.
+    """
+    if old == new:
+        return profile
+    if old is None:
+        profile['null_count'] = max(profile['null_count'] - 1, 0)
+    if new is None:
+        profile['null_count'] += 1
+
+    counts = profile.setdefault('heavy_hitters', {})
+    if old is not None and old in counts:
+        counts[old] -= 1
+        if counts[old] <= 0:
+            del counts[old]
+    if new is not None:
+        if new in counts or len(counts) < TOP_K_CAPACITY:
+            counts[new] = counts.get(new, 0) + 1
+        if sketch:
+            hll = HyperLogLog.from_json(profile['hll'])
+            hll.add_hashes(hash_values([new]))
+            profile['hll'] = hll.to_json()
+            profile['distinct_estimate'] = hll.count()
+        profile['text_min'] = new if profile.get('text_min') is None else min(profile['text_min'], new)
+        profile['text_max'] = new if profile.get('text_max') is None else max(profile['text_max'], new)
+    if old is not None and old in (profile.get('text_min'), profile.get('text_max')):
+        # The old extreme may be gone; bounds stay a (valid) outer estimate
+        profile['exact_bounds'] = False
+
+    old_number, new_number = _as_number(old), _as_number(new)
+    numeric = profile.get('numeric')
+    if numeric is None and new_number is not None:
+        numeric = profile['numeric'] = {'count': 0, 'sum': 0.0, 'min': None, 'max': None, 'histogram': None}
+    if numeric is None:
+        return profile
+    histogram = numeric.get('histogram')
+    if old_number is not None:
+        numeric['count'] = max(numeric['count'] - 1, 0)
+        numeric['sum'] -= old_number
+        if old_number in (numeric['min'], numeric['max']):
+            profile['exact_bounds'] = False
+        if histogram:
+            index = _histogram_bin(histogram, old_number)
+            histogram['counts'][index] = max(histogram['counts'][index] - 1, 0)
+    if new_number is not None:
+        numeric['count'] += 1
+        numeric['sum'] += new_number
+        numeric['min'] = new_number if numeric['min'] is None else min(numeric['min'], new_number)
+        numeric['max'] = new_number if numeric['max'] is None else max(numeric['max'], new_number)
+        if histogram:
+            histogram['counts'][_histogram_bin(histogram, new_number)] += 1
+    return profile
+
+
+def apply_cell_changes(profile, changes):
+    """Fold many edited cells of one column, as (old, new) pairs, into a profile"""
+    added = []
+    for old, new in changes:
+        apply_cell_change(profile, old, new, sketch=False)
+        if new is not None and new != old:
+            added.append(new)
+    if added:
+        hll = HyperLogLog.from_json(profile['hll'])
+        hll.add_hashes(hash_values(added))
+        profile['hll'] = hll.to_json()
+        profile['distinct_estimate'] = hll.count()
+    return profile
+
+
+def merge_profiles(profile, delta):
+    """Fold the profile of newly loaded rows into a stored column profile
+
+    Sketches merge exactly (HyperLogLog registers take the maximum, top-k
+    counts add up). The delta's histogram is re-binned into the stored bins
+    by bin centre, so the merged histogram is marked as sampled.
+    """
+    profile['count'] += delta['count']
+    profile['null_count'] += delta['null_count']
+    for key, pick in (('text_min', min), ('text_max', max)):
+        if delta[key] is not None:
+            profile[key] = delta[key] if profile.get(key) is None else pick(profile[key], delta[key])
+
+    hll = HyperLogLog.from_json(profile['hll'])
+    np.maximum(hll.registers, HyperLogLog.from_json(delta['hll']).registers, out=hll.registers)
+    profile['hll'] = hll.to_json()
+    profile['distinct_estimate'] = hll.count()
+
+    counts = profile.get('heavy_hitters') or {}
+    for value, count in delta['heavy_hitters'].items():
+        counts[value] = counts.get(value, 0) + count
+    profile['heavy_hitters'] = dict(sorted(counts.items(), key=lambda item: -item[1])[:TOP_K_CAPACITY])
+
+    numeric, added = profile.get('numeric'), delta.get('numeric')
+    if added and numeric is None:
+        profile['numeric'] = added
+    elif added:
+        numeric['count'] += added['count']
+        numeric['sum'] += added['sum']
+        numeric['min'] = added['min'] if numeric['min'] is None else min(numeric['min'], added['min'])
+        numeric['max'] = added['max'] if numeric['max'] is None else max(numeric['max'], added['max'])
+        histogram, added_histogram = numeric.get('histogram'), added.get('histogram')
+        if histogram is None:
+            numeric['histogram'] = added_histogram
+        elif added_histogram:
+            edges = added_histogram['edges']
+            for low, high, count in zip(edges, edges[1:], added_histogram['counts']):
+                histogram['counts'][_histogram_bin(histogram, (low + high) / 2)] += count
+            histogram['sampled'] = True
+    profile['exact_bounds'] = profile.get('exact_bounds', True) and delta.get('exact_bounds', True)
+    return profile
+
+
+def current_cell_values(csv_upload, cells):
+    """Stored text of the given cells, as {(row_id, column): text}
+
+    ``cells`` maps row ids to the columns wanted. Rows that do not exist are
+    left out of the result.
+    """
+    values = {}
+    row_ids = list(cells)
+    for start in range(0, len(row_ids), LOOKUP_BATCH_SIZE):
+        batch = row_ids[start:start + LOOKUP_BATCH_SIZE]
+        if csv_upload.uses_typed_table():
+            columns = sorted({column for row_id in batch for column in cells[row_id]})
+            rows = typed_cell_rows(csv_upload, batch, columns)
+        else:
+            rows = (
+                (row_id, csv_upload.decode_row(row_data))
+                for row_id, row_data in CSVData.objects.filter(csv_upload=csv_upload, id__in=batch)
+                .values_list('id', 'row_data')
+            )
+        for row_id, data in rows:
+            for column in cells[row_id]:
+                value = data.get(column)
+                values[(row_id, column)] = None if value is None else display_value(value)
+    return values
+
+
+def record_cell_changes(csv_upload, changes):
+    """Update stored profiles for edited cells
+
+    ``changes`` is a list of (column, old, new) stored-text triples. The
+    table's byte_size counter is adjusted too. The CSVUpload row is locked
+    so concurrent edits do not lose updates.
+    """
+    if not changes:
+        return
+    with transaction.atomic():
+        locked = type(csv_upload).objects.select_for_update().only(
+            'id', 'column_stats', 'byte_size'
+        ).get(pk=csv_upload.pk)
+        stats = locked.get_column_stats()
+        by_column = {}
+        for column, old, new in changes:
+            by_column.setdefault(column, []).append((old, new))
+        for column, column_changes in by_column.items():
+            if column in stats:
+                # One sketch update per column, however many of its cells changed
+                apply_cell_changes(stats[column], column_changes)
+        locked.set_column_stats(stats)
+        locked.byte_size += cell_change_bytes(changes)
+        locked.save(update_fields=['column_stats', 'byte_size'])
+    csv_upload.column_stats = locked.column_stats
+    csv_upload.byte_size = locked.byte_size
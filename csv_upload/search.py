@@ -0,0 +1,72 @@
+"""
+Indexed substring search over the cell values of CSVData rows.
+
+Every row keeps ``search_text``: its cell values joined by newlines, with no
+JSON keys. PostgreSQL indexes that column with a pg_trgm GIN index, which
+serves ``ILIKE '%text%'`` directly. SQLite keeps an external-content FTS5
+table with the trigram tokenizer in sync through triggers, which serves
+``LIKE '%text%'``. Both indexes are created by migration 0007.
+"""
+
+from django.db.models import BooleanField, Func, TextField
+
+from csv_upload.expressions import escape_like
+
+SEARCH_SEPARATOR = '\n'
+FTS_TABLE = 'csv_upload_csvdata_fts'
+TRIGRAM_INDEX_NAME = 'csv_data_search_trgm'
+
+
+def build_search_text(row_dict):
+    """Cell values of a row joined for the search index (NULL cells skipped)"""
+    return SEARCH_SEPARATOR.join(str(value) for value in row_dict.values() if value is not None)
+
+
+class RowSearchText(Func):
+    """SQL equivalent of build_search_text() for a JSON row expression
+
+    Used to keep search_text in step with in-place jsonb updates. Works on
+    both object rows and array rows.
+    """
+    output_field = TextField()
+
+    def as_sql(self, compiler, connection):
+        row, params = compiler.compile(self.source_expressions[0])
+        return (
+            f"COALESCE((SELECT group_concat(cell.value, char(10)) FROM json_each({row}) AS cell), '')",
+            params,
+        )
+
+    def as_postgresql(self, compiler, connection):
+        row, params = compiler.compile(self.source_expressions[0])
+        return (
+            f"COALESCE(CASE jsonb_typeof({row}) "
+            f"WHEN 'array' THEN (SELECT string_agg(cell.value, E'\\n') FROM jsonb_array_elements_text({row}) AS cell(value)) "
+            f"ELSE (SELECT string_agg(cell.value, E'\\n') FROM jsonb_each_text({row}) AS cell) END, '')",
+            (*params, *params, *params),
+        )
+
+
+class SearchTextContains(Func):
+    """True if a row's cell values contain ``text`` (case-insensitive)"""
+    output_field = BooleanField()
+    conditional = True
+
+    def __init__(self, text):
+        self.text = text
+        super().__init__('search_text', 'id')
+
+    def as_sql(self, compiler, connection):
+        row_id, params = compiler.compile(self.source_expressions[1])
+        escaped = escape_like(self.text)
+        # The FTS5 trigram index is only used for LIKE without an ESCAPE clause
+        escape = " ESCAPE '\\'" if escaped != self.text else ''
+        sql = (
+            f"{row_id} IN (SELECT rowid FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE}.search_text LIKE %s{escape})"
+        )
+        return sql, (*params, '%' + escaped + '%')
+
+    def as_postgresql(self, compiler, connection):
+        search_text, params = compiler.compile(self.source_expressions[0])
+        return f"{search_text} ILIKE %s", (*params, '%' + escape_like(self.text) + '%')
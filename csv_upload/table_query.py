@@ -0,0 +1,173 @@
+"""
+Filter, sort and paginate one table, with a versioned result cache.
+
+view_table and reload_table_data both go through TableQuery. Every page it
+serves is cached under a key made of the table id, the table's
+``data_version``, and the filter, sort and page parameters. Anything that
+changes rows or columns calls ``CSVUpload.bump_data_version()``, so stale
+entries are simply never asked for again and age out of the cache.
+
+The cache is the Django cache named by ``CSV_TABLE_CACHE_ALIAS``, which by
+default is the in-process LRU LocMemCache.
+"""
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.paginator import Paginator
+
+from csv_upload.filter_expressions import FilterExpression
+from csv_upload.pagination import keyset_page
+from csv_upload.typed_tables import TypedRowQuery
+
+DEFAULT_CACHE_TIMEOUT = 300
+DEFAULT_PAGE_SIZE = 10
+
+
+def get_table_cache():
+    """The cache backend holding table result pages"""
+    return caches[getattr(settings, 'CSV_TABLE_CACHE_ALIAS', 'default')]
+
+
+def serialize_rows(rows):
+    """Rows as the dicts the table template and the JSON API use"""
+    return [
+        {'id': data_row.id, 'row_number': data_row.row_number, 'data': data_row.get_row_data()}
+        for data_row in rows
+    ]
+
+
+class TablePage:
+    """One page of rows, whether freshly queried or read from the cache"""
+
+    def __init__(self, table_data, number, num_pages, count):
+        self.table_data = table_data
+        self.number = number
+        self.num_pages = num_pages
+        self.count = count
+
+    def has_next(self):
+        return self.number < self.num_pages
+
+    def has_previous(self):
+        return self.number > 1
+
+
+class TableQuery:
+    """The rows of one table under a filter, a filter expression and a sort"""
+
+    def __init__(self, csv_upload, filter_text='', sort_by='row_number', sort_order='asc',
+                 page_size=DEFAULT_PAGE_SIZE, filter_expression=None):
+        self.csv_upload = csv_upload
+        self.filter_text = filter_text
+        self.sort_by = sort_by if sort_by in csv_upload.get_columns() else 'row_number'
+        self.sort_order = 'desc' if sort_order == 'desc' else 'asc'
+        self.page_size = page_size
+        self.filter_expression = filter_expression
+
+    @classmethod
+    def from_request(cls, csv_upload, params, use_where=True):
+        """Build from GET parameters; raises FilterSyntaxError for a bad ``where``"""
+        filter_expression = None
+        where_text = params.get('where', '') if use_where else ''
+        if where_text.strip():
+            filter_expression = FilterExpression(where_text).validate(csv_upload)
+        return cls(
+            csv_upload,
+            filter_text=params.get('filter', ''),
+            sort_by=params.get('sort', 'row_number'),
+            sort_order=params.get('order', 'asc'),
+            page_size=int(params.get('page_size', DEFAULT_PAGE_SIZE)),
+            filter_expression=filter_expression,
+        )
+
+    def data_type(self):
+        """Configured type of the sort column, or None for row_number"""
+        if self.sort_by == 'row_number':
+            return None
+        return self.csv_upload.get_column_properties(self.sort_by).get('data_type')
+
+    def filtered_rows(self):
+        """CSVData rows matching the filter and expression, unordered"""
+        # Through the related manager every row shares self.csv_upload, which array rows decode with
+        data_rows = self.csv_upload.data_rows.all()
+        if self.filter_text:
+            # Search the cell values of the jsonb rows, not the key names
+            data_rows = data_rows.search_values(self.filter_text)
+        if self.filter_expression is not None:
+            data_rows = data_rows.filter(self.filter_expression.to_q(self.csv_upload))
+        return data_rows
+
+    def rows(self):
+        """Filtered and sorted rows, ready for Paginator"""
+        if self.csv_upload.uses_typed_table():
+            # Typed tables filter, sort and paginate in SQL
+            return TypedRowQuery(
+                self.csv_upload, self.filter_text, self.sort_by, self.sort_order, self.filter_expression
+            )
+        data_rows = self.filtered_rows()
+        if self.sort_by != 'row_number':
+            # Sort on the jsonb value in the database, numerically for number columns
+            return data_rows.order_by_column(
+                self.csv_upload.row_key(self.sort_by),
+                descending=(self.sort_order == 'desc'),
+                data_type=self.data_type(),
+            )
+        return data_rows.order_by('row_number' if self.sort_order == 'asc' else '-row_number')
+
+    def supports_cursor(self):
+        """Keyset pagination is available for JSON tables"""
+        return not self.csv_upload.uses_typed_table()
+
+    def cache_key(self, *page_parts):
+        """Key for one result page under the table's current data version"""
+        parts = [
+            self.filter_text,
+            str(self.filter_expression or ''),
+            self.sort_by,
+            self.sort_order,
+            self.page_size,
+            *page_parts,
+        ]
+        digest = hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+        return f'csv_table:{self.csv_upload.pk}:{self.csv_upload.data_version}:{digest}'
+
+    def _cached(self, key, compute):
+        cache = get_table_cache()
+        result = cache.get(key)
+        if result is None:
+            result = compute()
+            cache.set(key, result, getattr(settings, 'CSV_TABLE_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT))
+        return result
+
+    def page(self, page_number=1):
+        """One numbered page (out-of-range numbers clamp like Paginator.get_page)"""
+        def compute():
+            paginator = Paginator(self.rows(), self.page_size)
+            page_obj = paginator.get_page(page_number)
+            return {
+                'table_data': serialize_rows(page_obj.object_list),
+                'number': page_obj.number,
+                'num_pages': paginator.num_pages,
+                'count': paginator.count,
+            }
+
+        result = self._cached(self.cache_key('page', str(page_number)), compute)
+        return TablePage(result['table_data'], result['number'], result['num_pages'], result['count'])
+
+    def keyset(self, cursor=None):
+        """One page by keyset seek; raises InvalidCursor for a bad cursor"""
+        def compute():
+            page = keyset_page(
+                self.filtered_rows(), self.sort_by, self.sort_order, self.page_size, cursor, self.data_type(),
+                row_key=self.csv_upload.row_key(self.sort_by) if self.sort_by != 'row_number' else None
+            )
+            return {
+                'table_data': serialize_rows(page.object_list),
+                'next_cursor': page.next_cursor,
+                'prev_cursor': page.prev_cursor,
+            }
+
+        return self._cached(self.cache_key('cursor', cursor or ''), compute)
@@ -0,0 +1,55 @@
+"""
+Denormalized table summaries for the upload page.
+
+CSVUpload stores ``row_count``, ``byte_size`` (UTF-8 bytes of the non-null
+cell values as text, the same measure for both storage engines),
+``column_count`` and ``last_modified``, so the list of tables is one query
+with no per-table COUNT(*). Ingest sets the counters, cell edits adjust
+``byte_size`` (see profiling.record_cell_changes) and every
+``bump_data_version()`` stamps ``last_modified``.
+``manage.py reconcile_table_stats`` recomputes them from the rows.
+"""
+
+from csv_upload.exports import iter_row_data
+from csv_upload.table_query import TableQuery
+from csv_upload.typed_tables import display_value
+
+
+def text_bytes(value):
+    """UTF-8 size of one stored value (0 for NULL)"""
+    if value is None:
+        return 0
+    return len(display_value(value).encode('utf-8'))
+
+
+def series_bytes(series):
+    """UTF-8 size of the non-null values of a column"""
+    values = series.dropna().astype(str)
+    if values.empty:
+        return 0
+    # Character counts are byte counts for ASCII; only other values are encoded
+    ascii_values = values.str.isascii()
+    total = int(values[ascii_values].str.len().sum())
+    if not ascii_values.all():
+        total += int(values[~ascii_values].str.encode('utf-8').str.len().sum())
+    return total
+
+
+def frame_bytes(frame):
+    """UTF-8 size of the non-null cells of a DataFrame chunk"""
+    return sum(series_bytes(frame[column]) for column in frame.columns)
+
+
+def cell_change_bytes(changes):
+    """Change in byte_size for (column, old, new) stored-text triples"""
+    return sum(text_bytes(new) - text_bytes(old) for _, old, new in changes)
+
+
+def measure_table(csv_upload):
+    """(row_count, byte_size, column_count) recomputed from the stored rows"""
+    table_query = TableQuery(csv_upload)
+    row_count = table_query.rows().count()
+    byte_size = 0
+    for row_data in iter_row_data(table_query):
+        byte_size += sum(text_bytes(value) for value in row_data.values())
+    return row_count, byte_size, len(csv_upload.get_column_names())
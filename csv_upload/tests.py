@@ -1,3 +1,1647 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import date, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from csv_upload.arrow_io import pyarrow_available
+from csv_upload.chunked_uploads import purge_expired_uploads
+from csv_upload.filter_expressions import FilterExpression, FilterSyntaxError
+from csv_upload.ingest import IngestPipeline, dataframe_rows
+from csv_upload.management.commands.import_csv import import_file
+from csv_upload.jobs import claim_next_job, enqueue_upload, run_job
+from csv_upload.merge import MergePipeline, delete_upload
+from csv_upload.models import CSVData, CSVUpload, IngestJob, UploadSession
+from csv_upload.parallel_ingest import RangePipeline, count_quotes, next_record_start, split_ranges
+from csv_upload.partitions import partition_name
+from csv_upload.profiling import HyperLogLog
+from csv_upload.table_query import TableQuery, get_table_cache
+from csv_upload.table_stats import measure_table
+from csv_upload.type_inference import canonicalize_column, column_fits, infer_column_type, widen_data_type
+from csv_upload.typed_tables import ROW_ID, SEARCH_TEXT, physical_table_name
+from csv_upload.views import get_table_data
+
+
+def csv_file(text, name='data.csv'):
+    """In-memory CSV source named like an uploaded file"""
+    source = io.BytesIO(text.encode('utf-8'))
+    source.name = name
+    return source
+
+
+def ingest(text, table_name='people', **kwargs):
+    """Load CSV text into a new table; returns the CSVUpload"""
+    csv_upload, _ = IngestPipeline(csv_file(text), table_name, **kwargs).run()
+    return csv_upload
+
+
+def table_rows(csv_upload):
+    """Every row of a table as a dict, in row order"""
+    return get_table_data(csv_upload, limit=None)
+
+
+def delete_uploads():
+    """Delete every upload with its storage; flushing leaves partitions and typed tables behind"""
+    for csv_upload in CSVUpload.objects.all():
+        delete_upload(csv_upload)
+
+
+class BulkLoadTests(TestCase):
+    """Loading rows into CSVData with COPY on PostgreSQL and bulk_create elsewhere"""
+
+    def test_round_trips_values_that_need_quoting(self):
+        text = 'name,note\nAnn,"comma, here"\nBob,"say ""hi"""\nCy,"two\nlines"\nDee,\nÉd,naïve ✓\n'
+        method = 'COPY' if connection.vendor == 'postgresql' else 'bulk_create'
+        with self.settings(CSV_INGEST_BATCH_SIZE=2), self.assertLogs('csv_upload.bulk_load', 'INFO') as logs:
+            csv_upload = ingest(text)
+        self.assertIn(f'via {method}', logs.output[-1])
+        self.assertEqual(table_rows(csv_upload), [
+            {'name': 'Ann', 'note': 'comma, here'},
+            {'name': 'Bob', 'note': 'say "hi"'},
+            {'name': 'Cy', 'note': 'two\nlines'},
+            {'name': 'Dee', 'note': None},
+            {'name': 'Éd', 'note': 'naïve ✓'},
+        ])
+        row_numbers = CSVData.objects.filter(csv_upload=csv_upload).order_by('row_number')
+        self.assertEqual(list(row_numbers.values_list('row_number', flat=True)), [1, 2, 3, 4, 5])
+
+
+PEOPLE_CSV = 'name,age\nAnn,40\nBob,31\nCy,22\nDee,57\nEd,19\n'
+
+
+@override_settings(CSV_INFERENCE_SAMPLE_ROWS=2)
+class IngestPipelineTests(TestCase):
+    """Chunked ingest into new tables"""
+
+    def test_loads_every_chunk(self):
+        for storage_engine in (CSVUpload.STORAGE_JSON, CSVUpload.STORAGE_TABLE):
+            with self.subTest(storage_engine=storage_engine):
+                pipeline = IngestPipeline(
+                    csv_file(PEOPLE_CSV), f'people_{storage_engine}', storage_engine=storage_engine, memory_budget=1
+                )
+                csv_upload, stats = pipeline.run()
+                self.assertGreater(pipeline.chunks_loaded, 1)
+                self.assertEqual(stats.rows, 5)
+                self.assertTrue(csv_upload.is_ready)
+                self.assertEqual(csv_upload.get_column_properties('age')['data_type'], 'INTEGER')
+                self.assertEqual(
+                    [row['name'] for row in table_rows(csv_upload)], ['Ann', 'Bob', 'Cy', 'Dee', 'Ed']
+                )
+
+    def test_failed_load_removes_the_upload(self):
+        tables = set(connection.introspection.table_names())
+        for storage_engine in (CSVUpload.STORAGE_JSON, CSVUpload.STORAGE_TABLE):
+            with self.subTest(storage_engine=storage_engine):
+                # The last chunk opens a quoted field that never closes
+                with self.assertRaises(pd.errors.ParserError):
+                    ingest(PEOPLE_CSV + '"Flo,33\n', storage_engine=storage_engine, memory_budget=1)
+                self.assertFalse(CSVUpload.objects.exists())
+                self.assertFalse(CSVData.objects.exists())
+                # No typed table is left behind
+                self.assertEqual(set(connection.introspection.table_names()), tables)
+
+    def test_widening_after_the_first_chunk_keeps_the_original_text(self):
+        tables = set(connection.introspection.table_names())
+        text = 'name,active,joined,age\nAnn,yes,01/02/2024,40\nBob,no,03/04/2024,31\nCy,maybe,soon,2.5\n'
+        for storage_engine in (CSVUpload.STORAGE_JSON, CSVUpload.STORAGE_TABLE):
+            with self.subTest(storage_engine=storage_engine):
+                pipeline = IngestPipeline(
+                    csv_file(text), f'people_{storage_engine}', storage_engine=storage_engine, memory_budget=1
+                )
+                with self.assertLogs('csv_upload.ingest', 'INFO') as logs:
+                    csv_upload, stats = pipeline.run()
+                self.assertIn('Reloading', '\n'.join(logs.output))
+                self.assertEqual(stats.rows, 3)
+                types = {name: csv_upload.get_column_properties(name)['data_type'] for name in csv_upload.get_columns()}
+                self.assertEqual(types, {'name': 'TEXT', 'active': 'TEXT', 'joined': 'TEXT', 'age': 'REAL'})
+                rows = table_rows(csv_upload)
+                self.assertEqual([row['active'] for row in rows], ['yes', 'no', 'maybe'])
+                self.assertEqual([row['joined'] for row in rows], ['01/02/2024', '03/04/2024', 'soon'])
+                # The preview is rebuilt by the second load
+                self.assertEqual(pipeline.preview, rows)
+                self.assertEqual([float(row['age']) for row in rows], [40.0, 31.0, 2.5])
+                self.assertEqual(set(csv_upload.get_column_stats()['active']['heavy_hitters']), {'yes', 'no', 'maybe'})
+        # The tables of the abandoned first loads are gone
+        self.assertEqual(CSVUpload.objects.count(), 2)
+        typed = CSVUpload.objects.get(storage_engine=CSVUpload.STORAGE_TABLE)
+        self.assertEqual(set(connection.introspection.table_names()) - tables, {physical_table_name(typed)})
+
+    def test_widening_reads_a_stream_again(self):
+        class Stream(io.BytesIO):
+            def seekable(self):
+                return False
+
+        stream = Stream(b'name,active\nAnn,yes\nBob,no\nCy,maybe\n')
+        csv_upload, _ = IngestPipeline(stream, 'people', filename='people.csv', memory_budget=1).run()
+        self.assertEqual([row['active'] for row in table_rows(csv_upload)], ['yes', 'no', 'maybe'])
+
+    def test_rejects_a_file_without_header(self):
+        with self.assertRaises(ValueError):
+            ingest('')
+        self.assertFalse(CSVUpload.objects.exists())
+
+
+class UnreadyUploadTests(TestCase):
+    """Uploads whose load has not committed are hidden"""
+
+    def setUp(self):
+        self.loading = CSVUpload.objects.create(
+            filename='big.csv', table_name='loading', columns='{"a": {"data_type": "TEXT"}}', is_ready=False
+        )
+
+    def test_hidden_from_the_table_list(self):
+        ready = ingest(PEOPLE_CSV)
+        response = self.client.get(reverse('csv_upload:upload'))
+        self.assertEqual(list(response.context['existing_tables']), [ready])
+
+    def test_table_views_answer_not_found(self):
+        for name in ('view_table', 'edit_table', 'delete_table', 'reload_table_data'):
+            with self.subTest(view=name):
+                response = self.client.get(reverse(f'csv_upload:{name}', args=[self.loading.pk]))
+                self.assertEqual(response.status_code, 404)
+
+    def test_name_stays_taken(self):
+        with self.assertRaises(IntegrityError):
+            ingest(PEOPLE_CSV, table_name='loading')
+
+
+class IngestJobTests(TransactionTestCase):
+    """Background ingest jobs as run_ingest_worker runs them"""
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir, ignore_errors=True)
+        spool_settings = override_settings(CSV_INGEST_SPOOL_DIR=self.spool_dir)
+        spool_settings.enable()
+        self.addCleanup(spool_settings.disable)
+
+    def enqueue(self, text, table_name='people'):
+        uploaded = SimpleUploadedFile(f'{table_name}.csv', text.encode('utf-8'), content_type='text/csv')
+        return enqueue_upload(uploaded, table_name)
+
+    def test_runs_a_queued_job(self):
+        job = self.enqueue(PEOPLE_CSV)
+        claimed = claim_next_job()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.status, IngestJob.STATUS_RUNNING)
+
+        job = run_job(claimed, progress_interval=0.05)
+        self.assertEqual(job.status, IngestJob.STATUS_DONE, job.error)
+        self.assertEqual(job.rows_loaded, 5)
+        self.assertEqual(len(table_rows(job.csv_upload)), 5)
+        self.assertFalse(os.path.exists(job.source_path))
+        self.assertIsNone(claim_next_job())
+
+    @override_settings(CSV_INGEST_BACKGROUND=True)
+    def test_upload_returns_a_job_to_poll(self):
+        response = self.client.post(
+            reverse('csv_upload:upload'), {'csv_file': csv_file(PEOPLE_CSV), 'table_name': 'people'},
+            HTTP_ACCEPT='application/json',
+        )
+        self.assertEqual(response.status_code, 202)
+        progress_url = response.json()['progress_url']
+        progress = self.client.get(progress_url).json()
+        self.assertEqual((progress['status'], progress['table_id']), (IngestJob.STATUS_QUEUED, None))
+        # The name is taken while the job waits
+        response = self.client.post(
+            reverse('csv_upload:upload'), {'csv_file': csv_file(PEOPLE_CSV), 'table_name': 'people'}
+        )
+        self.assertContains(response, 'already exists')
+
+        run_job(claim_next_job(), progress_interval=0.05)
+        progress = self.client.get(progress_url).json()
+        self.assertEqual((progress['status'], progress['rows_loaded']), (IngestJob.STATUS_DONE, 5))
+        self.assertEqual(progress['view_url'], reverse('csv_upload:view_table', args=[progress['table_id']]))
+
+    def test_running_job_with_a_heartbeat_is_left_alone(self):
+        self.enqueue(PEOPLE_CSV)
+        claim_next_job()
+        self.assertIsNone(claim_next_job(stale_after=60))
+
+    def test_stale_job_is_reclaimed_without_its_partial_table(self):
+        job = self.enqueue(PEOPLE_CSV)
+        claim_next_job()
+        # The worker committed the empty table, then died before the rows were in
+        pipeline = IngestPipeline(csv_file(PEOPLE_CSV), 'people')
+        pipeline.update_schema(next(pipeline.iter_chunks()))
+        pipeline.create_upload()
+        IngestJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        with self.assertLogs('csv_upload.jobs', 'WARNING'):
+            claimed = claim_next_job(stale_after=60)
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertFalse(CSVUpload.objects.exists())
+
+        job = run_job(claimed, progress_interval=0.05)
+        self.assertEqual(job.status, IngestJob.STATUS_DONE, job.error)
+        self.assertTrue(job.csv_upload.is_ready)
+        self.assertEqual(job.rows_loaded, 5)
+
+    def test_partial_table_is_discarded_after_the_claim_commits(self):
+        job = self.enqueue(PEOPLE_CSV)
+        IngestJob.objects.filter(pk=job.pk).update(
+            status=IngestJob.STATUS_RUNNING, worker='dead-worker', updated_at=timezone.now() - timedelta(hours=1),
+        )
+        pipeline = IngestPipeline(csv_file(PEOPLE_CSV), 'people')
+        pipeline.update_schema(next(pipeline.iter_chunks()))
+        pipeline.create_upload()
+        seen = {}
+
+        def record_state(csv_upload):
+            seen['atomic_blocks'] = len(connection.atomic_blocks)
+            seen['worker'] = IngestJob.objects.get(pk=job.pk).worker
+
+        outer_blocks = len(connection.atomic_blocks)
+        with mock.patch('csv_upload.jobs.delete_upload', side_effect=record_state), self.assertLogs('csv_upload.jobs'):
+            claimed = claim_next_job(stale_after=60)
+        self.assertEqual(seen['atomic_blocks'], outer_blocks)
+        self.assertEqual(seen['worker'], claimed.worker)
+        self.assertNotEqual(claimed.worker, 'dead-worker')
+
+
+class TypedTableTests(TestCase):
+    """Uploads stored as typed SQL tables"""
+
+    def setUp(self):
+        get_table_cache().clear()
+        self.csv_upload = ingest(
+            'name,joined,born,active,age\n'
+            'Ann,2024-01-02,2024-01-02,yes,40\n'
+            'Bob,2023-11-30,1999-12-31 08:30:00,no,31\n'
+            'Cy,2022-05-06,2001-07-08 12:00,yes,22\n',
+            storage_engine=CSVUpload.STORAGE_TABLE,
+        )
+
+    def configure(self, column, **properties):
+        data = {'data_type': 'TEXT', 'nullable': 'on', 'on_delete': 'CASCADE', **properties}
+        response = self.client.post(
+            reverse('csv_upload:configure_column', args=[self.csv_upload.pk, column]), data
+        )
+        self.assertEqual(response.status_code, 302)
+        self.csv_upload.refresh_from_db()
+
+    def reload(self, **params):
+        response = self.client.get(reverse('csv_upload:reload_table_data', args=[self.csv_upload.pk]), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_infers_column_types(self):
+        types = {name: self.csv_upload.get_column_properties(name)['data_type'] for name in self.csv_upload.get_columns()}
+        self.assertEqual(types, {
+            'name': 'TEXT', 'joined': 'DATE', 'born': 'DATETIME', 'active': 'BOOLEAN', 'age': 'INTEGER',
+        })
+        self.assertEqual(table_rows(self.csv_upload)[0], {
+            'name': 'Ann', 'joined': '2024-01-02', 'born': '2024-01-02 00:00:00', 'active': 'true', 'age': '40',
+        })
+        inference = self.csv_upload.get_column_properties('born')['type_inference']
+        self.assertEqual((inference['confidence'], inference['sample_size']), (1.0, 3))
+
+    def test_configuring_a_column_keeps_the_others(self):
+        before = table_rows(self.csv_upload)
+        self.configure('name', max_length='50')
+        self.assertEqual(self.csv_upload.get_column_properties('name')['max_length'], 50)
+        self.assertEqual(table_rows(self.csv_upload), before)
+        # What ingest inferred is kept next to the configured properties
+        self.assertIn('type_inference', self.csv_upload.get_column_properties('name'))
+
+    def test_changing_a_type_casts_only_that_column(self):
+        self.configure('age', data_type='REAL')
+        rows = table_rows(self.csv_upload)
+        self.assertEqual([float(row['age']) for row in rows], [40.0, 31.0, 22.0])
+        self.assertEqual([row['joined'] for row in rows], ['2024-01-02', '2023-11-30', '2022-05-06'])
+        self.assertEqual(
+            [row['born'] for row in rows], ['2024-01-02 00:00:00', '1999-12-31 08:30:00', '2001-07-08 12:00:00']
+        )
+        self.assertEqual([row['active'] for row in rows], ['true', 'false', 'true'])
+
+    def test_filters_sorts_and_pages_in_sql(self):
+        page = self.reload(sort='age', order='desc', page_size=2, page=1)
+        self.assertEqual((page['total_records'], page['total_pages']), (3, 2))
+        self.assertEqual([row['data']['name'] for row in page['table_data']], ['Ann', 'Bob'])
+        page = self.reload(sort='age', order='desc', page_size=2, page=2)
+        self.assertEqual([row['data']['name'] for row in page['table_data']], ['Cy'])
+        # The filter matches any column's text, ignoring case
+        page = self.reload(filter='BO')
+        self.assertEqual([row['data']['name'] for row in page['table_data']], ['Bob'])
+        page = self.reload(filter='2023')
+        self.assertEqual([row['data']['name'] for row in page['table_data']], ['Bob'])
+
+    def test_filter_searches_the_displayed_values(self):
+        with CaptureQueriesContext(connection) as queries:
+            page = self.reload(filter='FALSE')
+        self.assertEqual([row['data']['name'] for row in page['table_data']], ['Bob'])
+        # One indexed column is matched instead of casting every column
+        self.assertFalse(any('CAST(' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual([row['data']['name'] for row in self.reload(filter='08:30:00')['table_data']], ['Bob'])
+        self.assertEqual(self.reload(filter='name')['table_data'], [])
+
+    def test_search_column_follows_edits_and_type_changes(self):
+        rows = self.reload()['table_data']
+        self.client.post(
+            reverse('csv_upload:update_cell', args=[self.csv_upload.pk]),
+            json.dumps({'row_id': rows[0]['id'], 'column': 'name', 'value': 'Anya'}), content_type='application/json',
+        )
+        self.client.post(
+            reverse('csv_upload:patch_table', args=[self.csv_upload.pk]),
+            json.dumps([{'row_id': rows[2]['id'], 'column': 'name', 'value': 'Cyra'}]), content_type='application/json',
+        )
+        self.assertEqual([row['data']['name'] for row in self.reload(filter='y')['table_data']], ['Anya', 'Cyra'])
+        self.assertEqual(self.reload(filter='Ann')['table_data'], [])
+        self.configure('age', data_type='REAL')
+        self.assertEqual([row['data']['name'] for row in self.reload(filter='31.0')['table_data']], ['Bob'])
+
+    def test_update_cell_coerces_to_the_column_type(self):
+        row_id = self.reload()['table_data'][0]['id']
+        url = reverse('csv_upload:update_cell', args=[self.csv_upload.pk])
+        response = self.client.post(
+            url, json.dumps({'row_id': row_id, 'column': 'age', 'value': ' 41 '}), content_type='application/json'
+        )
+        self.assertEqual(response.json()['new_value'], '41')
+        self.assertEqual(table_rows(self.csv_upload)[0]['age'], '41')
+        response = self.client.post(
+            url, json.dumps({'row_id': row_id, 'column': 'age', 'value': 'forty'}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(table_rows(self.csv_upload)[0]['age'], '41')
+
+
+class TypedSearchMigrationTests(TransactionTestCase):
+    """Typed tables created before they had a search column"""
+
+    def setUp(self):
+        self.addCleanup(delete_uploads)
+
+    def test_migration_fills_the_search_column(self):
+        csv_upload = ingest('name,active,age\nAnn,yes,40\n,,\n', storage_engine=CSVUpload.STORAGE_TABLE)
+        executor = MigrationExecutor(connection)
+        latest = executor.loader.graph.leaf_nodes('csv_upload')
+        self.addCleanup(lambda: MigrationExecutor(connection).migrate(latest))
+        executor.migrate([('csv_upload', '0015_ingest_mode')])
+        MigrationExecutor(connection).migrate(latest)
+
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {quote(SEARCH_TEXT)} FROM {quote(physical_table_name(csv_upload))} ORDER BY {quote(ROW_ID)}"
+            )
+            self.assertEqual([row[0] for row in cursor.fetchall()], ['Ann\ntrue\n40', ''])
+
+
+class JSONRowTests(TestCase):
+    """jsonb rows filtered, sorted and edited in the database"""
+
+    def setUp(self):
+        get_table_cache().clear()
+        self.csv_upload = ingest(PEOPLE_CSV, storage_engine=CSVUpload.STORAGE_JSON)
+
+    def update_cell(self, row_id, column, value):
+        return self.client.post(
+            reverse('csv_upload:update_cell', args=[self.csv_upload.pk]),
+            json.dumps({'row_id': row_id, 'column': column, 'value': value}), content_type='application/json',
+        )
+
+    def reload(self, **params):
+        response = self.client.get(reverse('csv_upload:reload_table_data', args=[self.csv_upload.pk]), params)
+        return [row['data']['name'] for row in response.json()['table_data']]
+
+    def test_update_cell_rewrites_one_key(self):
+        row = CSVData.objects.filter(csv_upload=self.csv_upload).order_by('row_number').first()
+        response = self.update_cell(row.id, 'name', 'Anna')
+        self.assertEqual(response.json()['success'], True)
+        self.assertEqual(table_rows(self.csv_upload)[0], {'name': 'Anna', 'age': '40'})
+        rows = CSVData.objects.filter(csv_upload=self.csv_upload)
+        self.assertEqual(list(rows.search_values('anna').values_list('id', flat=True)), [row.id])
+
+    def test_update_cell_rejects_bad_edits(self):
+        row = CSVData.objects.filter(csv_upload=self.csv_upload).order_by('row_number').first()
+        for column, row_id in (('height', row.id), ('name', 0)):
+            with self.subTest(column=column, row_id=row_id):
+                response = self.update_cell(row_id, column, 'X')
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(table_rows(self.csv_upload)[0], {'name': 'Ann', 'age': '40'})
+
+    def test_filter_matches_cell_values_only(self):
+        self.assertEqual(self.reload(filter='DEE'), ['Dee'])
+        # Every row has a "name" key, but no value containing it
+        self.assertEqual(self.reload(filter='name'), [])
+
+    def test_sorts_by_a_column(self):
+        self.assertEqual(self.reload(sort='name', order='desc'), ['Ed', 'Dee', 'Cy', 'Bob', 'Ann'])
+
+    @skipUnless(connection.vendor == 'postgresql', 'jsonb is PostgreSQL only')
+    def test_row_data_is_jsonb(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT data_type FROM information_schema.columns WHERE table_name = %s AND column_name = %s',
+                [CSVData._meta.db_table, 'row_data'],
+            )
+            self.assertEqual(cursor.fetchone()[0], 'jsonb')
+
+
+class NumericSortTests(TestCase):
+    """INTEGER and REAL columns of JSON rows sort numerically"""
+
+    def setUp(self):
+        get_table_cache().clear()
+
+    def reload(self, csv_upload, **params):
+        response = self.client.get(reverse('csv_upload:reload_table_data', args=[csv_upload.pk]), params)
+        return [row['data'] for row in response.json()['table_data']]
+
+    def test_text_that_is_not_a_number_sorts_last(self):
+        values = ['10', '1.2.3', '9', '-', 'v5', '2.5', '', '1e1', ' 7 ']
+        csv_upload = ingest('value\n' + '\n'.join(f'"{value}"' for value in values) + '\n')
+        rows = CSVData.objects.filter(csv_upload=csv_upload)
+        for descending, numbers in ((False, ['2.5', ' 7 ', '9', '10', '1e1']), (True, ['10', '1e1', '9', ' 7 ', '2.5'])):
+            with self.subTest(descending=descending):
+                ordered = [
+                    row.get_row_data()['value']
+                    for row in rows.order_by_column(csv_upload.row_key('value'), descending=descending, data_type='REAL')
+                ]
+                self.assertEqual(ordered[:5], numbers)
+                # Everything else keeps file order after the numbers
+                self.assertEqual(ordered[5:], ['1.2.3', '-', 'v5', None])
+
+    def test_views_sort_by_the_column_type(self):
+        csv_upload = ingest('n,score,code\n1,9,9\n2,100,100\n3,10,10\n')
+        # Inferred INTEGER columns sort as numbers
+        for order, expected in (('asc', ['9', '10', '100']), ('desc', ['100', '10', '9'])):
+            with self.subTest(order=order):
+                rows = self.reload(csv_upload, sort='score', order=order)
+                self.assertEqual([row['score'] for row in rows], expected)
+        # A column configured as TEXT keeps string order
+        csv_upload.set_column_properties('code', {**csv_upload.get_column_properties('code'), 'data_type': 'TEXT'})
+        csv_upload.save()
+        rows = self.reload(csv_upload, sort='code')
+        self.assertEqual([row['code'] for row in rows], ['10', '100', '9'])
+        response = self.client.get(reverse('csv_upload:view_table', args=[csv_upload.pk]), {'sort': 'score', 'order': 'desc'})
+        self.assertEqual([row['data']['n'] for row in response.context['page_obj'].table_data], ['2', '3', '1'])
+
+
+def scores_csv(count=25):
+    """Rows numbered 1..count with an INTEGER score column that has gaps and ties"""
+    lines = ['n,score']
+    for number in range(1, count + 1):
+        lines.append(f'{number},{"" if number % 6 == 0 else number * 7 % 11}')
+    return '\n'.join(lines) + '\n'
+
+
+class KeysetPaginationTests(TestCase):
+    """Seeking through the reload API with opaque cursors"""
+
+    def setUp(self):
+        get_table_cache().clear()
+        self.csv_upload = ingest(scores_csv(), 'scores', storage_engine=CSVUpload.STORAGE_JSON)
+        self.url = reverse('csv_upload:reload_table_data', args=[self.csv_upload.pk])
+
+    def walk(self, direction='next', cursor=None, **params):
+        """Row numbers of every page from a cursor, following next or prev cursors"""
+        pages = []
+        while True:
+            query = {'pagination': 'cursor', 'page_size': 4, **params}
+            if cursor:
+                query['cursor'] = cursor
+            data = self.client.get(self.url, query).json()
+            self.assertEqual(data['pagination'], 'cursor')
+            pages.append([row['row_number'] for row in data['table_data']])
+            cursor = data[f'{direction}_cursor']
+            if cursor is None:
+                return pages, data
+
+    def test_cursors_visit_every_row_once_in_either_direction(self):
+        for sort, order in (('row_number', 'asc'), ('row_number', 'desc'), ('score', 'asc'), ('score', 'desc')):
+            with self.subTest(sort=sort, order=order):
+                expected = [
+                    row['row_number'] for row in
+                    self.client.get(self.url, {'sort': sort, 'order': order, 'page_size': 100}).json()['table_data']
+                ]
+                pages, last = self.walk(sort=sort, order=order)
+                self.assertEqual([number for page in pages for number in page], expected)
+                self.assertFalse(last['has_next'])
+                self.assertTrue(all(len(page) == 4 for page in pages[:-1]))
+                # Back from the last page to the first
+                back, first = self.walk('prev', last['prev_cursor'], sort=sort, order=order)
+                self.assertEqual([number for page in reversed(back) for number in page], expected[:-len(pages[-1])])
+                self.assertFalse(first['has_previous'])
+
+    def test_rejects_a_bad_or_foreign_cursor(self):
+        data = self.client.get(self.url, {'pagination': 'cursor', 'page_size': 4, 'sort': 'score'}).json()
+        for cursor, params in (('not a cursor', {'sort': 'score'}), (data['next_cursor'], {'sort': 'n'})):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(self.url, {'cursor': cursor, **params})
+                self.assertEqual(response.status_code, 400)
+
+
+class SearchTests(TestCase):
+    """The table filter searches cell values, not column names"""
+
+    def setUp(self):
+        self.csv_upload = ingest('name,city\nAnn,Oslo\n,\nBob,Bergen\n')
+
+    def search(self, text):
+        rows = CSVData.objects.filter(csv_upload=self.csv_upload).search_values(text).order_by('row_number')
+        return [row.get_row_data()['name'] for row in rows]
+
+    def test_matches_any_cell(self):
+        self.assertEqual(self.search('ERG'), ['Bob'])
+        self.assertEqual(self.search('n'), ['Ann', 'Bob'])
+
+    def test_ignores_column_names(self):
+        self.assertEqual(self.search('city'), [])
+
+    def test_row_of_empty_cells_is_kept(self):
+        self.assertEqual(CSVData.objects.filter(csv_upload=self.csv_upload).count(), 3)
+        self.assertEqual(CSVData.objects.get(csv_upload=self.csv_upload, row_number=2).search_text, '')
+
+    def test_wildcards_match_literally(self):
+        csv_upload = ingest('code\n50%\n500\na_b\naxb\n', 'codes')
+        rows = CSVData.objects.filter(csv_upload=csv_upload)
+        self.assertEqual([row.search_text for row in rows.search_values('0%')], ['50%'])
+        self.assertEqual([row.search_text for row in rows.search_values('a_')], ['a_b'])
+
+    def test_index_follows_edits(self):
+        row = CSVData.objects.get(csv_upload=self.csv_upload, row_number=1)
+        CSVData.objects.filter(csv_upload=self.csv_upload).set_cell(row.id, self.csv_upload.row_key('city'), 'Tromsø')
+        self.assertEqual(self.search('troms'), ['Ann'])
+        self.assertEqual(self.search('oslo'), [])
+
+
+class FilterExpressionTests(TestCase):
+    """Filter expressions give the same rows on both storage engines"""
+
+    CSV = 'name,age\nAnn,40\nann,31\nAnna,22\nA_n,57\nA*n,19\n'
+
+    def setUp(self):
+        get_table_cache().clear()
+        self.uploads = [
+            ingest(self.CSV, table_name=f'people_{storage_engine}', storage_engine=storage_engine)
+            for storage_engine in (CSVUpload.STORAGE_JSON, CSVUpload.STORAGE_TABLE)
+        ]
+
+    def reload(self, csv_upload, expression):
+        return self.client.get(reverse('csv_upload:reload_table_data', args=[csv_upload.pk]), {'where': expression})
+
+    def assertMatches(self, expression, names):
+        for csv_upload in self.uploads:
+            with self.subTest(expression=expression, storage_engine=csv_upload.storage_engine):
+                rows = self.reload(csv_upload, expression).json()['table_data']
+                self.assertEqual([row['data']['name'] for row in rows], names)
+
+    def test_prefix_match_is_case_sensitive(self):
+        self.assertMatches("name ^= An", ['Ann', 'Anna'])
+        self.assertMatches("name ^= an", ['ann'])
+
+    def test_prefix_match_has_no_wildcards(self):
+        self.assertMatches("name ^= 'A_'", ['A_n'])
+        self.assertMatches("name ^= 'A*'", ['A*n'])
+        self.assertMatches("name ^= 'A%'", [])
+
+    def test_numeric_comparison(self):
+        self.assertMatches('age > 30 AND NOT name = ann', ['Ann', 'A_n'])
+
+    def test_rejects_unknown_columns_and_bad_values(self):
+        csv_upload = self.uploads[0]
+        for expression in ('city = Oslo', 'age > old', 'age >', 'name ^= (a'):
+            with self.subTest(expression=expression):
+                with self.assertRaises(FilterSyntaxError):
+                    FilterExpression(expression).validate(csv_upload)
+                self.assertEqual(self.reload(csv_upload, expression).status_code, 400)
+
+
+class TableQueryCacheTests(TestCase):
+    """Result pages cached under the table's data version"""
+
+    def setUp(self):
+        get_table_cache().clear()
+        self.csv_upload = ingest(scores_csv(), 'scores', storage_engine=CSVUpload.STORAGE_JSON)
+
+    def test_repeated_pages_are_served_from_the_cache(self):
+        TableQuery(self.csv_upload, sort_by='score').page(2)
+        with self.assertNumQueries(0):
+            page = TableQuery(self.csv_upload, sort_by='score').page(2)
+        self.assertEqual((page.number, page.num_pages, page.count), (2, 3, 25))
+        # Another filter, sort or page is a different entry
+        with self.assertNumQueries(2):
+            TableQuery(self.csv_upload, sort_by='score', sort_order='desc').page(2)
+
+    def test_bumping_the_data_version_retires_cached_pages(self):
+        self.assertEqual(TableQuery(self.csv_upload).page(1).table_data[0]['data']['n'], '1')
+        row = CSVData.objects.filter(csv_upload=self.csv_upload, row_number=1).get()
+        CSVData.objects.set_cell(row.id, self.csv_upload.row_key('n'), '100')
+        # Not yet bumped: the cached page is still served
+        self.assertEqual(TableQuery(self.csv_upload).page(1).table_data[0]['data']['n'], '1')
+        self.csv_upload.bump_data_version()
+        self.assertEqual(TableQuery(self.csv_upload).page(1).table_data[0]['data']['n'], '100')
+
+    def test_views_bump_the_data_version(self):
+        row = CSVData.objects.filter(csv_upload=self.csv_upload, row_number=1).get()
+        url = reverse('csv_upload:reload_table_data', args=[self.csv_upload.pk])
+        self.assertEqual(self.client.get(url).json()['table_data'][0]['data']['n'], '1')
+        self.client.post(
+            reverse('csv_upload:update_cell', args=[self.csv_upload.pk]),
+            json.dumps({'row_id': row.id, 'column': 'n', 'value': '100'}), content_type='application/json',
+        )
+        self.assertEqual(self.client.get(url).json()['table_data'][0]['data']['n'], '100')
+
+
+class ConditionalReloadTests(TestCase):
+    """ETags and 304 responses on the reload API"""
+
+    def setUp(self):
+        get_table_cache().clear()
+        self.csv_upload = ingest(PEOPLE_CSV, storage_engine=CSVUpload.STORAGE_JSON)
+        self.url = reverse('csv_upload:reload_table_data', args=[self.csv_upload.pk])
+
+    def test_unchanged_table_answers_304_without_reading_rows(self):
+        response = self.client.get(self.url, {'sort': 'age'})
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        # Only the version lookup runs
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'sort': 'age'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # Another query string has another ETag
+        response = self.client.get(self.url, {'sort': 'name'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_edits_change_the_etag(self):
+        response = self.client.get(self.url)
+        row = response.json()['table_data'][0]
+        self.client.post(
+            reverse('csv_upload:update_cell', args=[self.csv_upload.pk]),
+            json.dumps({'row_id': row['id'], 'column': 'age', 'value': '41'}), content_type='application/json',
+        )
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()['table_data'][0]['data']['age'], '41')
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def test_missing_table_is_404(self):
+        self.assertEqual(self.client.get(reverse('csv_upload:reload_table_data', args=[0])).status_code, 404)
+
+
+class PatchTableTests(TestCase):
+    """Batched cell edits through the patch API, on both storage engines"""
+
+    def setUp(self):
+        get_table_cache().clear()
+
+    def patch(self, csv_upload, edits):
+        return self.client.post(
+            reverse('csv_upload:patch_table', args=[csv_upload.pk]), json.dumps({'edits': edits}),
+            content_type='application/json',
+        )
+
+    def test_applies_valid_edits_and_reports_the_rest(self):
+        for storage_engine in (CSVUpload.STORAGE_JSON, CSVUpload.STORAGE_TABLE):
+            with self.subTest(storage_engine=storage_engine):
+                csv_upload = ingest(PEOPLE_CSV, f'people_{storage_engine}', storage_engine=storage_engine)
+                ids = [row['id'] for row in TableQuery(csv_upload, page_size=100).page().table_data]
+                data = self.patch(csv_upload, [
+                    {'row_id': ids[0], 'column': 'name', 'value': 'Anna'},
+                    {'row_id': ids[1], 'column': 'age', 'value': '32'},
+                    {'row_id': ids[1], 'column': 'age', 'value': 33},
+                    {'row_id': ids[2], 'column': 'age', 'value': 'old'},
+                    {'row_id': ids[3], 'column': 'height', 'value': '1'},
+                    {'row_id': max(ids) + 100, 'column': 'name', 'value': 'Nobody'},
+                    {'row_id': ids[4], 'column': 'age', 'value': None},
+                ]).json()
+                self.assertEqual((data['applied'], data['failed']), (4, 3))
+                self.assertEqual(
+                    [result['success'] for result in data['results']], [True, True, True, False, False, False, True]
+                )
+                self.assertEqual(data['results'][5]['message'], f'Row {max(ids) + 100} does not exist')
+                # The later edit of a cell wins
+                self.assertEqual(
+                    [(row['name'], row['age']) for row in table_rows(csv_upload)],
+                    [('Anna', '40'), ('Bob', '33'), ('Cy', '22'), ('Dee', '57'), ('Ed', None)],
+                )
+
+    def test_rejects_a_malformed_patch(self):
+        csv_upload = ingest(PEOPLE_CSV)
+        version = csv_upload.data_version
+        for body in ({'edits': 'name=Ann'}, {'edits': {'row_id': 1}}):
+            with self.subTest(body=body):
+                response = self.client.post(
+                    reverse('csv_upload:patch_table', args=[csv_upload.pk]), json.dumps(body),
+                    content_type='application/json',
+                )
+                self.assertEqual(response.status_code, 400)
+        with override_settings(CSV_PATCH_MAX_EDITS=1):
+            self.assertEqual(self.patch(csv_upload, [{}, {}]).status_code, 400)
+        csv_upload.refresh_from_db()
+        self.assertEqual(csv_upload.data_version, version)
+
+
+class ColumnProfileTests(TestCase):
+    """Column profiles collected at ingest and kept current by edits"""
+
+    def setUp(self):
+        get_table_cache().clear()
+
+    def test_ingest_profiles_every_column(self):
+        csv_upload = ingest(PEOPLE_CSV + 'Flo,\n', memory_budget=1)
+        stats = csv_upload.get_column_stats()
+        age = stats['age']
+        self.assertEqual((age['count'], age['null_count'], age['distinct_estimate']), (6, 1, 5))
+        self.assertEqual(
+            {key: age['numeric'][key] for key in ('count', 'sum', 'min', 'max')},
+            {'count': 5, 'sum': 169.0, 'min': 19.0, 'max': 57.0},
+        )
+        self.assertEqual(sum(age['numeric']['histogram']['counts']), 5)
+        self.assertEqual((stats['name']['text_min'], stats['name']['text_max']), ('Ann', 'Flo'))
+        self.assertEqual(stats['name']['heavy_hitters'], {name: 1 for name in ('Ann', 'Bob', 'Cy', 'Dee', 'Ed', 'Flo')})
+
+    def test_edits_update_the_profile(self):
+        csv_upload = ingest(PEOPLE_CSV)
+        rows = TableQuery(csv_upload, page_size=100).page().table_data
+        self.client.post(
+            reverse('csv_upload:patch_table', args=[csv_upload.pk]),
+            json.dumps([
+                {'row_id': rows[3]['id'], 'column': 'age', 'value': None},
+                {'row_id': rows[0]['id'], 'column': 'name', 'value': 'Bob'},
+            ]),
+            content_type='application/json',
+        )
+        csv_upload.refresh_from_db()
+        stats = csv_upload.get_column_stats()
+        self.assertEqual((stats['age']['null_count'], stats['age']['numeric']['count']), (1, 4))
+        self.assertEqual(stats['age']['numeric']['sum'], 112.0)
+        # 57 was the maximum, so the bounds are now only an outer estimate
+        self.assertFalse(stats['age']['exact_bounds'])
+        self.assertEqual(stats['name']['heavy_hitters']['Bob'], 2)
+        self.assertNotIn('Ann', stats['name']['heavy_hitters'])
+
+    def test_patch_updates_each_column_sketch_once(self):
+        csv_upload = ingest(PEOPLE_CSV)
+        rows = TableQuery(csv_upload, page_size=100).page().table_data
+        edits = [{'row_id': row['id'], 'column': 'name', 'value': f'New {i}'} for i, row in enumerate(rows)]
+        edits.append({'row_id': rows[0]['id'], 'column': 'age', 'value': '99'})
+        with mock.patch('csv_upload.profiling.HyperLogLog.from_json', wraps=HyperLogLog.from_json) as from_json:
+            self.client.post(
+                reverse('csv_upload:patch_table', args=[csv_upload.pk]), json.dumps(edits),
+                content_type='application/json',
+            )
+        self.assertEqual(from_json.call_count, 2)
+        csv_upload.refresh_from_db()
+        name = csv_upload.get_column_stats()['name']
+        self.assertEqual(name['heavy_hitters'], {f'New {i}': 1 for i in range(5)})
+        self.assertEqual(name['distinct_estimate'], 10)
+
+    def test_edit_page_shows_profiles_without_reading_rows(self):
+        csv_upload = ingest(PEOPLE_CSV)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('csv_upload:edit_table', args=[csv_upload.pk]))
+        self.assertFalse(any(CSVData._meta.db_table in query['sql'] for query in queries.captured_queries))
+        age = next(column for column in response.context['columns_with_properties'] if column['name'] == 'age')
+        self.assertEqual((age['stats']['min'], age['stats']['max'], age['stats']['mean']), (19.0, 57.0, 33.8))
+
+
+class TypeInferenceTests(TestCase):
+    """Vectorized type inference and canonical forms"""
+
+    def infer(self, *values):
+        return infer_column_type(pd.Series(values, dtype=object))
+
+    def test_picks_the_narrowest_type(self):
+        self.assertEqual(self.infer('1', '-2', None, '30')[0], 'INTEGER')
+        self.assertEqual(self.infer('1', '2.5', '.5', '1e3')[0], 'REAL')
+        self.assertEqual(self.infer('yes', 'No', 'TRUE', 'f')[0], 'BOOLEAN')
+        self.assertEqual(self.infer('2024-03-01', '1999-12-31')[0], 'DATE')
+        self.assertEqual(self.infer('2024-03-01', '2024-03-01 12:30')[0], 'DATETIME')
+        # Leading zeros and empty samples stay text
+        self.assertEqual(self.infer('007', '12')[0], 'TEXT')
+        self.assertEqual(self.infer(None, ' ')[0], 'TEXT')
+
+    def test_detects_locale_date_formats(self):
+        data_type, inference = self.infer('31/12/2024', '01/02/2024')
+        self.assertEqual((data_type, inference['date_format']), ('DATE', '%d/%m/%Y'))
+        data_type, inference = self.infer('12/31/2024', '01/02/2024')
+        self.assertEqual((data_type, inference['date_format']), ('DATE', '%m/%d/%Y'))
+
+    def test_records_scores_below_the_confidence_threshold(self):
+        data_type, inference = self.infer('1', '2', '3', 'n/a')
+        self.assertEqual(data_type, 'TEXT')
+        self.assertEqual(inference['scores']['INTEGER'], 0.75)
+        self.assertEqual(inference['sample_size'], 4)
+        with self.settings(CSV_INFERENCE_MIN_CONFIDENCE=0.7):
+            data_type, inference = self.infer('1', '2', '3', 'n/a')
+        self.assertEqual((data_type, inference['confidence']), ('INTEGER', 0.75))
+
+    def test_widening_follows_the_type_chains(self):
+        self.assertEqual(widen_data_type('INTEGER', 'REAL'), 'REAL')
+        self.assertEqual(widen_data_type('DATE', 'DATETIME'), 'DATETIME')
+        self.assertEqual(widen_data_type('BOOLEAN', 'INTEGER'), 'TEXT')
+        self.assertEqual(widen_data_type('DATE', 'REAL'), 'TEXT')
+
+    def test_later_values_may_use_another_date_format(self):
+        later_chunk = pd.Series(['31.12.2024', '01.02.2024'])
+        self.assertTrue(column_fits(later_chunk, 'DATE', 'ISO8601'))
+        self.assertFalse(column_fits(later_chunk, 'INTEGER'))
+        self.assertEqual(list(canonicalize_column(later_chunk, 'DATE', 'ISO8601')), ['2024-12-31', '2024-02-01'])
+
+    def test_canonical_forms(self):
+        def canonical(data_type, *values, date_format=None):
+            return list(canonicalize_column(pd.Series(values, dtype=object), data_type, date_format))
+
+        self.assertEqual(canonical('INTEGER', ' 42', '+7', None), ['42', '7', None])
+        self.assertEqual(canonical('REAL', '2.50', '1e3'), ['2.5', '1000.0'])
+        self.assertEqual(canonical('BOOLEAN', 'Yes', 'n', 'maybe'), ['true', 'false', 'maybe'])
+        self.assertEqual(
+            canonical('DATETIME', '03/01/2024 12:30', '03/02/2024', date_format='%m/%d/%Y %H:%M'),
+            ['2024-03-01 12:30:00', '2024-03-02 00:00:00'],
+        )
+
+
+class ExportTests(TestCase):
+    """Streaming CSV, NDJSON and SQL exports under the table's filter and sort"""
+
+    def export(self, csv_upload, export_format, **params):
+        response = self.client.get(reverse('csv_upload:export_table', args=[csv_upload.pk, export_format]), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def for_each_engine(self):
+        for storage_engine in (CSVUpload.STORAGE_JSON, CSVUpload.STORAGE_TABLE):
+            with self.subTest(storage_engine=storage_engine):
+                yield ingest(PEOPLE_CSV + 'Flo,\n', f'people_{storage_engine}', storage_engine=storage_engine)
+
+    def test_csv_follows_the_filter_and_sort(self):
+        for csv_upload in self.for_each_engine():
+            text = self.export(csv_upload, 'csv', where='age > 20', sort='age', order='desc')
+            self.assertEqual(text.splitlines(), ['name,age', 'Dee,57', 'Ann,40', 'Bob,31', 'Cy,22'])
+
+    def test_ndjson_has_native_values(self):
+        for csv_upload in self.for_each_engine():
+            records = [json.loads(line) for line in self.export(csv_upload, 'ndjson').splitlines()]
+            self.assertEqual(records[0], {'name': 'Ann', 'age': 40})
+            self.assertEqual(records[-1], {'name': 'Flo', 'age': None})
+
+    def test_sql_dump_recreates_the_table(self):
+        for csv_upload in self.for_each_engine():
+            script = self.export(csv_upload, 'sql', dialect='sqlite')
+            database = sqlite3.connect(':memory:')
+            self.addCleanup(database.close)
+            database.executescript(script)
+            rows = database.execute(f'SELECT name, age FROM "{csv_upload.table_name}"').fetchall()
+            self.assertEqual(rows, [('Ann', 40), ('Bob', 31), ('Cy', 22), ('Dee', 57), ('Ed', 19), ('Flo', None)])
+
+    def test_unknown_format_is_404(self):
+        csv_upload = ingest(PEOPLE_CSV)
+        response = self.client.get(reverse('csv_upload:export_table', args=[csv_upload.pk, 'xlsx']))
+        self.assertEqual(response.status_code, 404)
+        # A table still loading cannot be exported either
+        CSVUpload.objects.filter(pk=csv_upload.pk).update(is_ready=False)
+        response = self.client.get(reverse('csv_upload:export_table', args=[csv_upload.pk, 'csv']))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(CSV_EXPORT_CHUNK_SIZE=2, CSV_EXPORT_INSERT_BATCH_SIZE=2)
+    def test_small_chunks_export_every_row(self):
+        for csv_upload in self.for_each_engine():
+            self.assertEqual(len(self.export(csv_upload, 'csv').splitlines()), 7)
+            self.assertEqual(self.export(csv_upload, 'sql').count('INSERT INTO'), 3)
+
+
+@skipUnless(pyarrow_available(), 'needs pyarrow')
+class ArrowFormatTests(TestCase):
+    """Parquet and Arrow IPC import with the Arrow schema's types, and Parquet export"""
+
+    def setUp(self):
+        import pyarrow as pa
+
+        self.table = pa.table({
+            'id': pa.array([1, 2, 3], pa.int32()),
+            'price': pa.array([1.5, None, -2.25]),
+            'active': pa.array([True, False, None]),
+            'joined': pa.array([date(2024, 1, 2), date(2024, 2, 29), None]),
+            'note': pa.array(['a, "b"', None, 'ünï']),
+        })
+
+    def source(self, fmt):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        buffer = io.BytesIO()
+        if fmt == 'parquet':
+            pq.write_table(self.table, buffer, row_group_size=1)
+        else:
+            with pa.ipc.new_file(buffer, self.table.schema) as writer:
+                for batch in self.table.to_batches(max_chunksize=1):
+                    writer.write_batch(batch)
+        buffer.seek(0)
+        buffer.name = f'items.{fmt}'
+        return buffer
+
+    def test_imports_with_the_schema_types(self):
+        for fmt in ('parquet', 'arrow'):
+            for storage_engine in (CSVUpload.STORAGE_JSON, CSVUpload.STORAGE_TABLE):
+                with self.subTest(fmt=fmt, storage_engine=storage_engine):
+                    csv_upload, _ = IngestPipeline(
+                        self.source(fmt), f'items_{fmt}_{storage_engine}', storage_engine=storage_engine, memory_budget=1
+                    ).run()
+                    self.assertEqual(
+                        {name: csv_upload.get_column_properties(name)['data_type'] for name in csv_upload.get_column_names()},
+                        {'id': 'INTEGER', 'price': 'REAL', 'active': 'BOOLEAN', 'joined': 'DATE', 'note': 'TEXT'},
+                    )
+                    self.assertEqual(table_rows(csv_upload), [
+                        {'id': '1', 'price': '1.5', 'active': 'true', 'joined': '2024-01-02', 'note': 'a, "b"'},
+                        {'id': '2', 'price': None, 'active': 'false', 'joined': '2024-02-29', 'note': None},
+                        {'id': '3', 'price': '-2.25', 'active': None, 'joined': None, 'note': 'ünï'},
+                    ])
+
+    def test_parquet_export_round_trips(self):
+        import pyarrow.parquet as pq
+
+        for storage_engine in (CSVUpload.STORAGE_JSON, CSVUpload.STORAGE_TABLE):
+            with self.subTest(storage_engine=storage_engine):
+                csv_upload, _ = IngestPipeline(
+                    self.source('parquet'), f'items_{storage_engine}', storage_engine=storage_engine
+                ).run()
+                with override_settings(CSV_EXPORT_ROW_GROUP_SIZE=2):
+                    response = self.client.get(reverse('csv_upload:export_table', args=[csv_upload.pk, 'parquet']))
+                    exported = pq.ParquetFile(io.BytesIO(b''.join(response.streaming_content)))
+                self.assertEqual(exported.metadata.num_row_groups, 2)
+                self.assertEqual(exported.read().to_pylist(), self.table.to_pylist())
+
+
+class RowEncodingTests(TestCase):
+    """Key-less row arrays and compacting keyed rows into them"""
+
+    def setUp(self):
+        get_table_cache().clear()
+
+    def keyed_upload(self):
+        """A JSON table whose rows are still objects keyed by column name, as before row arrays"""
+        csv_upload = ingest(PEOPLE_CSV, storage_engine=CSVUpload.STORAGE_JSON)
+        rows = CSVData.objects.filter(csv_upload=csv_upload).order_by('row_number')
+        for row in rows:
+            row_dict = csv_upload.decode_row(row.row_data)
+            if row_dict['name'] == 'Cy':
+                # A key missing from the object becomes a null cell
+                del row_dict['age']
+            CSVData.objects.filter(id=row.id).update(row_data=row_dict)
+        CSVUpload.objects.filter(pk=csv_upload.pk).update(row_format=CSVUpload.ROW_FORMAT_OBJECT)
+        csv_upload.refresh_from_db()
+        return csv_upload
+
+    def test_new_tables_store_rows_as_arrays(self):
+        csv_upload = ingest(PEOPLE_CSV, storage_engine=CSVUpload.STORAGE_JSON)
+        self.assertTrue(csv_upload.uses_row_arrays())
+        row = CSVData.objects.filter(csv_upload=csv_upload).order_by('row_number').first()
+        self.assertEqual(row.row_data, ['Ann', '40'])
+        # Cells past the end of a short array read as null
+        self.assertEqual(csv_upload.decode_row(['Ann']), {'name': 'Ann', 'age': None})
+
+    def test_compact_row_data_rewrites_keyed_rows(self):
+        csv_upload = self.keyed_upload()
+        expected = table_rows(csv_upload)
+        self.assertNotIn('age', expected[2])
+        expected[2]['age'] = None
+        output = io.StringIO()
+        call_command('compact_row_data', csv_upload.pk, batch_size=2, stdout=output)
+        self.assertIn('5 rows', output.getvalue())
+        csv_upload.refresh_from_db()
+        self.assertTrue(csv_upload.uses_row_arrays())
+        rows = CSVData.objects.filter(csv_upload=csv_upload).order_by('row_number')
+        self.assertEqual([row.row_data for row in rows][:3], [['Ann', '40'], ['Bob', '31'], ['Cy', None]])
+        self.assertEqual(table_rows(csv_upload), expected)
+        # Sorting and filtering address the column by position now
+        ages = [row['data']['age'] for row in TableQuery(csv_upload, sort_by='age', page_size=100).page().table_data]
+        self.assertEqual(ages, ['19', '31', '40', '57', None])
+        self.assertEqual(rows.filter(FilterExpression('age >= 40').to_q(csv_upload)).count(), 2)
+
+    def test_compact_row_data_rejects_unknown_tables(self):
+        csv_upload = ingest(PEOPLE_CSV, storage_engine=CSVUpload.STORAGE_JSON)
+        with self.assertRaisesMessage(CommandError, f'No keyed JSON table with id {csv_upload.pk}'):
+            call_command('compact_row_data', csv_upload.pk, stdout=io.StringIO())
+
+
+class TableDeletionTests(TestCase):
+    """Deleting a table removes its rows and storage without the ORM cascade"""
+
+    def test_delete_view_removes_only_that_table(self):
+        tables = set(connection.introspection.table_names())
+        kept = ingest(PEOPLE_CSV, 'kept')
+        for storage_engine in (CSVUpload.STORAGE_JSON, CSVUpload.STORAGE_TABLE):
+            with self.subTest(storage_engine=storage_engine):
+                gone = ingest(PEOPLE_CSV, f'gone_{storage_engine}', storage_engine=storage_engine)
+                response = self.client.post(reverse('csv_upload:delete_table', args=[gone.pk]))
+                self.assertEqual(response.status_code, 302)
+                self.assertFalse(CSVUpload.objects.filter(pk=gone.pk).exists())
+                self.assertFalse(CSVData.objects.filter(csv_upload_id=gone.pk).exists())
+        self.assertEqual(len(table_rows(kept)), 5)
+        # No typed table is left behind (partitions are checked in PartitionTests)
+        self.assertEqual(set(connection.introspection.table_names()), tables)
+
+    @override_settings(CSV_DELETE_BATCH_SIZE=2)
+    def test_rows_are_deleted_in_raw_batches(self):
+        if connection.vendor == 'postgresql':
+            self.skipTest('PostgreSQL drops the partition instead')
+        csv_upload = ingest(PEOPLE_CSV)
+        with CaptureQueriesContext(connection) as queries:
+            delete_upload(csv_upload)
+        deletes = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('DELETE FROM "csv_upload_csvdata"') and 'LIMIT' in query['sql']
+        ]
+        # Five rows in batches of two; the last, short batch ends the loop
+        self.assertEqual(len(deletes), 3)
+        # No SELECT of the rows for the cascade collector
+        self.assertFalse(any(
+            query['sql'].startswith('SELECT') and 'FROM "csv_upload_csvdata"' in query['sql'] for query in queries
+        ))
+        self.assertFalse(CSVData.objects.exists())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'CSVData is partitioned on PostgreSQL only')
+class PartitionTests(TransactionTestCase):
+    """Every JSON upload's rows live in a CSVData partition of its own"""
+
+    def setUp(self):
+        self.addCleanup(delete_uploads)
+
+    def partition(self, csv_upload):
+        """(exists, attached) for an upload's partition"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT to_regclass(%s) IS NOT NULL, EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(%s))',
+                [partition_name(csv_upload)] * 2
+            )
+            return cursor.fetchone()
+
+    def test_deleting_a_table_detaches_its_partition_concurrently(self):
+        kept = ingest(PEOPLE_CSV, 'kept')
+        gone = ingest(PEOPLE_CSV, 'gone')
+        self.assertEqual(self.partition(gone), (True, True))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('csv_upload:delete_table', args=[gone.pk]))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(any('DETACH PARTITION' in query['sql'] and 'CONCURRENTLY' in query['sql'] for query in queries))
+        self.assertFalse(CSVUpload.objects.filter(pk=gone.pk).exists())
+        self.assertEqual(self.partition(gone), (False, False))
+        self.assertEqual(len(table_rows(kept)), 5)
+
+    def test_deleting_inside_a_transaction_drops_the_partition(self):
+        csv_upload = ingest(PEOPLE_CSV)
+        deleted = CSVUpload(pk=csv_upload.pk)
+        with transaction.atomic():
+            delete_upload(csv_upload)
+        self.assertFalse(CSVUpload.objects.exists())
+        self.assertEqual(self.partition(deleted), (False, False))
+
+    def test_migrations_move_existing_rows_into_partitions(self):
+        before_partitioning = [('csv_upload', '0010_csvupload_row_format')]
+        executor = MigrationExecutor(connection)
+        latest = executor.loader.graph.leaf_nodes('csv_upload')
+        # Migrated forward again even if the test fails
+        self.addCleanup(lambda: MigrationExecutor(connection).migrate(latest))
+        executor.migrate(before_partitioning)
+
+        apps = executor.loader.project_state(before_partitioning).apps
+        Upload = apps.get_model('csv_upload', 'CSVUpload')
+        Data = apps.get_model('csv_upload', 'CSVData')
+        uploads = [Upload.objects.create(filename=f'{name}.csv', table_name=name, columns='{}') for name in ('a', 'b')]
+        empty = Upload.objects.create(filename='empty.csv', table_name='empty', columns='{}')
+        for number, csv_upload in enumerate(uploads, start=1):
+            Data.objects.bulk_create(
+                Data(csv_upload=csv_upload, row_number=row, row_data={'n': str(row)}, search_text=str(row))
+                for row in range(1, number * 3 + 1)
+            )
+
+        MigrationExecutor(connection).migrate(latest)
+
+        with connection.cursor() as cursor:
+            for csv_upload, rows in ((uploads[0], 3), (uploads[1], 6), (empty, 0)):
+                self.assertEqual(self.partition(csv_upload), (True, True))
+                cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(partition_name(csv_upload))}')
+                self.assertEqual(cursor.fetchone()[0], rows)
+            cursor.execute("SELECT to_regclass('csv_upload_csvdata_default')")
+            self.assertIsNone(cursor.fetchone()[0])
+        self.assertEqual(CSVData.objects.filter(csv_upload_id=uploads[1].pk).count(), 6)
+
+
+@override_settings(CSV_INGEST_BACKGROUND=False, CSV_UPLOAD_PREVIEW_ROWS=3, CSV_INGEST_MEMORY_BUDGET=1)
+class UploadPreviewTests(TestCase):
+    """The preview after a synchronous upload comes from the parsed chunks"""
+
+    def test_preview_is_not_read_back_from_the_table(self):
+        for storage_engine in (CSVUpload.STORAGE_JSON, CSVUpload.STORAGE_TABLE):
+            with self.subTest(storage_engine=storage_engine):
+                table_name = f'people_{storage_engine}'
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.post(reverse('csv_upload:upload'), {
+                        'csv_file': csv_file(PEOPLE_CSV), 'table_name': table_name,
+                        'storage_engine': storage_engine,
+                    })
+                csv_upload = CSVUpload.objects.get(table_name=table_name)
+                self.assertEqual(response.context['table_data'], table_rows(csv_upload)[:3])
+                self.assertEqual(response.context['columns'], [('name', 'TEXT'), ('age', 'INTEGER')])
+                tables = (CSVData._meta.db_table, physical_table_name(csv_upload))
+                reads = [
+                    query['sql'] for query in queries.captured_queries
+                    if query['sql'].startswith('SELECT') and any(f'"{table}"' in query['sql'] for table in tables)
+                ]
+                self.assertEqual(reads, [])
+
+
+class TableSummaryTests(TestCase):
+    """Stored row, byte and column counters for the upload page"""
+
+    def setUp(self):
+        get_table_cache().clear()
+
+    def counters(self, csv_upload):
+        csv_upload.refresh_from_db()
+        return csv_upload.row_count, csv_upload.byte_size, csv_upload.column_count
+
+    def test_counters_follow_loads_edits_and_appends(self):
+        text = 'name,age\nÅsa,40\nBob,\nCy,22\n'
+        for storage_engine in (CSVUpload.STORAGE_JSON, CSVUpload.STORAGE_TABLE):
+            with self.subTest(storage_engine=storage_engine):
+                csv_upload = ingest(text, f'people_{storage_engine}', storage_engine=storage_engine, memory_budget=1)
+                # 'Åsa' is four bytes
+                self.assertEqual(self.counters(csv_upload), (3, 13, 2))
+                self.assertEqual(measure_table(csv_upload), (3, 13, 2))
+
+                row_id = TableQuery(csv_upload).page().table_data[1]['id']
+                self.client.post(
+                    reverse('csv_upload:patch_table', args=[csv_upload.pk]),
+                    json.dumps([{'row_id': row_id, 'column': 'age', 'value': '100'}]), content_type='application/json',
+                )
+                self.assertEqual(self.counters(csv_upload), (3, 16, 2))
+                MergePipeline(csv_file('name,age\nDee,57\n'), csv_upload, IngestJob.MODE_APPEND).run()
+                self.assertEqual(self.counters(csv_upload), (4, 21, 2))
+                self.assertEqual(measure_table(csv_upload), self.counters(csv_upload))
+
+    def test_upload_page_counts_nothing(self):
+        for table_name in ('first', 'second'):
+            ingest(PEOPLE_CSV, table_name)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('csv_upload:upload'))
+        self.assertFalse(any('COUNT(' in query['sql'].upper() for query in queries.captured_queries))
+        self.assertEqual([table.row_count for table in response.context['existing_tables']], [5, 5])
+
+    def test_reconcile_table_stats_corrects_drift(self):
+        csv_upload = ingest(PEOPLE_CSV)
+        CSVUpload.objects.filter(pk=csv_upload.pk).update(row_count=1, byte_size=0)
+        output = io.StringIO()
+        call_command('reconcile_table_stats', stdout=output)
+        self.assertIn('row_count 1 -> 5', output.getvalue())
+        self.assertEqual(self.counters(csv_upload), measure_table(csv_upload))
+        output = io.StringIO()
+        call_command('reconcile_table_stats', csv_upload.pk, stdout=output)
+        self.assertIn('0 table(s) corrected', output.getvalue())
+
+
+class ChunkedUploadTests(TestCase):
+    """The resumable upload API, as a script without a browser session drives it"""
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir, ignore_errors=True)
+        spool_settings = override_settings(CSV_INGEST_SPOOL_DIR=self.spool_dir, CSV_INGEST_BACKGROUND=True)
+        spool_settings.enable()
+        self.addCleanup(spool_settings.disable)
+        self.client = Client(enforce_csrf_checks=True)
+        self.data = PEOPLE_CSV.encode()
+
+    def start(self, csrf=True):
+        headers = {}
+        if csrf:
+            # Any page sets the CSRF cookie
+            self.client.get(reverse('csv_upload:upload'))
+            headers['X-CSRFToken'] = self.client.cookies['csrftoken'].value
+        return self.client.post(
+            reverse('csv_upload:start_chunked_upload'),
+            {'filename': 'people.csv', 'table_name': 'people', 'total_bytes': len(self.data)},
+            content_type='application/json', headers=headers,
+        )
+
+    def open_upload(self):
+        response = self.start()
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def put(self, upload, start, end, token=None):
+        chunk = self.data[start:end]
+        return self.client.generic(
+            'PUT', f"{upload['chunk_url']}?offset={start}", chunk, content_type='application/octet-stream',
+            headers={
+                'X-Chunk-SHA256': hashlib.sha256(chunk).hexdigest(),
+                'X-Upload-Token': upload['upload_token'] if token is None else token,
+            },
+        )
+
+    def finalize(self, upload, **data):
+        return self.client.post(
+            upload['finalize_url'], data, content_type='application/json',
+            headers={'X-Upload-Token': upload['upload_token']},
+        )
+
+    def test_opening_needs_the_csrf_token(self):
+        self.assertEqual(self.start(csrf=False).status_code, 403)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_uploads_chunks_with_the_upload_token(self):
+        upload = self.open_upload()
+        for start in range(0, len(self.data), 10):
+            response = self.put(upload, start, start + 10)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['received_bytes'], len(self.data))
+
+        response = self.finalize(upload, sha256=hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(response.status_code, 202)
+        session = UploadSession.objects.get()
+        self.assertEqual(session.status, UploadSession.STATUS_FINALIZED)
+        self.assertEqual(session.content_hash, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(session.ingest_job.source_path, session.spool_path)
+
+    def test_requests_without_the_upload_token_are_refused(self):
+        upload = self.open_upload()
+        self.assertEqual(self.put(upload, 0, 10, token='').status_code, 403)
+        self.assertEqual(self.put(upload, 0, 10, token='0' * 64).status_code, 403)
+        for method in ('get', 'delete'):
+            with self.subTest(method=method):
+                self.assertEqual(getattr(self.client, method)(upload['upload_url']).status_code, 403)
+        self.assertEqual(UploadSession.objects.get().received_bytes, 0)
+
+    def test_out_of_order_chunk_is_refused_with_the_resume_offset(self):
+        upload = self.open_upload()
+        self.put(upload, 0, 10)
+        response = self.put(upload, 20, 30)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['received_bytes'], 10)
+
+    def test_duplicate_chunk_is_accepted_once(self):
+        upload = self.open_upload()
+        self.put(upload, 0, 10)
+        response = self.put(upload, 0, 10)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['received_bytes'], 10)
+        with open(UploadSession.objects.get().spool_path, 'rb') as spool:
+            self.assertEqual(spool.read(), self.data[:10])
+
+    def test_finalize_with_a_missing_chunk_is_refused(self):
+        upload = self.open_upload()
+        self.put(upload, 0, 10)
+        response = self.finalize(upload)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(UploadSession.objects.get().status, UploadSession.STATUS_OPEN)
+        self.assertFalse(IngestJob.objects.exists())
+
+    def test_file_checksum_mismatch_leaves_the_upload_open(self):
+        upload = self.open_upload()
+        self.put(upload, 0, len(self.data))
+        response = self.finalize(upload, sha256='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(UploadSession.objects.get().status, UploadSession.STATUS_OPEN)
+
+    def test_expired_upload_is_purged(self):
+        upload = self.open_upload()
+        self.put(upload, 0, 10)
+        spool_path = UploadSession.objects.get().spool_path
+        UploadSession.objects.update(updated_at=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(purge_expired_uploads(expire_after=60), 1)
+        self.assertFalse(os.path.exists(spool_path))
+        self.assertEqual(self.put(upload, 10, 20).status_code, 404)
+
+
+class DeduplicationTests(TestCase):
+    """Repeated uploads of an identical file copied inside the database"""
+
+    def setUp(self):
+        get_table_cache().clear()
+
+    def load(self, table_name, storage_engine, content_hash='same-file', text=PEOPLE_CSV):
+        pipeline = IngestPipeline(
+            csv_file(text), table_name, storage_engine=storage_engine, content_hash=content_hash
+        )
+        csv_upload, _ = pipeline.run()
+        return pipeline, csv_upload
+
+    def test_identical_file_is_copied(self):
+        for storage_engine in (CSVUpload.STORAGE_JSON, CSVUpload.STORAGE_TABLE):
+            with self.subTest(storage_engine=storage_engine):
+                _, source = self.load(f'first_{storage_engine}', storage_engine)
+                pipeline, copy = self.load(f'second_{storage_engine}', storage_engine)
+                self.assertEqual(pipeline.copied_from, source)
+                self.assertEqual(table_rows(copy), table_rows(source))
+                self.assertEqual(
+                    (copy.row_count, copy.byte_size, copy.get_column_stats(), copy.columns),
+                    (source.row_count, source.byte_size, source.get_column_stats(), source.columns),
+                )
+                # The copy is a table of its own, and new rows get fresh ids
+                row_id = TableQuery(copy).page().table_data[0]['id']
+                self.client.post(
+                    reverse('csv_upload:patch_table', args=[copy.pk]),
+                    json.dumps([{'row_id': row_id, 'column': 'name', 'value': 'Anna'}]),
+                    content_type='application/json',
+                )
+                MergePipeline(csv_file('name,age\nFlo,33\n'), copy, IngestJob.MODE_APPEND).run()
+                self.assertEqual(table_rows(source)[0]['name'], 'Ann')
+                self.assertEqual([row['name'] for row in table_rows(copy)], ['Anna', 'Bob', 'Cy', 'Dee', 'Ed', 'Flo'])
+
+    def test_changed_tables_and_other_engines_are_not_copied(self):
+        _, source = self.load('first', CSVUpload.STORAGE_JSON)
+        pipeline, _ = self.load('other_engine', CSVUpload.STORAGE_TABLE)
+        self.assertIsNone(pipeline.copied_from)
+        # An edit means the table no longer matches its file
+        source.bump_data_version()
+        pipeline, _ = self.load('after_edit', CSVUpload.STORAGE_JSON)
+        self.assertIsNone(pipeline.copied_from)
+        pipeline, _ = self.load('no_hash', CSVUpload.STORAGE_JSON, content_hash='')
+        self.assertIsNone(pipeline.copied_from)
+
+    def test_table_still_loading_is_not_copied(self):
+        _, source = self.load('first', CSVUpload.STORAGE_JSON)
+        CSVUpload.objects.filter(pk=source.pk).update(is_ready=False)
+        pipeline, copy = self.load('second', CSVUpload.STORAGE_JSON)
+        self.assertIsNone(pipeline.copied_from)
+        self.assertEqual(copy.content_hash, 'same-file')
+
+    @override_settings(CSV_INGEST_BACKGROUND=False)
+    def test_form_uploads_are_hashed_as_they_arrive(self):
+        for table_name in ('first', 'second'):
+            self.client.post(reverse('csv_upload:upload'), {'csv_file': csv_file(PEOPLE_CSV), 'table_name': table_name})
+        first, second = CSVUpload.objects.order_by('id')
+        self.assertEqual(first.content_hash, hashlib.sha256(PEOPLE_CSV.encode()).hexdigest())
+        self.assertEqual(second.content_hash, first.content_hash)
+        self.assertEqual(table_rows(second), table_rows(first))
+
+
+class MergePipelineTests(TestCase):
+    """Appending and upserting deltas into existing tables, on both storage engines"""
+
+    def create(self, text, storage_engine, key='id'):
+        csv_upload = ingest(text, f'people_{storage_engine}', storage_engine=storage_engine)
+        if key:
+            data_type = csv_upload.get_column_properties(key)['data_type']
+            response = self.client.post(
+                reverse('csv_upload:configure_column', args=[csv_upload.pk, key]),
+                {'data_type': data_type, 'primary_key': 'on', 'on_delete': 'CASCADE'},
+            )
+            self.assertEqual(response.status_code, 302)
+            csv_upload.refresh_from_db()
+        return csv_upload
+
+    def merge(self, csv_upload, text, mode=IngestJob.MODE_UPSERT):
+        pipeline = MergePipeline(csv_file(text), csv_upload, mode)
+        csv_upload, _ = pipeline.run()
+        return pipeline, csv_upload
+
+    def for_each_engine(self):
+        for storage_engine in (CSVUpload.STORAGE_JSON, CSVUpload.STORAGE_TABLE):
+            with self.subTest(storage_engine=storage_engine):
+                yield storage_engine
+
+    def test_append_adds_rows_after_the_last(self):
+        for storage_engine in self.for_each_engine():
+            target = self.create(PEOPLE_CSV, storage_engine, key=None)
+            pipeline, csv_upload = self.merge(target, 'name,age\nFlo,33\n', IngestJob.MODE_APPEND)
+            self.assertEqual((pipeline.rows_inserted, pipeline.rows_updated), (1, 0))
+            self.assertEqual(csv_upload.row_count, 6)
+            self.assertEqual(table_rows(csv_upload)[-1], {'name': 'Flo', 'age': '33'})
+
+    def test_upsert_updates_matched_keys_and_inserts_the_rest(self):
+        for storage_engine in self.for_each_engine():
+            target = self.create('id,name\n1,Ann\n2,Bob\n', storage_engine)
+            # Within the file the last row of a key wins
+            pipeline, csv_upload = self.merge(target, 'id,name\n2,Bobby\n3,Cy\n3,Cyd\n')
+            self.assertEqual((pipeline.rows_inserted, pipeline.rows_updated), (1, 1))
+            self.assertEqual(csv_upload.row_count, 3)
+            self.assertEqual(
+                [(row['id'], row['name']) for row in table_rows(csv_upload)], [('1', 'Ann'), ('2', 'Bobby'), ('3', 'Cyd')]
+            )
+            # Merged rows carry their search text
+            search = TableQuery(csv_upload, filter_text='bob').page().table_data
+            self.assertEqual([row['data']['name'] for row in search], ['Bobby'])
+
+    def test_upsert_of_key_columns_only_updates_nothing(self):
+        for storage_engine in self.for_each_engine():
+            target = self.create('id\n1\n2\n', storage_engine)
+            pipeline, csv_upload = self.merge(target, 'id\n2\n3\n')
+            self.assertEqual(pipeline.rows_inserted, 1)
+            if storage_engine == CSVUpload.STORAGE_TABLE:
+                # ON CONFLICT DO NOTHING skips the matched row
+                self.assertEqual(pipeline.rows_updated, 0)
+            self.assertEqual([row['id'] for row in table_rows(csv_upload)], ['1', '2', '3'])
+
+    def test_rejects_a_file_with_other_columns(self):
+        for storage_engine in self.for_each_engine():
+            target = self.create('id,name\n1,Ann\n', storage_engine)
+            with self.assertRaisesMessage(ValueError, 'missing name; unknown city'):
+                self.merge(target, 'id,city\n2,Oslo\n')
+            self.assertEqual(table_rows(target), [{'id': '1', 'name': 'Ann'}])
+
+    def test_rejects_key_conflicts(self):
+        for storage_engine in self.for_each_engine():
+            target = self.create('id,name\n1,Ann\n', storage_engine)
+            for delta, message in (
+                ('id,name\nx1,Zed\n', 'Key column "id" would change type'),
+                ('id,name\n,Zed\n', 'Every row needs a value in the key column(s) id'),
+            ):
+                with self.assertRaisesMessage(ValueError, message):
+                    self.merge(target, delta)
+            target.refresh_from_db()
+            self.assertEqual(target.row_count, 1)
+            self.assertEqual(table_rows(target), [{'id': '1', 'name': 'Ann'}])
+
+    def test_upsert_needs_a_key(self):
+        target = self.create('id,name\n1,Ann\n', CSVUpload.STORAGE_JSON, key=None)
+        with self.assertRaisesMessage(ValueError, 'has no primary key column'):
+            self.merge(target, 'id,name\n1,Ann\n')
+
+    def test_widening_a_delta_keeps_its_original_text(self):
+        for storage_engine in (CSVUpload.STORAGE_JSON, CSVUpload.STORAGE_TABLE):
+            with self.subTest(storage_engine=storage_engine):
+                target = ingest('name,active\nAnn,yes\n', f'people_{storage_engine}', storage_engine=storage_engine)
+                pipeline = MergePipeline(
+                    csv_file('name,active\nBob,no\nCy,yes\nDee,maybe\n'), target, IngestJob.MODE_APPEND,
+                    memory_budget=1
+                )
+                csv_upload, stats = pipeline.run()
+                self.assertEqual(stats.rows, 3)
+                self.assertEqual(csv_upload.get_column_properties('active')['data_type'], 'TEXT')
+                # The row loaded before the change keeps its canonical form
+                self.assertEqual([row['active'] for row in table_rows(csv_upload)], ['true', 'no', 'yes', 'maybe'])
+
+
+class ByteRangeSplitTests(TestCase):
+    """Splitting a CSV file into byte ranges of whole records for parallel ingest"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.csv')
+        self.addCleanup(os.remove, self.path)
+        with os.fdopen(handle, 'w', newline='') as target:
+            writer = csv.writer(target, lineterminator='\n')
+            writer.writerow(['id', 'note', 'score'])
+            for number in range(60):
+                # Every third note holds newlines, commas and doubled quotes inside its quoted field
+                note = f'line {number}\n"quoted" {number},\nend' if number % 3 == 0 else f'plain {number}'
+                writer.writerow([number, note, number % 7])
+        with open(self.path, 'rb') as source:
+            self.data_start = next_record_start(source, 0)
+
+    def records(self, start, end):
+        with open(self.path, 'rb') as source:
+            source.seek(start)
+            text = source.read(end - start).decode()
+        return list(csv.reader(io.StringIO(text, newline='')))
+
+    def test_next_record_start_skips_newlines_in_quotes(self):
+        source = io.BytesIO(b'a,"x\ny"\nb,"""\n"""\nc\n')
+        self.assertEqual(next_record_start(source, 0), 8)
+        # From inside the quoted field, its newline is not a record end
+        self.assertEqual(next_record_start(source, 3, in_quotes=True), 8)
+        self.assertEqual(next_record_start(source, 3), 5)
+        # A doubled quote inside a quoted field leaves it open
+        self.assertEqual(next_record_start(source, 8), 18)
+        self.assertEqual(next_record_start(source, 18), 20)
+        self.assertIsNone(next_record_start(source, 20))
+
+    def test_ranges_hold_whole_records(self):
+        serial = self.records(self.data_start, os.path.getsize(self.path))
+        split_inside_quotes = False
+        for parts in range(1, 41):
+            with self.subTest(parts=parts):
+                ranges = split_ranges(self.path, self.data_start, parts)
+                self.assertEqual(ranges[0][0], self.data_start)
+                self.assertEqual(ranges[-1][1], os.path.getsize(self.path))
+                self.assertEqual([record for start, end in ranges for record in self.records(start, end)], serial)
+            end = os.path.getsize(self.path)
+            with open(self.path, 'rb') as source:
+                for part in range(1, parts):
+                    target = self.data_start + (end - self.data_start) * part // parts
+                    split_inside_quotes |= count_quotes(source, self.data_start, target) % 2 == 1
+        # Some split points fell inside a quoted field, so the test covered that case
+        self.assertTrue(split_inside_quotes)
+
+    def test_merged_range_profiles_match_a_serial_profile(self):
+        serial = IngestPipeline(open(self.path, 'rb'), 'notes', memory_budget=1)
+        self.addCleanup(serial.source.close)
+        serial_rows = []
+        for chunk in serial.iter_chunks():
+            serial.update_schema(chunk)
+            serial.profiler.update(chunk)
+            serial_rows.extend(row for _, row in dataframe_rows(chunk))
+
+        for parts in (2, 5, 13):
+            with self.subTest(parts=parts):
+                merged_rows = []
+                merged = None
+                for index, (start, end) in enumerate(split_ranges(self.path, self.data_start, parts)):
+                    pipeline = RangePipeline({
+                        'index': index, 'path': self.path, 'start': start, 'end': end, 'table_name': 'notes',
+                        'column_names': serial.column_names, 'columns_info': serial.columns_info, 'memory_budget': 1,
+                    })
+                    for chunk in pipeline.iter_chunks():
+                        pipeline.profiler.update(chunk)
+                        merged_rows.extend(row for _, row in dataframe_rows(chunk))
+                    if merged is None:
+                        merged = pipeline.profiler
+                    else:
+                        merged.merge(pipeline.profiler)
+                self.assertEqual(merged_rows, serial_rows)
+                self.assertEqual(merged.finish(), serial.profiler.finish())
+
+
+class ImportCommandTests(TestCase):
+    """Loading files with the import_csv management command"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, text, name='people.csv'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as target:
+            target.write(text)
+        return path
+
+    def run_command(self, *args, **options):
+        output = io.StringIO()
+        call_command('import_csv', *args, workers=1, stdout=output, **options)
+        return output.getvalue()
+
+    def options(self, on_exists):
+        return {
+            'on_exists': on_exists, 'batch_size': None, 'file_workers': 1,
+            'storage_engine': CSVUpload.STORAGE_JSON,
+        }
+
+    def test_creates_a_table_per_file(self):
+        self.write(PEOPLE_CSV)
+        self.write('city\nOslo\n', name='cities.csv')
+        output = self.run_command(self.directory)
+        self.assertIn('2 created', output)
+        self.assertEqual(len(table_rows(CSVUpload.objects.get(table_name='people'))), 5)
+        self.assertEqual(table_rows(CSVUpload.objects.get(table_name='cities')), [{'city': 'Oslo'}])
+
+    def test_skips_an_existing_table_by_default(self):
+        ingest('name,age\nZed,70\n')
+        output = self.run_command(self.write(PEOPLE_CSV))
+        self.assertIn('skipped', output)
+        self.assertEqual(table_rows(CSVUpload.objects.get(table_name='people')), [{'name': 'Zed', 'age': '70'}])
+
+    def test_appends_to_an_existing_table(self):
+        ingest('name,age\nZed,70\n')
+        self.run_command(self.write(PEOPLE_CSV), on_exists='append')
+        rows = table_rows(CSVUpload.objects.get(table_name='people'))
+        self.assertEqual([row['name'] for row in rows], ['Zed', 'Ann', 'Bob', 'Cy', 'Dee', 'Ed'])
+
+    def test_replaces_an_existing_table(self):
+        old = ingest('name,age\nZed,70\n')
+        self.run_command(self.write(PEOPLE_CSV), on_exists='replace')
+        self.assertFalse(CSVUpload.objects.filter(pk=old.pk).exists())
+        self.assertEqual(CSVUpload.objects.count(), 1)
+        self.assertEqual(len(table_rows(CSVUpload.objects.get(table_name='people'))), 5)
+
+    def test_failed_replace_keeps_the_old_table_and_drops_the_new_one(self):
+        old = ingest('name,age\nZed,70\n')
+        path = self.write(PEOPLE_CSV)
+        with mock.patch.object(CSVUpload.objects, 'select_for_update', side_effect=DatabaseError('lock timeout')):
+            report = import_file(path, 'people', self.options('replace'))
+        self.assertEqual((report['status'], report['error']), ('failed', 'lock timeout'))
+        # Only the old table is left; the temporary upload was deleted
+        self.assertEqual(list(CSVUpload.objects.values_list('pk', flat=True)), [old.pk])
+        self.assertEqual(table_rows(CSVUpload.objects.get(pk=old.pk)), [{'name': 'Zed', 'age': '70'}])
+
+    def test_reports_failed_files(self):
+        self.write('', name='empty.csv')
+        with self.assertRaisesMessage(CommandError, '1 file(s) failed to import'):
+            self.run_command(self.directory)
+        self.assertFalse(CSVUpload.objects.exists())
+
+    def test_reads_stdin_with_the_table_name_template(self):
+        self.write('city\nOslo\n', name='cities.csv')
+        stdin = io.TextIOWrapper(io.BytesIO(b'name,active\nAnn,yes\nBob,no\nCy,maybe\n'))
+        with mock.patch('sys.stdin', stdin):
+            output = self.run_command(
+                '-', os.path.join(self.directory, '*.csv'), table_name_template='{parent}_{name}', batch_size=1
+            )
+        self.assertIn('2 created', output)
+        parent = os.path.basename(self.directory)
+        # stdin has no directory, and a name gets a letter in front
+        self.assertEqual(set(CSVUpload.objects.values_list('table_name', flat=True)), {f'{parent}_cities', 'table__stdin'})
+        # stdin cannot seek, so widening the column reloads it from a spooled copy
+        rows = table_rows(CSVUpload.objects.get(table_name='table__stdin'))
+        self.assertEqual([row['active'] for row in rows], ['yes', 'no', 'maybe'])
+        self.assertEqual(table_rows(CSVUpload.objects.get(table_name=f'{parent}_cities')), [{'city': 'Oslo'}])
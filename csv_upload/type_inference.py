@@ -0,0 +1,204 @@
+"""
+Vectorized column type inference for CSV ingest.
+
+CSV chunks are read as text and every column is scored against the
+candidate types INTEGER, REAL, BOOLEAN, DATE and DATETIME with pandas
+string and datetime operations (no per-cell Python). A column gets the
+narrowest type whose score - the fraction of non-null values that parse as
+that type - reaches ``CSV_INFERENCE_MIN_CONFIDENCE``, otherwise TEXT.
+
+Values are then rewritten in one canonical text form per type (``42``,
+``2.5``, ``true``, ``2024-03-01``, ``2024-03-01 12:30:00``), so ISO dates
+sort as text, numbers cast cleanly and integers never pick up a ``.0``.
+Values that do not parse (only possible below a confidence of 1.0) are kept
+as they were.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from csv_upload.typed_tables import FALSE_VALUES, TRUE_VALUES
+
+DEFAULT_MIN_CONFIDENCE = 1.0
+
+# Narrowest first; a column gets the first type that reaches the confidence threshold
+CANDIDATE_TYPES = ['INTEGER', 'REAL', 'BOOLEAN', 'DATE', 'DATETIME']
+
+# Each type widens along its chain; types on different chains widen to TEXT
+TYPE_WIDENING_CHAINS = [
+    ['INTEGER', 'REAL', 'TEXT'],
+    ['BOOLEAN', 'TEXT'],
+    ['DATE', 'DATETIME', 'TEXT'],
+]
+
+# No leading zeros, so zip codes and ids like 007 stay TEXT; integers stay int64-safe
+INTEGER_PATTERN = r'[+-]?(?:0|[1-9]\d{0,17})'
+REAL_PATTERN = r'[+-]?(?:(?:0|[1-9]\d*)(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?'
+TIME_PATTERN = re.compile(r'\d{1,2}:\d{2}')
+# Cheap pre-check before trying any date format
+DATE_SHAPE_PATTERN = re.compile(r'\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}')
+
+# Tried in order after ISO 8601; month-first wins ties, as in pandas
+DATE_FORMATS = ['%m/%d/%Y', '%d/%m/%Y', '%d.%m.%Y', '%Y/%m/%d', '%d-%m-%Y']
+DATETIME_FORMATS = [
+    f'{date_format} {time_format}'
+    for date_format in DATE_FORMATS
+    for time_format in ('%H:%M:%S', '%H:%M')
+]
+
+
+def min_confidence():
+    return getattr(settings, 'CSV_INFERENCE_MIN_CONFIDENCE', DEFAULT_MIN_CONFIDENCE)
+
+
+def widen_data_type(current, other):
+    """Return the narrowest type that holds values of both types"""
+    if current == other:
+        return current
+    for chain in TYPE_WIDENING_CHAINS:
+        if current in chain and other in chain:
+            return max(current, other, key=chain.index)
+    return 'TEXT'
+
+
+def _to_datetimes(values, date_format):
+    """Parse values with one format; unparseable values become NaT"""
+    parsed = pd.to_datetime(values, format=date_format, errors='coerce')
+    if getattr(parsed.dt, 'tz', None) is not None:
+        parsed = parsed.dt.tz_convert('UTC').dt.tz_localize(None)
+    return parsed
+
+
+def detect_date_format(values, data_type):
+    """Format that parses the most values (ISO 8601 first), or None"""
+    if not values.str.match(DATE_SHAPE_PATTERN).any():
+        return None
+    # DATETIME columns accept plain dates too
+    formats = DATETIME_FORMATS + DATE_FORMATS if data_type == 'DATETIME' else DATE_FORMATS
+    best_format, best_count = None, 0
+    for date_format in ['ISO8601', *formats]:
+        try:
+            count = int(_to_datetimes(values, date_format).notna().sum())
+        except (TypeError, ValueError, OverflowError):
+            continue
+        if count > best_count:
+            best_format, best_count = date_format, count
+        if count == len(values):
+            break
+    return best_format
+
+
+def type_matches(values, data_type, date_format=None):
+    """Boolean mask of the (stripped, non-null) values that parse as data_type"""
+    if data_type == 'INTEGER':
+        return values.str.fullmatch(INTEGER_PATTERN)
+    if data_type == 'REAL':
+        return values.str.fullmatch(REAL_PATTERN)
+    if data_type == 'BOOLEAN':
+        return values.str.lower().isin(TRUE_VALUES | FALSE_VALUES)
+    if data_type in ('DATE', 'DATETIME'):
+        date_format = date_format or detect_date_format(values, data_type)
+        if date_format is None:
+            return pd.Series(False, index=values.index)
+        matched = _to_datetimes(values, date_format).notna()
+        # DATE values carry no time of day; DATETIME accepts dates too
+        return matched & ~values.str.contains(TIME_PATTERN) if data_type == 'DATE' else matched
+    return pd.Series(True, index=values.index)
+
+
+def _non_empty(series):
+    """Non-null, non-blank values as stripped strings"""
+    values = series.dropna().astype(str).str.strip()
+    return values[values != '']
+
+
+def infer_column_type(series):
+    """Infer a column type from a sample; returns (data_type, inference)
+
+    ``inference`` records the confidence of the chosen type, the number of
+    non-null values it was based on, each candidate's score and, for dates,
+    the detected format.
+    """
+    values = _non_empty(series)
+    inference = {'confidence': 1.0, 'sample_size': int(len(values)), 'scores': {}, 'date_format': None}
+    if values.empty:
+        # All-null sample: nothing to go on, keep the column as text
+        return 'TEXT', inference
+
+    threshold = min_confidence()
+    chosen = 'TEXT'
+    for data_type in CANDIDATE_TYPES:
+        date_format = None
+        if data_type in ('DATE', 'DATETIME'):
+            date_format = detect_date_format(values, data_type)
+            if date_format is None:
+                inference['scores'][data_type] = 0.0
+                continue
+        score = float(type_matches(values, data_type, date_format).mean())
+        inference['scores'][data_type] = round(score, 4)
+        if chosen == 'TEXT' and score >= threshold:
+            chosen = data_type
+            inference['confidence'] = round(score, 4)
+            inference['date_format'] = date_format
+    return chosen, inference
+
+
+def column_fits(series, data_type, date_format=None):
+    """True if every non-null value of series parses as data_type"""
+    if data_type == 'TEXT':
+        return True
+    values = _non_empty(series)
+    if values.empty:
+        return True
+    if bool(type_matches(values, data_type, date_format).all()):
+        return True
+    # A later chunk may write its dates in another format than the sample did
+    return data_type in ('DATE', 'DATETIME') and bool(type_matches(values, data_type).all())
+
+
+def canonicalize_column(series, data_type, date_format=None):
+    """Rewrite a column's values in the canonical text form of data_type
+
+    Nulls stay null and values that do not parse are returned unchanged.
+    """
+    if data_type == 'TEXT':
+        return series
+    result = series.astype(object)
+    present = series.notna()
+    if not present.any():
+        return result
+    values = series[present].astype(str).str.strip()
+
+    if data_type == 'INTEGER':
+        mask = values.str.fullmatch(INTEGER_PATTERN)
+        canonical = values[mask].astype(np.int64).astype(str)
+    elif data_type == 'REAL':
+        mask = values.str.fullmatch(REAL_PATTERN)
+        canonical = values[mask].astype(np.float64).astype(str)
+    elif data_type == 'BOOLEAN':
+        lowered = values.str.lower()
+        mask = lowered.isin(TRUE_VALUES | FALSE_VALUES)
+        canonical = lowered[mask].isin(TRUE_VALUES).map({True: 'true', False: 'false'})
+    else:
+        parsed = _to_datetimes(values, date_format or 'ISO8601')
+        if date_format is not None and parsed.isna().any():
+            # A later chunk may use another format than the sample did
+            unparsed = values[parsed.isna()]
+            other_format = detect_date_format(unparsed, data_type)
+            if other_format is not None:
+                parsed = parsed.fillna(_to_datetimes(unparsed, other_format))
+        mask = parsed.notna()
+        parsed = parsed[mask]
+        if data_type == 'DATE':
+            canonical = parsed.dt.strftime('%Y-%m-%d')
+        else:
+            # Same text as datetime.isoformat(sep=' '), which display_value() uses
+            canonical = parsed.dt.strftime('%Y-%m-%d %H:%M:%S')
+            micro = parsed.dt.microsecond
+            canonical = canonical.where(micro == 0, canonical + '.' + micro.astype(str).str.zfill(6))
+
+    result.loc[canonical.index] = canonical.astype(object)
+    return result
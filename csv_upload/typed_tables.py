@@ -0,0 +1,623 @@
+"""
+Typed table storage engine.
+
+Uploads with ``storage_engine='table'`` are materialized as one real table
+per upload. Its DDL is generated from the column properties stored in
+CSVUpload.columns (data type, NOT NULL, primary key, unique, default,
+max length, foreign keys), so sorting, filtering and type checks run as
+native SQL. Rows are addressed by the internal ``_row_id`` column and keep
+their file order in ``_row_number``.
+
+The table filter box searches ``_search_text``, the row's displayed cell
+values joined by newlines, instead of casting and matching every column.
+It is written with the row by the loader and rewritten for edited rows and
+for rows whose displayed values change with a column type. On PostgreSQL
+it gets a pg_trgm GIN index (the extension comes with migration 0007),
+which serves ``ILIKE '%text%'``.
+"""
+
+import datetime
+import uuid
+
+import pandas as pd
+from django.db import connection, transaction
+
+from csv_upload.bulk_load import BulkLoader
+from csv_upload.expressions import escape_like
+from csv_upload.search import SEARCH_SEPARATOR
+
+ROW_ID = '_row_id'
+ROW_NUMBER = '_row_number'
+SEARCH_TEXT = '_search_text'
+
+SQL_TYPES = {
+    'postgresql': {
+        'TEXT': 'TEXT',
+        'INTEGER': 'BIGINT',
+        'REAL': 'DOUBLE PRECISION',
+        'BOOLEAN': 'BOOLEAN',
+        'DATE': 'DATE',
+        'DATETIME': 'TIMESTAMP',
+        'BLOB': 'BYTEA',
+    },
+    'sqlite': {
+        'TEXT': 'TEXT',
+        'INTEGER': 'INTEGER',
+        'REAL': 'REAL',
+        'BOOLEAN': 'BOOLEAN',
+        'DATE': 'DATE',
+        'DATETIME': 'DATETIME',
+        'BLOB': 'BLOB',
+    },
+}
+
+ON_DELETE_ACTIONS = ['CASCADE', 'SET NULL', 'RESTRICT', 'SET DEFAULT', 'NO ACTION']
+
+TRUE_VALUES = {'true', 't', 'yes', 'y', '1'}
+FALSE_VALUES = {'false', 'f', 'no', 'n', '0'}
+
+
+def physical_table_name(csv_upload):
+    """Database table holding the rows of a typed upload"""
+    return f"csv_table_{csv_upload.pk}"
+
+
+def sql_type(properties, vendor):
+    """SQL column type for a column's properties"""
+    types = SQL_TYPES.get(vendor, SQL_TYPES['sqlite'])
+    data_type = properties.get('data_type', 'TEXT')
+    if data_type == 'TEXT' and properties.get('max_length'):
+        return f"VARCHAR({int(properties['max_length'])})"
+    return types.get(data_type, 'TEXT')
+
+
+def quote_literal(value):
+    """Render a value as a SQL string literal"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def column_definition(column, properties, vendor, quote, resolve_table=None):
+    """Column clause of a CREATE TABLE statement (primary keys are table-level)"""
+    parts = [quote(column), sql_type(properties, vendor)]
+
+    if properties.get('auto_increment') and vendor == 'postgresql':
+        parts.append('GENERATED BY DEFAULT AS IDENTITY')
+    if not properties.get('nullable', True) or properties.get('primary_key'):
+        parts.append('NOT NULL')
+    if properties.get('unique'):
+        parts.append('UNIQUE')
+    if properties.get('default_value') not in (None, ''):
+        parts.append(f"DEFAULT {quote_literal(properties['default_value'])}")
+
+    if properties.get('foreign_key') and properties.get('foreign_table') and resolve_table:
+        referenced = resolve_table(properties['foreign_table'])
+        if referenced:
+            parts.append(f"REFERENCES {quote(referenced)} ({quote(properties.get('foreign_column') or 'id')})")
+            if properties.get('on_delete') in ON_DELETE_ACTIONS:
+                parts.append(f"ON DELETE {properties['on_delete']}")
+
+    return ' '.join(parts)
+
+
+def create_table_sql(table, columns, vendor, quote, resolve_table=None, internal_columns=True):
+    """CREATE TABLE statement generated from column properties
+
+    ``columns`` maps column names to their property dicts. With
+    internal_columns the _row_id/_row_number/_search_text bookkeeping
+    columns are added.
+    """
+    definitions = []
+    primary_key = [name for name, properties in columns.items() if properties.get('primary_key')]
+
+    if internal_columns:
+        if vendor == 'postgresql':
+            row_id_constraint = 'UNIQUE' if primary_key else 'PRIMARY KEY'
+            definitions.append(f"{quote(ROW_ID)} BIGSERIAL {row_id_constraint}")
+            definitions.append(f"{quote(ROW_NUMBER)} BIGINT NOT NULL")
+        else:
+            definitions.append(f"{quote(ROW_ID)} INTEGER PRIMARY KEY AUTOINCREMENT")
+            definitions.append(f"{quote(ROW_NUMBER)} INTEGER NOT NULL")
+        definitions.append(f"{quote(SEARCH_TEXT)} TEXT NOT NULL DEFAULT ''")
+
+    for name, properties in columns.items():
+        definitions.append(column_definition(name, properties, vendor, quote, resolve_table))
+
+    if primary_key:
+        key_columns = ', '.join(quote(name) for name in primary_key)
+        if internal_columns and vendor != 'postgresql':
+            # SQLite only allows one PRIMARY KEY and _row_id already holds it
+            definitions.append(f"UNIQUE ({key_columns})")
+        else:
+            definitions.append(f"PRIMARY KEY ({key_columns})")
+
+    body = ',\n    '.join(definitions)
+    return f"CREATE TABLE {quote(table)} (\n    {body}\n)"
+
+
+def _resolve_typed_table(table_name):
+    """Map a referenced user table name to its physical typed table"""
+    from csv_upload.models import CSVUpload
+    referenced = CSVUpload.objects.ready().filter(table_name=table_name, storage_engine=CSVUpload.STORAGE_TABLE).first()
+    return physical_table_name(referenced) if referenced else None
+
+
+def coerce_value(value, data_type):
+    """Convert a cell value to the Python type stored for data_type
+
+    Raises ValueError if the value does not fit the column type.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        if data_type == 'TEXT':
+            return value
+        value = value.strip()
+        if value == '':
+            return None
+
+    if data_type == 'INTEGER':
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            number = float(value)
+            if not number.is_integer():
+                raise ValueError(f"'{value}' is not an integer")
+            return int(number)
+    elif data_type == 'REAL':
+        return float(value)
+    elif data_type == 'BOOLEAN':
+        if isinstance(value, bool):
+            return value
+        lowered = str(value).lower()
+        if lowered in TRUE_VALUES:
+            return True
+        if lowered in FALSE_VALUES:
+            return False
+        raise ValueError(f"'{value}' is not a boolean")
+    elif data_type in ('DATE', 'DATETIME'):
+        timestamp = pd.Timestamp(value)
+        if pd.isna(timestamp):
+            return None
+        return timestamp.date() if data_type == 'DATE' else timestamp.to_pydatetime()
+    elif data_type == 'BLOB':
+        return value if isinstance(value, bytes) else str(value).encode('utf-8')
+    return str(value)
+
+
+def display_value(value):
+    """Render a stored value the way the JSON storage engine shows it"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, memoryview):
+        value = value.tobytes()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return str(value)
+
+
+def search_text(values):
+    """Displayed cell values of a typed row joined for the search column (NULL cells skipped)"""
+    return SEARCH_SEPARATOR.join(display_value(value) for value in values if value is not None)
+
+
+def _db_param(value):
+    """Adapt a coerced value for cursor parameters on every backend"""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def create_indexes(cursor, table):
+    """Index the row order and, on PostgreSQL with pg_trgm, the search column of a typed table"""
+    quote = connection.ops.quote_name
+    cursor.execute(
+        f"CREATE INDEX {quote(table + '_row_number_idx')} ON {quote(table)} ({quote(ROW_NUMBER)})"
+    )
+    if connection.vendor != 'postgresql':
+        return
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    if cursor.fetchone():
+        cursor.execute(
+            f"CREATE INDEX {quote(table + '_search_trgm')} ON {quote(table)} "
+            f"USING gin ({quote(SEARCH_TEXT)} gin_trgm_ops)"
+        )
+
+
+def create_typed_table(csv_upload):
+    """Create the physical table for a typed upload"""
+    quote = connection.ops.quote_name
+    table = physical_table_name(csv_upload)
+    with connection.cursor() as cursor:
+        cursor.execute(create_table_sql(
+            table, csv_upload.get_columns(), connection.vendor, quote, _resolve_typed_table
+        ))
+        create_indexes(cursor, table)
+
+
+def drop_typed_table(csv_upload):
+    """Drop the physical table of a typed upload"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {connection.ops.quote_name(physical_table_name(csv_upload))}")
+
+
+def widen_typed_columns(csv_upload, column_names, table=None, previous_types=None):
+    """Apply widened data types found later in the ingest to the physical table (or another table shaped like it)
+
+    previous_types maps column names to the types they are widened from.
+    SQLite values keep their stored form (booleans are rewritten as the
+    text they display as), so only PostgreSQL rewrites the search column.
+    """
+    quote = connection.ops.quote_name
+    staging = table is not None
+    table = quote(table or physical_table_name(csv_upload))
+    if connection.vendor != 'postgresql':
+        # SQLite columns are dynamically typed, so only booleans, stored as 0/1, need rewriting as text
+        with connection.cursor() as cursor:
+            for name in column_names:
+                if (previous_types or {}).get(name) == 'BOOLEAN' and \
+                        csv_upload.get_column_properties(name).get('data_type') == 'TEXT':
+                    cursor.execute(
+                        f"UPDATE {table} SET {quote(name)} = "
+                        f"CASE {quote(name)} WHEN 1 THEN 'true' WHEN 0 THEN 'false' ELSE {quote(name)} END"
+                    )
+        return
+    with connection.cursor() as cursor:
+        for name in column_names:
+            new_type = sql_type(csv_upload.get_column_properties(name), connection.vendor)
+            cursor.execute(
+                f"ALTER TABLE {table} ALTER COLUMN {quote(name)} TYPE {new_type} "
+                f"USING CAST({quote(name)} AS {new_type})"
+            )
+    if column_names and not staging:
+        # Widened values display differently (1 -> 1.0, dates gain a time); a staging table is empty here
+        refresh_search_text(csv_upload)
+
+
+def rebuild_typed_table(csv_upload, cast_columns=()):
+    """Recreate the physical table after column properties changed
+
+    Rows are copied into a table built from the new DDL, so type or
+    constraint violations abort the change and leave the old table intact.
+    On PostgreSQL the columns in cast_columns (those whose data type changed)
+    are converted with CAST; every other value is copied as it is stored.
+    SQLite converts through column affinity instead, because its CAST to
+    DATE or DATETIME turns ISO date text into a number.
+    """
+    quote = connection.ops.quote_name
+    table = physical_table_name(csv_upload)
+    staging = f"{table}_{uuid.uuid4().hex[:8]}"
+    columns = csv_upload.get_columns()
+
+    def selected(name, properties):
+        if connection.vendor != 'postgresql' or name not in cast_columns:
+            return quote(name)
+        # TEXT is not cast to VARCHAR(n): an explicit cast would silently truncate
+        return f"CAST({quote(name)} AS {SQL_TYPES['postgresql'].get(properties.get('data_type'), 'TEXT')})"
+
+    select_list = [quote(ROW_ID), quote(ROW_NUMBER), quote(SEARCH_TEXT)] + [
+        selected(name, properties) for name, properties in columns.items()
+    ]
+    insert_list = [quote(ROW_ID), quote(ROW_NUMBER), quote(SEARCH_TEXT)] + [quote(name) for name in columns]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(create_table_sql(
+            staging, columns, connection.vendor, quote, _resolve_typed_table
+        ))
+        cursor.execute(
+            f"INSERT INTO {quote(staging)} ({', '.join(insert_list)}) "
+            f"SELECT {', '.join(select_list)} FROM {quote(table)}"
+        )
+        cursor.execute(f"DROP TABLE {quote(table)}")
+        cursor.execute(f"ALTER TABLE {quote(staging)} RENAME TO {quote(table)}")
+        if cast_columns:
+            # Before the indexes, so the trigram index is built once over the new text
+            refresh_search_text(csv_upload)
+        create_indexes(cursor, table)
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence(%s, %s), COALESCE(MAX({quote(ROW_ID)}), 0) + 1, false) "
+                f"FROM {quote(table)}",
+                [quote(table), ROW_ID]
+            )
+
+
+def update_typed_cell(csv_upload, row_id, column, value):
+    """Update one cell of a typed table and return the stored display value"""
+    columns = csv_upload.get_columns()
+    if column not in columns:
+        raise ValueError(f'Unknown column "{column}"')
+
+    stored = coerce_value(value, csv_upload.get_column_properties(column).get('data_type', 'TEXT'))
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {quote(physical_table_name(csv_upload))} SET {quote(column)} = %s "
+            f"WHERE {quote(ROW_ID)} = %s",
+            [_db_param(stored), row_id]
+        )
+        if cursor.rowcount == 0:
+            raise ValueError(f'Row {row_id} does not exist')
+    refresh_search_text(csv_upload, [row_id])
+    return display_value(stored)
+
+
+def update_typed_cells(csv_upload, changes):
+    """Apply {row_id: {column: coerced value}} edits; returns the row ids updated
+
+    One batched UPDATE per column via executemany.
+    """
+    quote = connection.ops.quote_name
+    table = quote(physical_table_name(csv_upload))
+    row_ids = list(changes)
+    existing = set()
+    with connection.cursor() as cursor:
+        for start in range(0, len(row_ids), 1000):
+            batch = row_ids[start:start + 1000]
+            cursor.execute(
+                f"SELECT {quote(ROW_ID)} FROM {table} WHERE {quote(ROW_ID)} IN ({', '.join(['%s'] * len(batch))})",
+                batch
+            )
+            existing.update(row[0] for row in cursor.fetchall())
+
+        columns = sorted({column for row_id in existing for column in changes[row_id]})
+        for column in columns:
+            cursor.executemany(
+                f"UPDATE {table} SET {quote(column)} = %s WHERE {quote(ROW_ID)} = %s",
+                [(_db_param(changes[row_id][column]), row_id) for row_id in existing if column in changes[row_id]]
+            )
+    refresh_search_text(csv_upload, existing)
+    return existing
+
+
+def typed_cell_rows(csv_upload, row_ids, columns):
+    """Yield (row_id, {column: value}) for the given rows of a typed table"""
+    if not row_ids:
+        return
+    quote = connection.ops.quote_name
+    selected = ', '.join(quote(column) for column in [ROW_ID, *columns])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {selected} FROM {quote(physical_table_name(csv_upload))} "
+            f"WHERE {quote(ROW_ID)} IN ({', '.join(['%s'] * len(row_ids))})",
+            list(row_ids)
+        )
+        for row in cursor.fetchall():
+            yield row[0], dict(zip(columns, row[1:]))
+
+
+def refresh_search_text(csv_upload, row_ids=None):
+    """Rewrite the search column of the given rows (default: every row) from their cell values"""
+    quote = connection.ops.quote_name
+    table = quote(physical_table_name(csv_upload))
+    columns = csv_upload.get_column_names()
+    booleans = [csv_upload.get_column_properties(name).get('data_type') == 'BOOLEAN' for name in columns]
+    select = f"SELECT {', '.join(quote(name) for name in [ROW_ID, *columns])} FROM {table}"
+    update = f"UPDATE {table} SET {quote(SEARCH_TEXT)} = %s WHERE {quote(ROW_ID)} = %s"
+
+    def updates(records):
+        # SQLite hands BOOLEAN columns back as 0/1
+        return [
+            (search_text([
+                bool(value) if boolean and isinstance(value, int) else value
+                for value, boolean in zip(record[1:], booleans)
+            ]), record[0])
+            for record in records
+        ]
+
+    with connection.cursor() as cursor:
+        if row_ids is not None:
+            row_ids = list(row_ids)
+            for start in range(0, len(row_ids), 1000):
+                batch = row_ids[start:start + 1000]
+                cursor.execute(f"{select} WHERE {quote(ROW_ID)} IN ({', '.join(['%s'] * len(batch))})", batch)
+                cursor.executemany(update, updates(cursor.fetchall()))
+            return
+        # Keyset batches, so no read cursor stays open over the rows being rewritten
+        last_id = None
+        while True:
+            if last_id is None:
+                cursor.execute(f"{select} ORDER BY {quote(ROW_ID)} LIMIT 1000")
+            else:
+                cursor.execute(f"{select} WHERE {quote(ROW_ID)} > %s ORDER BY {quote(ROW_ID)} LIMIT 1000", [last_id])
+            records = cursor.fetchall()
+            if not records:
+                break
+            cursor.executemany(update, updates(records))
+            last_id = records[-1][0]
+
+
+class TypedTableLoader(BulkLoader):
+    """BulkLoader that writes coerced values into a typed upload table"""
+
+    def __init__(self, csv_upload, **kwargs):
+        super().__init__(csv_upload, **kwargs)
+        self.column_types = {
+            name: csv_upload.get_column_properties(name).get('data_type', 'TEXT')
+            for name in csv_upload.get_column_names()
+        }
+
+    def copy_table(self):
+        return self.connection.ops.quote_name(self.table or physical_table_name(self.csv_upload))
+
+    def copy_columns(self):
+        return [ROW_NUMBER, SEARCH_TEXT] + list(self.column_types)
+
+    def copy_not_null_columns(self):
+        # Empty cells are NULL, as they are in JSON rows; a row of them still has search text ''
+        return [SEARCH_TEXT]
+
+    def coerced_values(self, row_number, row_dict):
+        values = []
+        for name, data_type in self.column_types.items():
+            try:
+                values.append(coerce_value(row_dict.get(name), data_type))
+            except (TypeError, ValueError) as e:
+                raise ValueError(f'Row {row_number}, column "{name}": {e}')
+        return values
+
+    def copy_values(self, row_number, row_dict):
+        coerced = self.coerced_values(row_number, row_dict)
+        values = [row_number, search_text(coerced)]
+        for value in coerced:
+            if isinstance(value, bytes):
+                value = '\\x' + value.hex()
+            values.append(_db_param(value))
+        return values
+
+    def _bulk_create(self, rows):
+        """Insert rows with executemany in batch_size slices"""
+        quote = self.connection.ops.quote_name
+        columns = self.copy_columns()
+        sql = (
+            f"INSERT INTO {self.copy_table()} ({', '.join(quote(c) for c in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))})"
+        )
+        count = 0
+        batch = []
+        with self.connection.cursor() as cursor:
+            for row_number, row_dict in rows:
+                coerced = self.coerced_values(row_number, row_dict)
+                batch.append([row_number, search_text(coerced)] + [_db_param(value) for value in coerced])
+                if len(batch) >= self.batch_size:
+                    cursor.executemany(sql, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(sql, batch)
+                count += len(batch)
+        return count
+
+
+class TypedRow:
+    """Row of a typed table with the same interface the views use on CSVData"""
+
+    def __init__(self, row_id, row_number, data):
+        self.id = row_id
+        self.row_number = row_number
+        self._data = data
+
+    def get_row_data(self):
+        return self._data
+
+
+class TypedRowQuery:
+    """Lazy, sliceable row set of a typed table
+
+    It behaves enough like a QuerySet (count() and slicing) for Django's
+    Paginator, so every page runs one COUNT and one LIMIT/OFFSET query.
+    """
+    ordered = True
+
+    def __init__(self, csv_upload, filter_text='', sort_by='row_number', sort_order='asc', filter_expression=None):
+        self.csv_upload = csv_upload
+        self.columns = csv_upload.get_column_names()
+        # SQLite hands BOOLEAN columns back as 0/1
+        self.boolean_columns = {
+            name for name in self.columns if csv_upload.get_column_properties(name).get('data_type') == 'BOOLEAN'
+        }
+        self.filter_text = filter_text
+        self.filter_expression = filter_expression
+        self.sort_by = sort_by
+        self.sort_order = sort_order
+        self._count = None
+
+    def _where(self):
+        conditions = []
+        params = []
+        if self.filter_text:
+            like = 'ILIKE' if connection.vendor == 'postgresql' else 'LIKE'
+            conditions.append(f"{connection.ops.quote_name(SEARCH_TEXT)} {like} %s ESCAPE '\\'")
+            params.append('%' + escape_like(self.filter_text) + '%')
+        if self.filter_expression is not None:
+            sql, expression_params = self.filter_expression.to_sql(self.csv_upload, connection)
+            conditions.append(sql)
+            params += expression_params
+        if not conditions:
+            return '', []
+        return 'WHERE ' + ' AND '.join(conditions), params
+
+    def _order_by(self):
+        quote = connection.ops.quote_name
+        direction = 'DESC' if self.sort_order == 'desc' else 'ASC'
+        if self.sort_by in self.columns:
+            return f"ORDER BY {quote(self.sort_by)} {direction}, {quote(ROW_NUMBER)} ASC"
+        return f"ORDER BY {quote(ROW_NUMBER)} {direction}"
+
+    def count(self):
+        if self._count is None:
+            where, params = self._where()
+            table = connection.ops.quote_name(physical_table_name(self.csv_upload))
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT COUNT(*) FROM {table} {where}", params)
+                self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def _select(self):
+        quote = connection.ops.quote_name
+        where, params = self._where()
+        select_list = ', '.join([quote(ROW_ID), quote(ROW_NUMBER)] + [quote(name) for name in self.columns])
+        sql = f"SELECT {select_list} FROM {quote(physical_table_name(self.csv_upload))} {where} {self._order_by()}"
+        return sql, params
+
+    def _row(self, record):
+        return TypedRow(record[0], record[1], {
+            name: display_value(bool(value) if name in self.boolean_columns and isinstance(value, int) else value)
+            for name, value in zip(self.columns, record[2:])
+        })
+
+    def iterator(self, chunk_size=2000):
+        """Stream every row in display order
+
+        Uses a server-side cursor on PostgreSQL (Django's chunked cursor), so
+        memory stays at one chunk of rows however large the table is.
+        """
+        sql, params = self._select()
+        cursor = connection.chunked_cursor()
+        try:
+            cursor.execute(sql, params)
+            while True:
+                records = cursor.fetchmany(chunk_size)
+                if not records:
+                    break
+                for record in records:
+                    yield self._row(record)
+        finally:
+            cursor.close()
+
+    def fetch(self, offset=0, limit=None):
+        """Rows in display order starting at offset"""
+        sql, params = self._select()
+        if limit is not None:
+            sql += ' LIMIT %s'
+            params = params + [limit]
+        if offset:
+            if limit is None:
+                sql += ' LIMIT -1' if connection.vendor == 'sqlite' else ''
+            sql += ' OFFSET %s'
+            params = params + [offset]
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [self._row(record) for record in cursor.fetchall()]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start = key.start or 0
+            limit = None if key.stop is None else max(key.stop - start, 0)
+            return self.fetch(start, limit)
+        rows = self.fetch(key, 1)
+        if not rows:
+            raise IndexError(key)
+        return rows[0]
+
+    def __iter__(self):
+        return iter(self.fetch())
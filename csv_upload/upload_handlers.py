@@ -0,0 +1,52 @@
+"""
+Upload handlers that hash files while Django receives them.
+
+They replace Django's default handlers in FILE_UPLOAD_HANDLERS and behave
+the same, except that every completed file carries the SHA-256 of its bytes
+as ``content_hash``. The hash is what dedup.py matches repeated uploads by,
+and computing it here costs no extra pass over the file.
+"""
+
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+def content_hash(uploaded_file):
+    """SHA-256 recorded for an uploaded file, or None if no hashing handler saw it"""
+    return getattr(uploaded_file, 'content_hash', None)
+
+
+class HashingUploadMixin:
+    """Hash the chunks a handler stores and attach the digest to its file"""
+
+    def handles_data(self):
+        return True
+
+    def new_file(self, *args, **kwargs):
+        # Before super(): MemoryFileUploadHandler raises StopFutureHandlers from new_file
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.handles_data():
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.content_hash = self.sha256.hexdigest()
+        return uploaded_file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    """MemoryFileUploadHandler that records content_hash"""
+
+    def handles_data(self):
+        # Files over FILE_UPLOAD_MAX_MEMORY_SIZE are passed on to the next handler
+        return self.activated
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    """TemporaryFileUploadHandler that records content_hash"""
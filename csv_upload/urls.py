@@ -11,4 +11,11 @@ urlpatterns = [
     path('delete/<int:table_id>/', views.delete_table, name='delete_table'),
     path('api/table/<int:table_id>/update-cell/', views.update_cell, name='update_cell'),
     path('api/table/<int:table_id>/reload/', views.reload_table_data, name='reload_table_data'),
+    path('api/table/<int:table_id>/patch/', views.patch_table, name='patch_table'),
+    path('api/table/<int:table_id>/export/<str:export_format>/', views.export_table, name='export_table'),
+    path('api/job/<int:job_id>/progress/', views.ingest_job_progress, name='ingest_job_progress'),
+    path('api/upload/', views.start_chunked_upload, name='start_chunked_upload'),
+    path('api/upload/<uuid:upload_id>/', views.chunked_upload, name='chunked_upload'),
+    path('api/upload/<uuid:upload_id>/chunk/', views.upload_chunk, name='upload_chunk'),
+    path('api/upload/<uuid:upload_id>/finalize/', views.finalize_chunked_upload, name='finalize_chunked_upload'),
 ]
@@ -1,15 +1,37 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.http import JsonResponse
-from django.core.paginator import Paginator
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.db import DatabaseError, transaction
 from django.db.models import Q
-import pandas as pd
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+import hashlib
 import json
-import io
-import re
+import os
 # Absolute imports to avoid IDE issues
-from csv_upload.models import CSVUpload, CSVData
-from csv_upload.forms import CSVUploadForm, RenameTableForm, ColumnPropertiesForm
+from csv_upload.models import CSVUpload, CSVData, IngestJob, UploadSession
+from csv_upload.arrow_io import pyarrow_available
+from csv_upload.chunked_uploads import (
+    ChunkRejected, abort_upload, finalize_upload, start_upload, upload_progress, write_chunk,
+)
+from csv_upload.exports import EXPORT_FORMATS, export_stream
+from csv_upload.filter_expressions import FilterSyntaxError
+from csv_upload.forms import CSVUploadForm, ChunkedUploadForm, RenameTableForm, ColumnPropertiesForm
+from csv_upload.ingest import PREVIEW_ROWS, IngestPipeline
+from csv_upload.jobs import enqueue_upload, job_progress
+from csv_upload.merge import MergePipeline, delete_upload
+from csv_upload.pagination import InvalidCursor
+from csv_upload.patching import apply_patch
+from csv_upload.profiling import current_cell_values, record_cell_changes, summarize
+from csv_upload.table_query import TableQuery
+from csv_upload.typed_tables import (
+    TypedRowQuery, coerce_value, display_value, rebuild_typed_table, update_typed_cell,
+)
+from csv_upload.upload_handlers import content_hash
 
 
 def upload_csv(request):
@@ -18,6 +40,7 @@ def upload_csv(request):
     csv_upload = None
     table_data = None
     columns = None
+    load_stats = None
     
     if request.method == 'POST':
         form = CSVUploadForm(request.POST, request.FILES)
@@ -25,211 +48,125 @@ def upload_csv(request):
             try:
                 csv_file = form.cleaned_data['csv_file']
                 table_name = form.cleaned_data['table_name']
+                mode = form.cleaned_data['mode']
+                # Append and upsert load into an existing table instead of creating one
+                target = None if mode == IngestJob.MODE_CREATE else CSVUpload.objects.ready().filter(table_name=table_name).first()
                 
-                # Check if table name already exists
-                if CSVUpload.objects.filter(table_name=table_name).exists():
+                # Check if table name already exists or is waiting in the ingest queue
+                if mode == IngestJob.MODE_CREATE and table_name_in_use(table_name):
                     messages.error(request, f'Table "{table_name}" already exists. Please choose a different name.')
+                elif mode != IngestJob.MODE_CREATE and target is None:
+                    messages.error(request, f'Table "{table_name}" does not exist. Choose an existing table to {mode} into.')
+                elif getattr(settings, 'CSV_INGEST_BACKGROUND', True):
+                    # Hand the file to run_ingest_worker and return straight away
+                    ingest_job = enqueue_upload(
+                        csv_file, table_name, target.storage_engine if target else form.cleaned_data['storage_engine'],
+                        mode
+                    )
+                    if 'application/json' in request.headers.get('Accept', ''):
+                        return JsonResponse({
+                            'success': True,
+                            'job_id': ingest_job.id,
+                            'progress_url': reverse('csv_upload:ingest_job_progress', args=[ingest_job.id]),
+                        }, status=202)
+                    if target:
+                        messages.info(request, f'Upload queued as job #{ingest_job.id}. Its rows will be loaded into table "{table_name}".')
+                    else:
+                        messages.info(request, f'Upload queued as job #{ingest_job.id}. Table "{table_name}" will appear once it is loaded.')
+                elif target:
+                    # Merge the file into the existing table
+                    pipeline = MergePipeline(csv_file, target, mode, filename=csv_file.name)
+                    _, merge_stats = pipeline.run()
+                    messages.success(
+                        request,
+                        f'Loaded {merge_stats.rows} rows into table {table_name}: '
+                        f'{pipeline.rows_inserted} inserted, {pipeline.rows_updated} updated'
+                    )
                 else:
                     # Process the CSV file
-                    csv_upload = process_csv_file(csv_file, table_name)
-                    messages.success(request, f'CSV file uploaded successfully! Created table: {table_name}')
+                    csv_upload, load_stats, table_data = process_csv_file(
+                        csv_file, table_name, form.cleaned_data['storage_engine']
+                    )
+                    messages.success(
+                        request,
+                        f'CSV file uploaded successfully! Created table: {table_name} '
+                        f'({load_stats.rows} rows, {load_stats.rows_per_second:,.0f} rows/s)'
+                    )
                     
-                    # Get the data for display
-                    table_data = get_table_data(csv_upload)
-                    columns = csv_upload.get_columns()
+                    # Preview rows come from the parsed chunks; view_table pages through the rest
+                    columns = [
+                        (name, csv_upload.get_column_properties(name).get('data_type', 'TEXT'))
+                        for name in csv_upload.get_column_names()
+                    ]
                     
             except Exception as e:
                 messages.error(request, f'Error processing CSV file: {str(e)}')
     
-    # Get all existing tables for selection
-    existing_tables = CSVUpload.objects.all().order_by('-uploaded_at')
+    # Get all existing tables for selection; the summary counters are stored, so nothing is counted here
+    existing_tables = CSVUpload.objects.ready().only(
+        'id', 'table_name', 'filename', 'uploaded_at', 'row_count', 'byte_size', 'column_count', 'last_modified'
+    ).order_by('-uploaded_at')
+    
+    # Queued and running ingest jobs, polled by the page for progress
+    ingest_jobs = IngestJob.objects.filter(status__in=IngestJob.ACTIVE_STATUSES)
     
     context = {
         'form': form,
         'csv_upload': csv_upload,
         'table_data': table_data,
         'columns': columns,
+        'load_stats': load_stats,
         'existing_tables': existing_tables,
+        'ingest_jobs': ingest_jobs,
     }
     
     return render(request, 'csv_upload/upload.html', context)
 
 
-def process_csv_file(csv_file, table_name):
-    """Process uploaded CSV file and store in database"""
-    # Read CSV file using pandas
-    content = csv_file.read().decode('utf-8')
-    df = pd.read_csv(io.StringIO(content))
-    
-    # Clean column names (remove special characters, spaces)
-    df.columns = [re.sub(r'[^a-zA-Z0-9_]', '_', col).lower().strip('_') for col in df.columns]
-    
-    # Create column information with properties
-    columns_info = {}
-    for col in df.columns:
-        # Determine data type
-        if df[col].dtype == 'object':
-            data_type = 'TEXT'
-        elif df[col].dtype in ['int64', 'int32']:
-            data_type = 'INTEGER'
-        elif df[col].dtype in ['float64', 'float32']:
-            data_type = 'REAL'
-        else:
-            data_type = 'TEXT'
-        
-        # Create column properties with default values
-        columns_info[col] = {
-            'data_type': data_type,
-            'nullable': True,
-            'primary_key': False,
-            'foreign_key': False,
-            'foreign_table': None,
-            'foreign_column': None,
-            'on_delete': None,
-            'unique': False,
-            'default_value': None,
-            'max_length': None,
-            'auto_increment': False
-        }
-    
-    # Create CSVUpload record
-    csv_upload = CSVUpload.objects.create(
-        filename=csv_file.name,
-        table_name=table_name,
+def table_name_in_use(table_name):
+    """True if a table, a queued ingest job or an open chunked upload has the name"""
+    return (
+        CSVUpload.objects.filter(table_name=table_name).exists() or
+        IngestJob.objects.filter(table_name=table_name, status__in=IngestJob.ACTIVE_STATUSES).exists() or
+        UploadSession.objects.filter(table_name=table_name, status=UploadSession.STATUS_OPEN).exists()
     )
-    csv_upload.set_columns(columns_info)
-    csv_upload.save()
-    
-    # Store each row of data
-    for index, row in df.iterrows():
-        # Convert row to dictionary, handling NaN values
-        row_dict = {}
-        for col, value in row.items():
-            if pd.isna(value):
-                row_dict[col] = None
-            else:
-                row_dict[col] = str(value)
-        
-        CSVData.objects.create(
-            csv_upload=csv_upload,
-            row_number=index + 1,
-            row_data=json.dumps(row_dict)
-        )
-    
-    return csv_upload
 
 
-def get_table_data(csv_upload):
-    """Get table data for display"""
-    data_rows = CSVData.objects.filter(csv_upload=csv_upload).order_by('row_number')
-    table_data = []
-    
-    for data_row in data_rows:
-        table_data.append(data_row.get_row_data())
-    
-    return table_data
+def process_csv_file(csv_file, table_name, storage_engine=None):
+    """Process uploaded CSV file and store in database; returns (csv_upload, load_stats, preview rows)"""
+    # Stream the file in chunks instead of reading it into memory at once
+    pipeline = IngestPipeline(
+        csv_file, table_name, filename=csv_file.name, storage_engine=storage_engine,
+        content_hash=content_hash(csv_file)
+    )
+    csv_upload, load_stats = pipeline.run()
+    if pipeline.copied_from:
+        # Copied from an identical upload without parsing, so there are no parsed rows to show
+        return csv_upload, load_stats, get_table_data(csv_upload)
+    return csv_upload, load_stats, pipeline.preview
+
+
+def get_table_data(csv_upload, limit=PREVIEW_ROWS):
+    """Get the first rows of a table for display (at most limit)"""
+    if csv_upload.uses_typed_table():
+        data_rows = TypedRowQuery(csv_upload)
+    else:
+        data_rows = csv_upload.data_rows.order_by('row_number')
+    return [data_row.get_row_data() for data_row in data_rows[:limit]]
 
 
 def view_table(request, table_id):
     """View a specific table with enhanced features"""
-    csv_upload = get_object_or_404(CSVUpload, id=table_id)
-    
-    # Get filter and sorting parameters
-    filter_text = request.GET.get('filter', '')
-    sort_by = request.GET.get('sort', 'row_number')
-    sort_order = request.GET.get('order', 'asc')
-    page_size = int(request.GET.get('page_size', 10))
-    page_number = request.GET.get('page', 1)
-    
-    # Get base queryset
-    data_rows = CSVData.objects.filter(csv_upload=csv_upload)
-    
-    # Apply filtering
-    if filter_text:
-        # Filter across all row data (JSON search)
-        data_rows = data_rows.filter(row_data__icontains=filter_text)
-    
-    # Apply sorting
-    if sort_by != 'row_number':
-        # For JSON field sorting, we'll sort in Python after fetching
-        # This is not optimal for large datasets but works for our use case
-        all_rows = list(data_rows)
-        columns = csv_upload.get_columns()
-        
-        if sort_by in columns:
-            try:
-                all_rows.sort(
-                    key=lambda x: json.loads(x.row_data).get(sort_by, ''),
-                    reverse=(sort_order == 'desc')
-                )
-                # Create a custom queryset-like list for pagination
-                data_rows = all_rows
-            except:
-                # Fallback to row_number sorting
-                data_rows = data_rows.order_by('row_number')
-        else:
-            data_rows = data_rows.order_by('row_number')
-    else:
-        order_by = 'row_number' if sort_order == 'asc' else '-row_number'
-        data_rows = data_rows.order_by(order_by)
-    
-    # Pagination
-    if isinstance(data_rows, list):
-        # For sorted data, implement manual pagination
-        total_rows = len(data_rows)
-        start_idx = (int(page_number) - 1) * page_size
-        end_idx = start_idx + page_size
-        paginated_rows = data_rows[start_idx:end_idx]
-        
-        # Create a mock paginator object for template consistency
-        class MockPaginator:
-            def __init__(self, object_list, per_page, total):
-                self.object_list = object_list
-                self.per_page = per_page
-                self.count = total
-                self.num_pages = (total + per_page - 1) // per_page
-        
-        class MockPage:
-            def __init__(self, object_list, number, paginator):
-                self.object_list = object_list
-                self.number = int(number)
-                self.paginator = paginator
-                
-            def has_previous(self):
-                return self.number > 1
-                
-            def has_next(self):
-                return self.number < self.paginator.num_pages
-                
-            def previous_page_number(self):
-                return self.number - 1 if self.has_previous() else None
-                
-            def next_page_number(self):
-                return self.number + 1 if self.has_next() else None
-        
-        paginator = MockPaginator(data_rows, page_size, total_rows)
-        page_obj = MockPage(paginated_rows, page_number, paginator)
-    else:
-        # Use Django's built-in paginator
-        paginator = Paginator(data_rows, page_size)
-        page_obj = paginator.get_page(page_number)
-    
-    # Convert paginated data to table format
-    table_data = []
-    for data_row in page_obj.object_list:
-        if hasattr(data_row, 'get_row_data'):
-            table_data.append({
-                'id': data_row.id,
-                'row_number': data_row.row_number,
-                'data': data_row.get_row_data()
-            })
-        else:
-            # Handle case where data_row might be from sorted list
-            table_data.append({
-                'id': data_row.id,
-                'row_number': data_row.row_number,
-                'data': data_row.get_row_data()
-            })
+    csv_upload = get_object_or_404(CSVUpload.objects.ready(), id=table_id)
+    
+    # Filter, sort and page through the shared (cached) table query
+    try:
+        table_query = TableQuery.from_request(csv_upload, request.GET)
+    except FilterSyntaxError as e:
+        # A bad filter expression is reported and ignored
+        messages.error(request, f'Invalid filter expression: {str(e)}')
+        table_query = TableQuery.from_request(csv_upload, request.GET, use_where=False)
+    page_obj = table_query.page(request.GET.get('page', 1))
     
     columns = csv_upload.get_columns()
     
@@ -238,16 +175,17 @@ def view_table(request, table_id):
     
     context = {
         'csv_upload': csv_upload,
-        'table_data': table_data,
+        'table_data': page_obj.table_data,
         'columns': columns,
         'page_obj': page_obj,
-        'paginator': page_obj.paginator,
-        'filter_text': filter_text,
-        'sort_by': sort_by,
-        'sort_order': sort_order,
-        'page_size': page_size,
+        'paginator': page_obj,
+        'filter_text': table_query.filter_text,
+        'where_text': request.GET.get('where', ''),
+        'sort_by': table_query.sort_by,
+        'sort_order': table_query.sort_order,
+        'page_size': table_query.page_size,
         'page_size_options': page_size_options,
-        'total_records': page_obj.paginator.count,
+        'total_records': page_obj.count,
     }
     
     return render(request, 'csv_upload/view_table.html', context)
@@ -255,11 +193,11 @@ def view_table(request, table_id):
 
 def delete_table(request, table_id):
     """Delete a table"""
-    csv_upload = get_object_or_404(CSVUpload, id=table_id)
+    csv_upload = get_object_or_404(CSVUpload.objects.ready(), id=table_id)
     
     if request.method == 'POST':
         table_name = csv_upload.table_name
-        csv_upload.delete()
+        delete_upload(csv_upload)
         messages.success(request, f'Table "{table_name}" deleted successfully.')
         return redirect('csv_upload:upload')
     
@@ -270,21 +208,42 @@ def update_cell(request, table_id):
     """API endpoint to update a single cell value"""
     if request.method == 'POST':
         try:
-            csv_upload = get_object_or_404(CSVUpload, id=table_id)
+            csv_upload = get_object_or_404(CSVUpload.objects.ready(), id=table_id)
             data = json.loads(request.body)
             
-            row_id = data.get('row_id')
             column = data.get('column')
             new_value = data.get('value')
+            try:
+                row_id = int(data.get('row_id'))
+            except (TypeError, ValueError):
+                raise ValueError('row_id must be an integer')
             
-            # Get the specific row
-            csv_data = get_object_or_404(CSVData, id=row_id, csv_upload=csv_upload)
-            
-            # Update the specific column in the row data
-            row_data = csv_data.get_row_data()
-            row_data[column] = new_value
-            csv_data.set_row_data(row_data)
-            csv_data.save()
+            with transaction.atomic():
+                if column not in csv_upload.get_columns():
+                    raise ValueError(f'Unknown column "{column}"')
+                old_value = current_cell_values(csv_upload, {row_id: [column]}).get((row_id, column))
+                
+                if csv_upload.uses_typed_table():
+                    # Coerced to the column type; the table enforces constraints
+                    new_value = update_typed_cell(csv_upload, row_id, column, new_value)
+                else:
+                    # Store the canonical text form ingest uses for the column type
+                    data_type = csv_upload.get_column_properties(column).get('data_type', 'TEXT')
+                    try:
+                        new_value = display_value(coerce_value(new_value, data_type))
+                    except (TypeError, ValueError):
+                        raise ValueError(f"'{new_value}' is not a valid {data_type} value")
+                    # Rewrite just this key of the jsonb row in place
+                    updated = CSVData.objects.filter(csv_upload=csv_upload).set_cell(
+                        row_id, csv_upload.row_key(column), new_value
+                    )
+                    if not updated:
+                        raise ValueError(f'Row {row_id} does not exist')
+                
+                # Keep the column profiles current without rescanning the table
+                stored = None if new_value is None else str(new_value)
+                record_cell_changes(csv_upload, [(column, old_value, stored)])
+                csv_upload.bump_data_version()
             
             return JsonResponse({
                 'success': True,
@@ -303,79 +262,296 @@ def update_cell(request, table_id):
     return JsonResponse({'success': False, 'message': 'Invalid request method'}, status=405)
 
 
+def patch_table(request, table_id):
+    """API endpoint applying a batch of cell edits in one transaction"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Invalid request method'}, status=405)
+    
+    csv_upload = get_object_or_404(CSVUpload.objects.ready(), id=table_id)
+    try:
+        data = json.loads(request.body)
+        # Accept either {"edits": [...]} or a bare list of edits
+        edits = data.get('edits') if isinstance(data, dict) else data
+        applied, results = apply_patch(csv_upload, edits)
+    except (ValueError, DatabaseError) as e:
+        return JsonResponse({
+            'success': False,
+            'message': f'Error applying patch: {str(e)}'
+        }, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'message': f'{applied} of {len(results)} cells updated',
+        'applied': applied,
+        'failed': len(results) - applied,
+        'results': results
+    })
+
+
+def table_data_etag(request, table_id):
+    """Strong ETag for a reload request: table data version plus the query string
+
+    Computed from CSVUpload alone, so If-None-Match hits never touch CSVData.
+    """
+    data_version = CSVUpload.objects.ready().filter(id=table_id).values_list('data_version', flat=True).first()
+    if data_version is None:
+        return None
+    query = '&'.join(f'{key}={value}' for key, value in sorted(request.GET.items()))
+    digest = hashlib.sha1(query.encode('utf-8')).hexdigest()[:16]
+    return f'{table_id}-{data_version}-{digest}'
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=table_data_etag)
 def reload_table_data(request, table_id):
     """API endpoint to reload table data with filters and pagination"""
-    csv_upload = get_object_or_404(CSVUpload, id=table_id)
-    
-    # Get parameters
-    filter_text = request.GET.get('filter', '')
-    sort_by = request.GET.get('sort', 'row_number')
-    sort_order = request.GET.get('order', 'asc')
-    page_size = int(request.GET.get('page_size', 10))
-    page_number = int(request.GET.get('page', 1))
+    csv_upload = get_object_or_404(CSVUpload.objects.ready(), id=table_id)
     
-    # Get filtered and sorted data (reuse logic from view_table)
-    data_rows = CSVData.objects.filter(csv_upload=csv_upload)
+    try:
+        table_query = TableQuery.from_request(csv_upload, request.GET)
+    except FilterSyntaxError as e:
+        return JsonResponse({'success': False, 'message': f'Invalid filter expression: {str(e)}'}, status=400)
     
-    if filter_text:
-        data_rows = data_rows.filter(row_data__icontains=filter_text)
-    
-    # Apply sorting
-    if sort_by != 'row_number':
-        all_rows = list(data_rows)
-        columns = csv_upload.get_columns()
+    # Keyset pagination: seek from an opaque cursor instead of COUNT + OFFSET
+    cursor = request.GET.get('cursor', '')
+    if (request.GET.get('pagination') == 'cursor' or cursor) and table_query.supports_cursor():
+        try:
+            page = table_query.keyset(cursor or None)
+        except InvalidCursor as e:
+            return JsonResponse({'success': False, 'message': str(e)}, status=400)
         
-        if sort_by in columns:
-            try:
-                all_rows.sort(
-                    key=lambda x: json.loads(x.row_data).get(sort_by, ''),
-                    reverse=(sort_order == 'desc')
-                )
-                data_rows = all_rows
-            except:
-                data_rows = data_rows.order_by('row_number')
-        else:
-            data_rows = data_rows.order_by('row_number')
-    else:
-        order_by = 'row_number' if sort_order == 'asc' else '-row_number'
-        data_rows = data_rows.order_by(order_by)
-    
-    # Pagination
-    if isinstance(data_rows, list):
-        total_rows = len(data_rows)
-        start_idx = (page_number - 1) * page_size
-        end_idx = start_idx + page_size
-        paginated_rows = data_rows[start_idx:end_idx]
-        total_pages = (total_rows + page_size - 1) // page_size
-    else:
-        paginator = Paginator(data_rows, page_size)
-        page_obj = paginator.get_page(page_number)
-        paginated_rows = page_obj.object_list
-        total_rows = paginator.count
-        total_pages = paginator.num_pages
-    
-    # Convert to table format
-    table_data = []
-    for data_row in paginated_rows:
-        table_data.append({
-            'id': data_row.id,
-            'row_number': data_row.row_number,
-            'data': data_row.get_row_data()
+        return JsonResponse({
+            'success': True,
+            'pagination': 'cursor',
+            'table_data': page['table_data'],
+            'next_cursor': page['next_cursor'],
+            'prev_cursor': page['prev_cursor'],
+            'has_next': page['next_cursor'] is not None,
+            'has_previous': page['prev_cursor'] is not None,
+            'page_size': table_query.page_size
         })
     
+    page_obj = table_query.page(request.GET.get('page', 1))
+    
     return JsonResponse({
         'success': True,
-        'table_data': table_data,
-        'total_records': total_rows,
-        'total_pages': total_pages,
-        'current_page': page_number,
-        'page_size': page_size
+        'table_data': page_obj.table_data,
+        'total_records': page_obj.count,
+        'total_pages': page_obj.num_pages,
+        'current_page': page_obj.number,
+        'page_size': table_query.page_size
     })
 
 
+def export_table(request, table_id, export_format):
+    """Stream the table, under the current filter and sort, as CSV, NDJSON or SQL"""
+    csv_upload = get_object_or_404(CSVUpload.objects.ready(), id=table_id)
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({'success': False, 'message': f'Unknown export format "{export_format}"'}, status=404)
+    if export_format == 'parquet' and not pyarrow_available():
+        return JsonResponse({'success': False, 'message': 'Parquet export needs the pyarrow package'}, status=400)
+    
+    try:
+        table_query = TableQuery.from_request(csv_upload, request.GET)
+    except FilterSyntaxError as e:
+        return JsonResponse({'success': False, 'message': f'Invalid filter expression: {str(e)}'}, status=400)
+    
+    content_type, extension = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(
+        export_stream(table_query, export_format, request.GET.get('dialect')),
+        content_type=content_type
+    )
+    response['Content-Disposition'] = f'attachment; filename="{csv_upload.table_name}.{extension}"'
+    return response
+
+
+def chunked_upload_urls(session):
+    """API URLs a client needs to continue a chunked upload"""
+    return {
+        'upload_url': reverse('csv_upload:chunked_upload', args=[session.pk]),
+        'chunk_url': reverse('csv_upload:upload_chunk', args=[session.pk]),
+        'finalize_url': reverse('csv_upload:finalize_chunked_upload', args=[session.pk]),
+    }
+
+
+def authorized_upload_session(request, upload_id):
+    """(session, None) for a request carrying the session's X-Upload-Token, else (None, error response)"""
+    session = get_object_or_404(UploadSession, id=upload_id)
+    if not constant_time_compare(request.headers.get('X-Upload-Token', ''), session.token):
+        return None, JsonResponse(
+            {'success': False, 'message': 'The X-Upload-Token header is missing or does not match the upload'},
+            status=403
+        )
+    return session, None
+
+
+def start_chunked_upload(request):
+    """API endpoint opening a resumable chunked upload"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Invalid request method'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Request body must be JSON'}, status=400)
+    form = ChunkedUploadForm(data if isinstance(data, dict) else {})
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'message': 'Invalid upload', 'errors': form.errors}, status=400)
+    
+    table_name = form.cleaned_data['table_name']
+    mode = form.cleaned_data['mode']
+    storage_engine = form.cleaned_data['storage_engine']
+    if mode == IngestJob.MODE_CREATE and table_name_in_use(table_name):
+        return JsonResponse({
+            'success': False,
+            'message': f'Table "{table_name}" already exists. Please choose a different name.'
+        }, status=409)
+    if mode != IngestJob.MODE_CREATE:
+        target = CSVUpload.objects.ready().filter(table_name=table_name).first()
+        if target is None:
+            return JsonResponse({'success': False, 'message': f'Table "{table_name}" does not exist'}, status=404)
+        storage_engine = target.storage_engine
+    session = start_upload(
+        form.cleaned_data['filename'], table_name, form.cleaned_data['total_bytes'], storage_engine, mode
+    )
+    return JsonResponse({
+        'success': True,
+        **upload_progress(session),
+        **chunked_upload_urls(session),
+        # Only ever returned here; the client sends it as X-Upload-Token from now on
+        'upload_token': session.token,
+    }, status=201)
+
+
+@csrf_exempt  # Authenticated by X-Upload-Token, which a cross-site form cannot send
+def chunked_upload(request, upload_id):
+    """API endpoint reporting (GET) or cancelling (DELETE) a chunked upload"""
+    session, error = authorized_upload_session(request, upload_id)
+    if error:
+        return error
+    if request.method == 'DELETE':
+        if session.status != UploadSession.STATUS_OPEN:
+            return JsonResponse({'success': False, 'message': 'The upload was finalized already'}, status=409)
+        abort_upload(session)
+        return JsonResponse({'success': True, 'message': 'Upload cancelled'})
+    if request.method != 'GET':
+        return JsonResponse({'success': False, 'message': 'Invalid request method'}, status=405)
+    
+    return JsonResponse({'success': True, **upload_progress(session), **chunked_upload_urls(session)})
+
+
+@csrf_exempt  # Authenticated by X-Upload-Token
+def upload_chunk(request, upload_id):
+    """API endpoint storing one chunk (PUT ?offset=N, X-Chunk-SHA256 header)"""
+    if request.method != 'PUT':
+        return JsonResponse({'success': False, 'message': 'Invalid request method'}, status=405)
+    
+    _, error = authorized_upload_session(request, upload_id)
+    if error:
+        return error
+    try:
+        offset = int(request.GET.get('offset', ''))
+        length = int(request.META.get('CONTENT_LENGTH') or '')
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'offset and Content-Length must be integers'}, status=400)
+    if offset < 0 or length < 1:
+        return JsonResponse({'success': False, 'message': 'Empty chunk or negative offset'}, status=400)
+    
+    try:
+        # Read from the request stream itself; request.body would buffer the whole chunk
+        session = write_chunk(upload_id, offset, request, length, request.headers.get('X-Chunk-SHA256'))
+    except ChunkRejected as e:
+        session = UploadSession.objects.filter(id=upload_id).first()
+        return JsonResponse({
+            'success': False,
+            'message': str(e),
+            'received_bytes': session.received_bytes if session else None,
+        }, status=e.status)
+    
+    return JsonResponse({'success': True, **upload_progress(session)})
+
+
+@csrf_exempt  # Authenticated by X-Upload-Token
+def finalize_chunked_upload(request, upload_id):
+    """API endpoint handing a complete chunked upload to the ingest pipeline"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Invalid request method'}, status=405)
+    
+    session, error = authorized_upload_session(request, upload_id)
+    if error:
+        return error
+    data = {}
+    if request.content_type == 'application/json' and request.body:
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'success': False, 'message': 'Request body must be JSON'}, status=400)
+    target = CSVUpload.objects.filter(table_name=session.table_name).first()
+    if session.mode == IngestJob.MODE_CREATE and (
+            target or
+            IngestJob.objects.filter(table_name=session.table_name, status__in=IngestJob.ACTIVE_STATUSES).exists()):
+        return JsonResponse({
+            'success': False,
+            'message': f'Table "{session.table_name}" already exists. Please choose a different name.'
+        }, status=409)
+    if session.mode != IngestJob.MODE_CREATE and (target is None or not target.is_ready):
+        return JsonResponse({'success': False, 'message': f'Table "{session.table_name}" does not exist'}, status=404)
+    
+    background = getattr(settings, 'CSV_INGEST_BACKGROUND', True)
+    try:
+        # The assembled spool file becomes the ingest source as it is; nothing is copied
+        session = finalize_upload(
+            upload_id, checksum=data.get('sha256') if isinstance(data, dict) else None, enqueue=background
+        )
+    except ChunkRejected as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=e.status)
+    
+    if background:
+        return JsonResponse({
+            'success': True,
+            **upload_progress(session),
+            'progress_url': reverse('csv_upload:ingest_job_progress', args=[session.ingest_job_id]),
+        }, status=202)
+    
+    try:
+        with open(session.spool_path, 'rb') as source:
+            if target and session.mode != IngestJob.MODE_CREATE:
+                pipeline = MergePipeline(source, target, session.mode, filename=session.filename)
+            else:
+                pipeline = IngestPipeline(
+                    source, session.table_name, filename=session.filename, storage_engine=session.storage_engine,
+                    content_hash=session.content_hash
+                )
+            csv_upload, load_stats = pipeline.run()
+    except Exception as e:
+        return JsonResponse({'success': False, 'message': f'Error processing CSV file: {str(e)}'}, status=400)
+    finally:
+        os.remove(session.spool_path)
+    
+    return JsonResponse({
+        'success': True,
+        **upload_progress(session),
+        'table_id': csv_upload.id,
+        'rows_loaded': load_stats.rows,
+        'rows_inserted': getattr(pipeline, 'rows_inserted', load_stats.rows),
+        'rows_updated': getattr(pipeline, 'rows_updated', 0),
+        'view_url': reverse('csv_upload:view_table', args=[csv_upload.id]),
+    }, status=201)
+
+
+def ingest_job_progress(request, job_id):
+    """API endpoint reporting progress of a background ingest job"""
+    ingest_job = get_object_or_404(IngestJob, id=job_id)
+    progress = job_progress(ingest_job)
+    if ingest_job.csv_upload_id:
+        progress['view_url'] = reverse('csv_upload:view_table', args=[ingest_job.csv_upload_id])
+    
+    return JsonResponse({'success': True, **progress})
+
+
 def edit_table(request, table_id):
     """Edit table view with rename functionality"""
-    csv_upload = get_object_or_404(CSVUpload, id=table_id)
+    csv_upload = get_object_or_404(CSVUpload.objects.ready(), id=table_id)
     rename_form = RenameTableForm(current_table_id=table_id)
     
     if request.method == 'POST':
@@ -385,18 +561,23 @@ def edit_table(request, table_id):
                 new_name = rename_form.cleaned_data['new_table_name']
                 old_name = csv_upload.table_name
                 csv_upload.table_name = new_name
-                csv_upload.save()
+                csv_upload.save(update_fields=['table_name'])
+                csv_upload.bump_data_version(source_changed=False)
                 
                 messages.success(request, f'Table renamed from "{old_name}" to "{new_name}" successfully!')
                 return redirect('csv_upload:edit_table', table_id=table_id)
     
     # Prepare column data with properties for template
     columns_with_properties = []
+    # Profiles were collected at ingest time, so no CSVData scan is needed here
+    column_stats = csv_upload.get_column_stats()
     for column_name in csv_upload.get_column_names():
         properties = csv_upload.get_column_properties(column_name)
+        profile = column_stats.get(column_name)
         columns_with_properties.append({
             'name': column_name,
-            'properties': properties
+            'properties': properties,
+            'stats': summarize(profile, properties.get('data_type')) if profile else None,
         })
     
     context = {
@@ -410,7 +591,7 @@ def edit_table(request, table_id):
 
 def configure_column(request, table_id, column_name):
     """Configure column properties view"""
-    csv_upload = get_object_or_404(CSVUpload, id=table_id)
+    csv_upload = get_object_or_404(CSVUpload.objects.ready(), id=table_id)
     
     # Get existing properties for this column
     existing_properties = csv_upload.get_column_properties(column_name)
@@ -425,11 +606,23 @@ def configure_column(request, table_id, column_name):
         if form.is_valid():
             # Save the column properties
             properties = form.get_column_properties()
+            if 'type_inference' in existing_properties:
+                # Keep what ingest inferred next to the configured type
+                properties['type_inference'] = existing_properties['type_inference']
             csv_upload.set_column_properties(column_name, properties)
-            csv_upload.save()
-            
-            messages.success(request, f'Column "{column_name}" properties updated successfully!')
-            return redirect('csv_upload:edit_table', table_id=table_id)
+            try:
+                with transaction.atomic():
+                    csv_upload.save(update_fields=['columns'])
+                    if csv_upload.uses_typed_table():
+                        # Regenerate the table DDL; only a column whose type changed is cast
+                        type_changed = properties['data_type'] != existing_properties.get('data_type', 'TEXT')
+                        rebuild_typed_table(csv_upload, [column_name] if type_changed else [])
+                    csv_upload.bump_data_version()
+            except Exception as e:
+                messages.error(request, f'Could not apply properties to column "{column_name}": {str(e)}')
+            else:
+                messages.success(request, f'Column "{column_name}" properties updated successfully!')
+                return redirect('csv_upload:edit_table', table_id=table_id)
     else:
         form = ColumnPropertiesForm(
             column_name=column_name,
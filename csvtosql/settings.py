@@ -135,3 +135,60 @@ X_FRAME_OPTIONS = 'DENY'
 
 # Additional security headers for Firefox compatibility
 SECURE_REFERRER_POLICY = 'same-origin'
+
+# Django's default upload handlers, extended to record each file's SHA-256 for deduplicating repeated uploads
+FILE_UPLOAD_HANDLERS = [
+    'csv_upload.upload_handlers.HashingMemoryFileUploadHandler',
+    'csv_upload.upload_handlers.HashingTemporaryFileUploadHandler',
+]
+
+# CSV ingest settings
+# Processes that parse and load one large CSV file in the ingest worker (PostgreSQL only); 1 loads sequentially
+CSV_INGEST_WORKERS = 1
+# Smallest CSV file split across CSV_INGEST_WORKERS processes; smaller files do not repay starting them
+CSV_PARALLEL_INGEST_MIN_BYTES = 64 * 1024 * 1024
+# Rows per COPY chunk / bulk_create batch when loading CSVData
+CSV_INGEST_BATCH_SIZE = 5000
+# Approximate peak memory (bytes) for one parsed CSV chunk during ingest
+CSV_INGEST_MEMORY_BUDGET = 64 * 1024 * 1024
+# Queue uploads for `manage.py run_ingest_worker` instead of loading them in the request
+CSV_INGEST_BACKGROUND = True
+# Where queued uploads wait for a worker; must be shared by web and worker hosts
+CSV_INGEST_SPOOL_DIR = BASE_DIR / 'spool'
+# Chunk size suggested to clients of the resumable upload API (api/upload/)
+CSV_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Largest chunk one PUT may carry; chunks are streamed to the spool file, never held in memory
+CSV_UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# Seconds an unfinished chunked upload may sit idle before the ingest worker deletes it
+CSV_UPLOAD_SESSION_EXPIRY = 24 * 60 * 60
+# Rows read before column types are inferred (later chunks can still widen a type)
+CSV_INFERENCE_SAMPLE_ROWS = 1000
+# Share of sampled values that must parse as a type for a column to get it; 1.0 means all
+CSV_INFERENCE_MIN_CONFIDENCE = 1.0
+# Rows of a synchronous upload shown on the upload page (taken from the parsed chunks, not re-queried)
+CSV_UPLOAD_PREVIEW_ROWS = 20
+# Default storage for new uploads: 'json' (CSVData rows) or 'table' (one typed SQL table per upload)
+CSV_STORAGE_ENGINE = 'json'
+
+# Table result cache
+# In-process LRU by default; point CSV_TABLE_CACHE_ALIAS at a shared backend (e.g. Redis) for multi-process deployments
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'csv-table-cache',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    }
+}
+CSV_TABLE_CACHE_ALIAS = 'default'
+# Seconds a cached result page is kept
+CSV_TABLE_CACHE_TIMEOUT = 300
+# Most cell edits accepted by one api/table/<id>/patch/ request
+CSV_PATCH_MAX_EDITS = 10000
+# Rows fetched per server-side cursor round trip when streaming an export
+CSV_EXPORT_CHUNK_SIZE = 2000
+# Rows per multi-row INSERT in SQL exports
+CSV_EXPORT_INSERT_BATCH_SIZE = 500
+# Rows per row group in Parquet exports (needs the optional pyarrow package)
+CSV_EXPORT_ROW_GROUP_SIZE = 50000
+# Rows removed per DELETE when a table is deleted on backends without CSVData partitions (PostgreSQL drops the partition)
+CSV_DELETE_BATCH_SIZE = 10000